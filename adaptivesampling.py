@@ -0,0 +1,138 @@
+import numpy as np
+
+"""
+Order the viewpoints of a path raster along the path. The walk starts at an end of the path (a viewpoint with at most
+one neighbour) and continues to an unvisited neighbouring viewpoint. If there is none, e.g. at a branch or a gap, it
+jumps to the nearest unvisited viewpoint.
+
+:param viewpoints: array of viewpoints (see ElevationMap.viewpoint_dtype)
+:returns: array of viewpoints in the order along the path
+"""
+
+
+def order_path(viewpoints):
+    if len(viewpoints) < 3:
+        return viewpoints.copy()
+    viewpoint_y = viewpoints["y"].astype(np.int64)
+    viewpoint_x = viewpoints["x"].astype(np.int64)
+    positions = dict(((y, x), i) for i, (y, x) in enumerate(zip(viewpoint_y.tolist(), viewpoint_x.tolist())))
+    neighbours = [(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dy or dx]
+
+    def get_neighbours(i):
+        y = int(viewpoint_y[i])
+        x = int(viewpoint_x[i])
+        return [positions[(y + dy, x + dx)] for dy, dx in neighbours if (y + dy, x + dx) in positions]
+
+    ends = [i for i in range(len(viewpoints)) if len(get_neighbours(i)) <= 1]
+    current = ends[0] if ends else 0
+    visited = np.zeros(len(viewpoints), bool)
+    order = []
+    while True:
+        visited[current] = True
+        order.append(current)
+        if len(order) == len(viewpoints):
+            break
+        unvisited = [i for i in get_neighbours(current) if not visited[i]]
+        if unvisited:
+            # prefer the straight neighbours, so diagonal shortcuts do not skip cells of the path
+            current = min(unvisited, key=lambda i: abs(viewpoint_y[i] - viewpoint_y[current])
+                          + abs(viewpoint_x[i] - viewpoint_x[current]))
+        else:
+            distances = np.maximum(np.abs(viewpoint_y - viewpoint_y[current]),
+                                   np.abs(viewpoint_x - viewpoint_x[current])).astype("d")
+            distances[visited] = np.inf
+            current = int(np.argmin(distances))
+    return viewpoints[np.array(order)]
+
+
+"""
+Measure how much the viewsheds of two viewpoints differ. The visual magnitude is dominated by the cells close to a
+viewpoint, which differ even between neighbouring viewpoints, so only the sets of the visible cells are compared.
+
+:param first: flat indices of the visible cells and their visual magnitudes of the first viewpoint
+:param second: flat indices of the visible cells and their visual magnitudes of the second viewpoint
+:returns: share of the cells visible from either viewpoint which are not visible from both (Jaccard distance)
+"""
+
+
+def get_viewshed_difference(first, second):
+    seen = len(np.union1d(first[0], second[0]))
+    if not seen:
+        return 0.0
+    return 1 - len(np.intersect1d(first[0], second[0])) / float(seen)
+
+
+"""
+Distribute the weights of all viewpoints of the path among the sampled ones. Every viewpoint passes its weight to the
+nearest sample along the path, a viewpoint halfway between two samples splits it evenly.
+
+:param viewpoints: array of viewpoints in the order along the path
+:param samples: sorted array of positions of the sampled viewpoints in the path
+:returns: array of the sampled viewpoints with the new weights
+"""
+
+
+def reweight_samples(viewpoints, samples):
+    positions = np.arange(len(viewpoints))
+    right = np.minimum(np.searchsorted(samples, positions), len(samples) - 1)
+    left = np.maximum(np.where(samples[right] > positions, right - 1, right), 0)
+    left_distance = np.abs(positions - samples[left])
+    right_distance = np.abs(samples[right] - positions)
+    left_share = np.where(left_distance < right_distance, 1.0, np.where(left_distance > right_distance, 0.0, 0.5))
+
+    weights = np.zeros(len(samples))
+    np.add.at(weights, left, viewpoints["weight"] * left_share)
+    np.add.at(weights, right, viewpoints["weight"] * (1 - left_share))
+    sampled = viewpoints[samples].copy()
+    sampled["weight"] = weights
+    return sampled
+
+
+"""
+Select viewpoints of a path adaptively. The path is sampled sparsely first, then in rounds the viewpoints halfway
+between two consecutive samples are added wherever the viewsheds of the samples differ by more than the tolerance
+(see get_viewshed_difference). The weights of the skipped viewpoints are moved to the nearest samples, so the total
+weight of the path is kept. The visual magnitude of a skipped viewpoint is approximated by the one of its sample, with a
+loose tolerance its sum may differ from the sum of the whole path by several percent, with zero tolerance every
+viewpoint is sampled.
+
+Every round is calculated by the workforce, which must use a cache (see ResultCache), the contributions of the samples
+are compared through the cache. Calculating the returned viewpoints afterwards only loads them from the cache.
+
+:param workforce: VisualMagWorkforce instance with a cache directory
+:param viewpoints: array of viewpoints (see ElevationMap.viewpoint_dtype)
+:param tolerance: (optional) allowed difference of the viewsheds of consecutive samples
+:param initial_step: (optional) number of viewpoints between the samples of the first round
+:param max_rounds: (optional) maximal number of rounds, unlimited by default
+:returns: array of the sampled viewpoints with the new weights
+"""
+
+
+def sample_path(workforce, viewpoints, tolerance=0.1, initial_step=16, max_rounds=None):
+    if workforce.cache is None:
+        raise ValueError("Adaptive sampling requires a workforce with a cache directory")
+    if not len(viewpoints):
+        return viewpoints.copy()
+    viewpoints = order_path(viewpoints)
+    samples = np.unique(np.append(np.arange(0, len(viewpoints), max(initial_step, 1)), len(viewpoints) - 1))
+    new_samples = samples
+    rounds = 0
+    while len(new_samples):
+        workforce.add_tasks(viewpoints[new_samples])
+        workforce.start_workers()
+        workforce.get_result()
+        workforce.wait_to_finish()
+        rounds += 1
+        if max_rounds is not None and rounds >= max_rounds:
+            break
+
+        new_samples = []
+        previous = workforce.cache.load(int(viewpoints[samples[0]]["y"]), int(viewpoints[samples[0]]["x"]))
+        for start, end in zip(samples[:-1].tolist(), samples[1:].tolist()):
+            current = workforce.cache.load(int(viewpoints[end]["y"]), int(viewpoints[end]["x"]))
+            if end - start > 1 and get_viewshed_difference(previous, current) > tolerance:
+                new_samples.append((start + end) // 2)
+            previous = current
+        new_samples = np.array(new_samples, dtype=np.intp)
+        samples = np.union1d(samples, new_samples)
+    return reweight_samples(viewpoints, samples)
@@ -0,0 +1,128 @@
+import time
+
+import numpy as np
+
+from elevationmap import ElevationMap
+from visualmag_workforce import ENGINES, PRECISIONS
+from xdrawengine import MultiResolutionEngine, VectorizedEngine
+
+"""
+Compare two visual magnitude rasters.
+
+:param exact: visual magnitude calculated exactly
+:param approximate: visual magnitude calculated approximately
+:returns: dictionary of error measures
+"""
+
+
+def get_approximation_error(exact, approximate):
+    exact_total = float(np.sum(exact))
+    difference = np.abs(approximate - exact)
+    exact_visible = exact > 0
+    approximate_visible = approximate > 0
+    seen = float(np.count_nonzero(exact_visible | approximate_visible))
+    return {
+        "exact_total": exact_total,
+        "approximate_total": float(np.sum(approximate)),
+        "relative_total_error": abs(float(np.sum(approximate)) - exact_total) / exact_total if exact_total else 0.0,
+        "relative_l1_error": float(np.sum(difference)) / exact_total if exact_total else 0.0,
+        "max_abs_error": float(np.max(difference)) if difference.size else 0.0,
+        "rmse": float(np.sqrt(np.mean(difference * difference))) if difference.size else 0.0,
+        # share of the cells seen by either mode which are seen by both
+        "visibility_agreement": float(np.count_nonzero(exact_visible & approximate_visible)) / seen if seen else 1.0
+    }
+
+
+"""
+Solve the viewpoints both exactly and in the approximate mode in this process and compare the results. A sample of the
+viewpoints is enough to estimate the error of a whole run.
+
+:param elevation_map_obj: ElevationMap instance, the terrain derivatives and the pyramid are calculated if missing
+:param viewpoints: array of viewpoints (see ElevationMap.viewpoint_dtype)
+:param cell_resolution: resolution of a cell
+:param origin_offset: elevation offset for the viewpoints
+:param band_distances: distances where the bands solved on the coarse levels begin (see MultiResolutionEngine)
+:param omitted_rings: (optional) rings around a viewpoint not included in the visual magnitude
+:param max_distance: (optional) distance from a viewpoint beyond which the cells are not solved
+:returns: dictionary of error measures (see get_approximation_error) with the times of both modes and the speedup
+"""
+
+
+def compare_with_exact(elevation_map_obj, viewpoints, cell_resolution, origin_offset, band_distances, omitted_rings=0,
+                       max_distance=None):
+    elevation_map_obj.compute_terrain_derivatives(cell_resolution)
+    if len(elevation_map_obj.pyramid) < len(band_distances):
+        elevation_map_obj.build_pyramid(len(band_distances), cell_resolution)
+    elevation_map = elevation_map_obj.get_map()
+    normal_map = elevation_map_obj.get_normals()
+    levels = [elevation_map_obj.get_pyramid_level(level) for level in range(1, len(band_distances) + 1)]
+
+    engines = {
+        "exact": VectorizedEngine(elevation_map, cell_resolution, omitted_rings, max_distance, normal_map),
+        "approximate": MultiResolutionEngine(elevation_map, cell_resolution, omitted_rings, max_distance, normal_map,
+                                             None, levels, band_distances)
+    }
+    rasters = {}
+    times = {}
+    for name, engine in engines.items():
+        visual_magnitude = np.zeros(elevation_map.shape).reshape(-1)
+        start_time = time.time()
+        for origin_y, origin_x, origin_weight in viewpoints.tolist():
+            visible_y, visible_x, magnitudes = engine.solve(origin_y, origin_x,
+                                                            float(elevation_map[origin_y, origin_x]) + origin_offset)
+            np.add.at(visual_magnitude, np.ravel_multi_index((visible_y, visible_x), elevation_map.shape),
+                      magnitudes * origin_weight)
+        times[name] = time.time() - start_time
+        rasters[name] = visual_magnitude.reshape(elevation_map.shape)
+
+    report = get_approximation_error(rasters["exact"], rasters["approximate"])
+    report["viewpoints"] = len(viewpoints)
+    report["exact_time"] = times["exact"]
+    report["approximate_time"] = times["approximate"]
+    report["speedup"] = times["exact"] / times["approximate"] if times["approximate"] else None
+    return report
+
+
+"""
+Solve the viewpoints in double and in single precision in this process and compare the results. The map, its normals,
+the LOS buffers and the accumulated visual magnitude use the dtype of the precision, as in VisualMagWorkforce.
+
+:param map_array: numpy array which contains elevation data
+:param viewpoints: array of viewpoints (see ElevationMap.viewpoint_dtype)
+:param cell_resolution: resolution of a cell
+:param origin_offset: elevation offset for the viewpoints
+:param omitted_rings: (optional) rings around a viewpoint not included in the visual magnitude
+:param max_distance: (optional) distance from a viewpoint beyond which the cells are not solved
+:param engine: (optional) name of the engine which solves the viewpoints (see ENGINES)
+:returns: dictionary of error measures (see get_approximation_error, the single precision result is the approximate
+one) with the times and the memory of the rasters in both precisions
+"""
+
+
+def compare_precision(map_array, viewpoints, cell_resolution, origin_offset, omitted_rings=0, max_distance=None,
+                      engine="vectorized"):
+    rasters = {}
+    report = {"viewpoints": len(viewpoints)}
+    for precision in ("double", "single"):
+        dtype = PRECISIONS[precision]
+        elevation_map_obj = ElevationMap()
+        elevation_map_obj.set_map(map_array.astype(dtype) if map_array.dtype.kind == "f" else map_array)
+        elevation_map_obj.compute_terrain_derivatives(cell_resolution, dtype=dtype)
+        elevation_map = elevation_map_obj.get_map()
+        normal_map = elevation_map_obj.get_normals()
+        solver = ENGINES[engine](elevation_map, cell_resolution, omitted_rings, max_distance, normal_map, None, dtype)
+
+        visual_magnitude = np.zeros(elevation_map.shape, dtype).reshape(-1)
+        start_time = time.time()
+        for origin_y, origin_x, origin_weight in viewpoints.tolist():
+            visible_y, visible_x, magnitudes = solver.solve(origin_y, origin_x,
+                                                            float(elevation_map[origin_y, origin_x]) + origin_offset)
+            np.add.at(visual_magnitude, np.ravel_multi_index((visible_y, visible_x), elevation_map.shape),
+                      (magnitudes * origin_weight).astype(dtype))
+        report["{}_time".format(precision)] = time.time() - start_time
+        # the rasters held by every worker and the sumator
+        report["{}_raster_bytes".format(precision)] = elevation_map.nbytes + normal_map.nbytes + visual_magnitude.nbytes
+        rasters[precision] = visual_magnitude.reshape(elevation_map.shape).astype("d")
+
+    report.update(get_approximation_error(rasters["double"], rasters["single"]))
+    return report
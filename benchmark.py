@@ -0,0 +1,372 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from multiprocessing import freeze_support
+
+import numpy as np
+
+from elevationmap import ElevationMap
+from visualmag_workforce import PRECISIONS, VisualMagWorkforce
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak RSS of the main process is then not reported
+    resource = None
+
+BUNDLED_DEM = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testData", "mhkdem.tif")
+SYNTHETIC_TERRAINS = ("flat", "ridge", "fractal")
+
+"""
+Generate a synthetic elevation map. The flat terrain is the cheapest case (everything is visible), the ridge splits the
+map into two halves hidden from each other and the fractal terrain resembles a natural landscape.
+
+:param terrain: kind of the terrain (flat, ridge or fractal)
+:param size: height and width of the map
+:param seed: (optional) seed of the random generator used by the fractal terrain
+:returns: float32 numpy array of elevations in metres
+"""
+
+
+def make_terrain(terrain, size, seed=0):
+    if terrain == "flat":
+        return np.full((size, size), 100, np.float32)
+    if terrain == "ridge":
+        x = np.arange(size) - (size - 1) / 2.0
+        profile = 100 + 300 * np.maximum(0, 1 - np.abs(x) / (size / 8.0))
+        return np.tile(profile, (size, 1)).astype(np.float32)
+    if terrain == "fractal":
+        # spectral synthesis, the amplitudes of the white noise fall off with the frequency like in natural terrain
+        random = np.random.RandomState(seed)
+        frequency_y = np.fft.fftfreq(size)[:, np.newaxis]
+        frequency_x = np.fft.rfftfreq(size)[np.newaxis, :]
+        frequency = np.hypot(frequency_y, frequency_x)
+        frequency[0, 0] = 1
+        spectrum = np.fft.rfft2(random.normal(size=(size, size))) / frequency ** 1.1
+        spectrum[0, 0] = 0
+        terrain = np.fft.irfft2(spectrum, (size, size))
+        terrain -= terrain.min()
+        return (500 * terrain / terrain.max()).astype(np.float32)
+    raise ValueError("Unknown terrain '{}', choose one of: {}".format(terrain, ", ".join(SYNTHETIC_TERRAINS)))
+
+
+"""
+Pick viewpoints uniformly at random from the map, each with weight 1.
+
+:param shape: shape of the elevation map
+:param count: number of viewpoints
+:param seed: (optional) seed of the random generator
+:returns: array of viewpoints (see ElevationMap.viewpoint_dtype)
+"""
+
+
+def make_viewpoints(shape, count, seed=0):
+    cells = np.random.RandomState(seed).choice(shape[0] * shape[1], min(count, shape[0] * shape[1]), replace=False)
+    viewpoints = np.empty(len(cells), ElevationMap.viewpoint_dtype)
+    viewpoints["y"], viewpoints["x"] = np.unravel_index(np.sort(cells), shape)
+    viewpoints["weight"] = 1
+    return viewpoints
+
+
+"""
+Count the cells the engines evaluate for the viewpoints, i.e. the cells of the window of every viewpoint except the
+omitted ones.
+
+:param viewpoints: array of viewpoints (see ElevationMap.viewpoint_dtype)
+:param shape: shape of the elevation map
+:param omitted_rings: number of rings around a viewpoint which are not evaluated
+:param max_distance: (optional) distance from a viewpoint beyond which the cells are not evaluated
+:returns: number of evaluated cells
+"""
+
+
+def count_evaluated_cells(viewpoints, shape, omitted_rings, max_distance=None):
+    def window_cells(distance):
+        y = viewpoints["y"].astype(np.int64)
+        x = viewpoints["x"].astype(np.int64)
+        return ((np.minimum(y + distance + 1, shape[0]) - np.maximum(y - distance, 0))
+                * (np.minimum(x + distance + 1, shape[1]) - np.maximum(x - distance, 0)))
+
+    distance = max(shape) if max_distance is None else max_distance
+    return int(np.sum(window_cells(distance) - window_cells(omitted_rings)))
+
+
+"""
+Read the peak resident set size of a process from /proc. Only available on Linux.
+
+:param pid: id of the process
+:returns: peak RSS in kB, None if it cannot be read
+"""
+
+
+def read_peak_rss(pid):
+    try:
+        with open("/proc/{}/status".format(pid)) as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+class PeakRssMonitor:
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.processes = {}
+        self.peaks = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.__sample)
+        self.thread.daemon = True
+
+    """
+    Start sampling the peak RSS of the processes. The processes are sampled until they exit, the last sample before
+    the exit is kept.
+
+    :param processes: dictionary of multiprocessing.Process instances keyed by their name
+    """
+
+    def start(self, processes):
+        self.processes = processes
+        self.thread.start()
+
+    """
+    Stop sampling.
+
+    :returns: dictionary of peak RSS in kB keyed by the process name, the main process is included as "main"
+    """
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        peaks = dict(self.peaks)
+        if resource is not None:
+            # ru_maxrss is in kB on Linux but in bytes on macOS
+            scale = 1024 if sys.platform == "darwin" else 1
+            peaks["main"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale
+        return peaks
+
+    def __sample(self):
+        while not self.stopped.is_set():
+            for name, process in self.processes.items():
+                peak = read_peak_rss(process.pid)
+                if peak is not None:
+                    self.peaks[name] = max(peak, self.peaks.get(name, 0))
+            self.stopped.wait(self.interval)
+
+
+"""
+Run the whole pipeline once and measure it. The stages are: terrain derivatives, workforce setup (sharing the rasters
+and building the geometry table), scheduling and starting the processes, the computation until the sumator returns
+the result, and joining the workers.
+
+:param name: name of the elevation map
+:param map_array: numpy array which contains elevation data
+:param viewpoint_count: number of random viewpoints
+:param num_workers: number of worker processes
+:param max_distance: distance from a viewpoint beyond which the cells are not solved, None for the whole map
+:param args: parsed command line arguments
+:returns: dictionary with the configuration and the measurements
+"""
+
+
+def run_benchmark(name, map_array, viewpoint_count, num_workers, max_distance, args):
+    viewpoints = make_viewpoints(map_array.shape, viewpoint_count, args.seed)
+    elevation_map = ElevationMap()
+    elevation_map.set_map(map_array)
+    stages = {}
+
+    start_time = time.time()
+    elevation_map.compute_terrain_derivatives(args.cell_resolution,
+                                              dtype=VisualMagWorkforce.get_normals_dtype(map_array, args.precision))
+    stages["derivatives"] = time.time() - start_time
+
+    start_time = time.time()
+    workforce = VisualMagWorkforce(elevation_map, args.cell_resolution, args.origin_offset, num_workers,
+                                   args.omitted_rings, args.engine, max_distance=max_distance,
+                                   chunk_size=args.chunk_size, precision=args.precision)
+    workforce.add_tasks(viewpoints)
+    stages["setup"] = time.time() - start_time
+
+    monitor = PeakRssMonitor()
+    start_time = time.time()
+    workforce.start_workers()
+    stages["start"] = time.time() - start_time
+
+    processes = dict(("worker{}".format(i), process) for i, process in enumerate(workforce.processes))
+    processes["sumator"] = workforce.sumator_process
+    monitor.start(processes)
+    start_time = time.time()
+    result = workforce.get_result()
+    stages["compute"] = time.time() - start_time
+
+    start_time = time.time()
+    workforce.wait_to_finish()
+    workforce.sumator_process.join()
+    stages["join"] = time.time() - start_time
+    peak_rss = monitor.stop()
+
+    elapsed = sum(stages.values())
+    cells = count_evaluated_cells(viewpoints, map_array.shape, args.omitted_rings, max_distance)
+    return {
+        "dem": name,
+        "shape": list(map_array.shape),
+        "viewpoints": len(viewpoints),
+        "workers": num_workers,
+        "radius": max_distance,
+        "engine": args.engine,
+        "precision": args.precision,
+        "stages": stages,
+        "elapsed": elapsed,
+        "viewpoints_per_second": len(viewpoints) / stages["compute"],
+        "cells": cells,
+        "cells_per_second": cells / stages["compute"],
+        "peak_rss_kb": peak_rss,
+        "metrics": workforce.get_stats().to_dict(),
+        "checksum": float(np.sum(result))
+    }
+
+
+"""
+Identify the configuration of a result, so results of different runs can be matched.
+
+:param result: dictionary returned by run_benchmark
+:returns: hashable key
+"""
+
+
+def get_configuration(result):
+    # results written before the precision modes were added are in double precision
+    return result["dem"], tuple(result["shape"]), result["viewpoints"], result["workers"], result["radius"], \
+        result["engine"], result.get("precision", "double")
+
+
+"""
+Compare the results with a baseline. A configuration regressed if its throughput dropped below (1 - tolerance) of the
+baseline, and it changed if the checksum of its raster differs.
+
+:param results: list of dictionaries returned by run_benchmark
+:param baseline: list of results of the baseline run
+:param tolerance: allowed relative slowdown
+:returns: list of comparison dictionaries for the configurations present in both runs
+"""
+
+
+def compare_results(results, baseline, tolerance):
+    baseline = dict((get_configuration(result), result) for result in baseline)
+    comparisons = []
+    for result in results:
+        reference = baseline.get(get_configuration(result))
+        if reference is None:
+            continue
+        speedup = result["viewpoints_per_second"] / reference["viewpoints_per_second"]
+        comparisons.append({
+            "configuration": list(get_configuration(result)),
+            "speedup": speedup,
+            "regressed": speedup < 1 - tolerance,
+            "checksum_changed": not np.isclose(result["checksum"], reference["checksum"], rtol=1e-6)
+        })
+    return comparisons
+
+
+def format_radius(radius):
+    return "full" if radius is None else str(radius)
+
+
+def parse_radius(value):
+    return None if value == "full" else int(value)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the visual magnitude pipeline end to end.")
+    parser.add_argument("--terrains", nargs="+", default=["bundled"] + list(SYNTHETIC_TERRAINS),
+                        help="bundled (testData/mhkdem.tif) and/or synthetic terrains: "
+                             + ", ".join(SYNTHETIC_TERRAINS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[128, 256, 512],
+                        help="sizes of the synthetic terrains")
+    parser.add_argument("--viewpoints", nargs="+", type=int, default=[16, 64], help="numbers of viewpoints")
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 4], help="numbers of worker processes")
+    parser.add_argument("--radius", nargs="+", type=parse_radius, default=[None, 100],
+                        help="maximal distances from the viewpoints, 'full' for the whole map")
+    parser.add_argument("--engine", default="vectorized")
+    parser.add_argument("--precision", choices=sorted(PRECISIONS), default="double")
+    parser.add_argument("--cell-resolution", type=float, default=31)
+    parser.add_argument("--origin-offset", type=float, default=1.8)
+    parser.add_argument("--omitted-rings", type=int, default=0)
+    parser.add_argument("--chunk-size", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=1, help="runs of every configuration, the fastest is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare the results with this JSON file written by --output")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="relative slowdown against the baseline reported as a regression")
+    return parser.parse_args()
+
+
+"""
+Yield the elevation maps to be benchmarked.
+
+:param args: parsed command line arguments
+:returns: generator of (name, map_array) tuples
+"""
+
+
+def get_terrains(args):
+    for terrain in args.terrains:
+        if terrain == "bundled":
+            elevation_map = ElevationMap()
+            elevation_map.read_map_file(BUNDLED_DEM)
+            yield "mhkdem", elevation_map.get_map()
+        else:
+            for size in args.sizes:
+                yield terrain, make_terrain(terrain, size, args.seed)
+
+
+def main():
+    args = parse_arguments()
+    results = []
+    for name, map_array in get_terrains(args):
+        for viewpoint_count in args.viewpoints:
+            for num_workers in args.workers:
+                for max_distance in args.radius:
+                    runs = [run_benchmark(name, map_array, viewpoint_count, num_workers, max_distance, args)
+                            for i in range(args.repeat)]
+                    results.append(min(runs, key=lambda run: run["elapsed"]))
+
+    print("{:<8} {:>10} {:>6} {:>3} {:>6} {:>9} {:>9} {:>12} {:>12}".format(
+        "dem", "shape", "vps", "wrk", "radius", "setup s", "compute s", "vp/s", "cells/s"))
+    for result in results:
+        print("{:<8} {:>10} {:>6} {:>3} {:>6} {:>9.3f} {:>9.3f} {:>12.1f} {:>12.0f}".format(
+            result["dem"], "x".join(str(size) for size in result["shape"]), result["viewpoints"], result["workers"],
+            format_radius(result["radius"]), result["stages"]["derivatives"] + result["stages"]["setup"],
+            result["stages"]["compute"], result["viewpoints_per_second"], result["cells_per_second"]))
+
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            comparisons = compare_results(results, json.load(baseline)["results"], args.tolerance)
+        for comparison in comparisons:
+            print("{} speedup {:.2f}{}{}".format(
+                " ".join(format_radius(item) if item is None else str(item) for item in comparison["configuration"]),
+                comparison["speedup"], " REGRESSED" if comparison["regressed"] else "",
+                " CHECKSUM CHANGED" if comparison["checksum_changed"] else ""))
+        if any(comparison["regressed"] for comparison in comparisons):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    freeze_support()
+    main()
@@ -0,0 +1,191 @@
+import collections
+import hashlib
+import os
+import time
+
+import numpy as np
+
+from elevationmap import ElevationMap
+
+# replace a file atomically, os.rename does the same on POSIX in Python 2 which has no os.replace
+replace_file = getattr(os, "replace", os.rename)
+
+
+class Checkpoint:
+    def __init__(self, filename, key, interval=600):
+        self.filename = filename
+        self.key = key
+        self.interval = interval
+        self.last_saved = time.time()
+        # set when the run continues from the saved state
+        self.resume = False
+        # a memory-mapped raster is saved in place, the journal of the changes since the last save (see record) is
+        # numbered by the saves
+        self.generation = 0
+        self.journal = None
+
+    """
+    Calculate a key identifying a run. A checkpoint can only be resumed by a run with the same elevation map,
+    parameters and viewpoints.
+
+    :param result_key: key of the map and the parameters (see ResultCache.get_key)
+    :param viewpoints: array of all viewpoints of the run (see ElevationMap.viewpoint_dtype)
+    :returns: hexadecimal key
+    """
+
+    @staticmethod
+    def get_key(result_key, viewpoints):
+        key = hashlib.sha1(result_key.encode("ascii"))
+        key.update(np.ascontiguousarray(np.sort(viewpoints.astype(ElevationMap.viewpoint_dtype))).tobytes())
+        return key.hexdigest()
+
+    """
+    Find out whether the checkpoint file exists and belongs to this run.
+
+    :returns: True if the run can be resumed from the checkpoint
+    """
+
+    def exists(self):
+        if not os.path.isfile(self.filename):
+            return False
+        with np.load(self.filename) as checkpoint:
+            if "raster" in checkpoint and not os.path.isfile(str(checkpoint["raster"])):
+                return False
+            return str(checkpoint["key"]) == self.key
+
+    """
+    Get the memory-mapped raster the checkpoint was saved in place of.
+
+    :returns: absolute path of the .npy file or None if the raster is saved in the checkpoint
+    """
+
+    def get_raster_file(self):
+        with np.load(self.filename) as checkpoint:
+            return str(checkpoint["raster"]) if "raster" in checkpoint else None
+
+    """
+    Add the saved state of the run to the visual magnitude of a new run, which is zero or, if the raster is saved in
+    place, the very raster the checkpoint refers to. A raster saved in place is copied in blocks of rows if the new run
+    uses another file, and the changes made after the last save are undone from the journal.
+
+    :param visual_magnitude: visual magnitude of the run
+    :param block_rows: (optional) number of rows copied at once
+    :returns: array of the completed viewpoints
+    """
+
+    def restore(self, visual_magnitude, block_rows=1024):
+        with np.load(self.filename) as checkpoint:
+            completed = checkpoint["completed"]
+            if "raster" not in checkpoint:
+                visual_magnitude += checkpoint["visual_magnitude"]
+                return completed
+            raster_file = str(checkpoint["raster"])
+            self.generation = int(checkpoint["generation"])
+
+        if os.path.abspath(getattr(visual_magnitude, "filename", None) or "") != raster_file:
+            saved_magnitude = np.load(raster_file, mmap_mode="r")
+            for row in range(0, saved_magnitude.shape[-2], block_rows):
+                visual_magnitude[..., row:row + block_rows, :] += saved_magnitude[..., row:row + block_rows, :]
+        journal_file = self.get_journal_file(self.generation)
+        if os.path.isfile(journal_file):
+            flat_magnitude = visual_magnitude.reshape(-1)
+            for cells, values in reversed(Checkpoint.read_journal(journal_file)):
+                flat_magnitude[cells] = values
+        if isinstance(visual_magnitude, np.memmap):
+            visual_magnitude.flush()
+        return completed
+
+    def load_completed(self):
+        with np.load(self.filename) as checkpoint:
+            return checkpoint["completed"]
+
+    """
+    Save the state of the run. The file is written under a temporary name first, so a crash while saving leaves the
+    previous checkpoint intact.
+
+    :param visual_magnitude: partially accumulated visual magnitude
+    :param completed: array of the viewpoints whose visual magnitude is included
+    """
+
+    def save(self, visual_magnitude, completed):
+        temporary = "{}.{}.tmp".format(self.filename, os.getpid())
+        if isinstance(visual_magnitude, np.memmap) and visual_magnitude.filename is not None:
+            # the raster is flushed in place, the checkpoint refers to it and to the journal started now
+            visual_magnitude.flush()
+            with open(temporary, "wb") as output:
+                np.savez(output, key=np.array(self.key), completed=completed,
+                         raster=np.array(os.path.abspath(visual_magnitude.filename)),
+                         generation=self.generation + 1)
+            replace_file(temporary, self.filename)
+            self.close_journal()
+            if os.path.isfile(self.get_journal_file(self.generation)):
+                os.remove(self.get_journal_file(self.generation))
+            self.generation += 1
+        else:
+            with open(temporary, "wb") as output:
+                np.savez(output, key=np.array(self.key), visual_magnitude=visual_magnitude, completed=completed)
+            replace_file(temporary, self.filename)
+        self.last_saved = time.time()
+
+    """
+    Record the values of cells of a memory-mapped raster before they are changed. The raster may reach the disk at any
+    time, so the changes made after the last save are undone from the journal when the run is resumed.
+
+    :param flat_magnitude: flat view of the memory-mapped visual magnitude
+    :param cells: flat indices of the cells about to be changed
+    """
+
+    def record(self, flat_magnitude, cells):
+        if self.journal is None:
+            self.journal = open(self.get_journal_file(self.generation), "wb")
+        cells = np.unique(cells)
+        np.save(self.journal, cells)
+        np.save(self.journal, flat_magnitude[cells])
+        self.journal.flush()
+
+    def close_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def get_journal_file(self, generation):
+        return "{}.{}.journal".format(self.filename, generation)
+
+    """
+    Read the records of a journal. A record cut short by a crash was not applied to the raster and is skipped.
+
+    :param journal_file: path to the journal
+    :returns: list of (cells, values) tuples in the order they were recorded
+    """
+
+    @staticmethod
+    def read_journal(journal_file):
+        records = []
+        with open(journal_file, "rb") as journal:
+            while True:
+                try:
+                    records.append((np.load(journal), np.load(journal)))
+                except (IOError, OSError, ValueError, EOFError):
+                    return records
+
+    def is_due(self):
+        return time.time() - self.last_saved >= self.interval
+
+    """
+    Remove the completed viewpoints from the viewpoints of the run. A viewpoint present several times is removed as
+    many times as it was completed.
+
+    :param viewpoints: array of viewpoints (see ElevationMap.viewpoint_dtype)
+    :param completed: array of the completed viewpoints
+    :returns: array of the remaining viewpoints
+    """
+
+    @staticmethod
+    def get_remaining(viewpoints, completed):
+        completed = collections.Counter(completed.tolist())
+        remaining = np.ones(len(viewpoints), bool)
+        for i, viewpoint in enumerate(viewpoints.tolist()):
+            if completed[viewpoint] > 0:
+                completed[viewpoint] -= 1
+                remaining[i] = False
+        return viewpoints[remaining]
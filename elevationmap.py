@@ -1,24 +1,151 @@
+import math
+import os
+
 import cv2
 import numpy as np
 
+from sharedraster import SharedRaster
+
 
 class ElevationMap:
+    viewpoint_dtype = np.dtype([("y", np.intp), ("x", np.intp), ("weight", "d")])
+
     def __init__(self):
         self.loaded = False
         self.map = None
+        self.derivatives_resolution = None
+        self.normals = None
+        # coarser levels of the map and their normals, see build_pyramid
+        self.pyramid = []
+
+    """
+    Read the elevation map. A .npy file is memory-mapped, so only the parts of the map which are accessed are loaded
+    to memory (see convert_map_file). Other formats are loaded whole.
+    
+    :param filename: path to the elevation map
+    """
 
     def read_map_file(self, filename):
-        self.map = cv2.imread(filename, -1)
+        if filename.lower().endswith(".npy"):
+            self.map = np.load(filename, mmap_mode="r")
+        else:
+            self.map = cv2.imread(filename, -1)
+            if self.map is None:
+                raise IOError("Cannot read the elevation map {}".format(filename))
+        self.set_map(self.map)
+
+    """
+    Use an existing array as the elevation map, e.g. a generated terrain.
+    
+    :param map_array: numpy array which contains elevation data
+    """
+
+    def set_map(self, map_array):
+        self.map = map_array
         self.loaded = True
+        self.derivatives_resolution = None
+        self.normals = None
+        self.pyramid = []
+
+    """
+    Convert an elevation map to a .npy file which can be memory-mapped by read_map_file. The map is read in blocks of
+    rows through GDAL if it is installed, so the map does not need to fit into memory. Without GDAL the map is read
+    whole with OpenCV.
+    
+    :param source: path to the elevation map
+    :param destination: path to the .npy file
+    :param block_rows: (optional) number of rows read at once
+    """
+
+    @staticmethod
+    def convert_map_file(source, destination, block_rows=1024):
+        try:
+            from osgeo import gdal, gdal_array
+        except ImportError:
+            np.save(destination, cv2.imread(source, -1))
+            return
+
+        dataset = gdal.Open(source)
+        band = dataset.GetRasterBand(1)
+        dtype = gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType)
+        converted = np.lib.format.open_memmap(destination, "w+", dtype, (dataset.RasterYSize, dataset.RasterXSize))
+        for row in range(0, dataset.RasterYSize, block_rows):
+            rows = min(block_rows, dataset.RasterYSize - row)
+            converted[row:row + rows] = band.ReadAsArray(0, row, dataset.RasterXSize, rows)
+        converted.flush()
+
+    """
+    Write a raster, e.g. the visual magnitude. A .npy file is written with numpy, any other file as a GeoTIFF through
+    GDAL if it is installed, in blocks of rows and with the georeference of the reference raster if one is provided.
+    Without GDAL the raster is written whole with OpenCV and without georeference.
+    
+    :param filename: path to the written raster
+    :param raster: numpy array to be written
+    :param reference_filename: (optional) path to a raster whose georeference is copied, e.g. the elevation map
+    :param block_rows: (optional) number of rows written at once
+    """
+
+    @staticmethod
+    def write_raster(filename, raster, reference_filename=None, block_rows=1024):
+        if filename.lower().endswith(".npy"):
+            np.save(filename, raster)
+            return
+        try:
+            from osgeo import gdal, gdal_array
+        except ImportError:
+            if not cv2.imwrite(filename, np.asarray(raster)):
+                raise IOError("Cannot write the raster to {}".format(filename))
+            return
+
+        height, width = raster.shape
+        dataset = gdal.GetDriverByName("GTiff").Create(filename, width, height, 1,
+                                                       gdal_array.NumericTypeCodeToGDALTypeCode(raster.dtype))
+        reference = None if reference_filename is None else gdal.Open(reference_filename)
+        if reference is not None:
+            dataset.SetGeoTransform(reference.GetGeoTransform())
+            dataset.SetProjection(reference.GetProjection())
+        band = dataset.GetRasterBand(1)
+        for row in range(0, height, block_rows):
+            band.WriteArray(np.asarray(raster[row:row + block_rows]), 0, row)
+        dataset.FlushCache()
+
+    """
+    Write the rasters of a stack (e.g. the visual magnitude for several offsets of the viewpoints) to separate files.
+    The suffix of every raster is inserted before the extension of the filename, e.g. result_offset1.8.tif.
+
+    :param filename: path the paths of the written rasters are derived from
+    :param rasters: stack of rasters, the first axis selects the raster
+    :param suffixes: suffixes of the rasters
+    :param reference_filename: (optional) path to a raster whose georeference is copied, e.g. the elevation map
+    :returns: list of the paths of the written rasters
+    """
+
+    @staticmethod
+    def write_raster_stack(filename, rasters, suffixes, reference_filename=None):
+        root, extension = os.path.splitext(filename)
+        filenames = ["{}_{}{}".format(root, suffix, extension) for suffix in suffixes]
+        for raster_filename, raster in zip(filenames, rasters):
+            ElevationMap.write_raster(raster_filename, raster, reference_filename)
+        return filenames
+
+    """
+    Read the viewpoints from a raster. Every cell with a positive value is a viewpoint, the value is its weight.
+    
+    :param filename: path to the raster with the viewpoints
+    :returns: array of viewpoints with fields y, x and weight (see viewpoint_dtype) in row-major order
+    """
 
     def read_viewpoints(self, filename):
         path = cv2.imread(filename, -1)
-        viewpoints = []
-        for y in range(path.shape[0]):
-            for x in range(path.shape[1]):
-                if path[y][x] > 0:
-                    viewpoints.append([y, x, path[y][x]])
+        if path is None:
+            raise IOError("Cannot read the viewpoints {}".format(filename))
+        viewpoint_y, viewpoint_x = np.nonzero(path > 0)
+        viewpoints = np.empty(len(viewpoint_y), ElevationMap.viewpoint_dtype)
+        viewpoints["y"] = viewpoint_y
+        viewpoints["x"] = viewpoint_x
+        viewpoints["weight"] = path[viewpoint_y, viewpoint_x]
         return viewpoints
+
     """
     Generate rectangles around the specified coordinates. Specify the distance to be excluded from the results.
     
@@ -26,11 +153,12 @@ class ElevationMap:
     :param x: X coordinate of the viewpoint
     :param map_array: numpy array which contains elevation data
     :param omitted_distance: distance which will be excluded from results
+    :param max_distance: (optional) distance of the last ring, the rings reach the map edge by default
     :returns: list of omitted rings and list of rings to be solved
     """
 
     @staticmethod
-    def get_rings(y, x, map_array, omitted_distance):
+    def get_rings(y, x, map_array, omitted_distance, max_distance=None):
         omitted_rings = []
         rings = []
         # calculate the excluded rings
@@ -41,12 +169,39 @@ class ElevationMap:
         # calculate the rings to be solved
         distance = omitted_distance + 1
         ring = ElevationMap.__get_ring(y, x, map_array, distance)
-        while len(ring):
+        while len(ring) and (max_distance is None or distance <= max_distance):
             rings.append(ring)
+            distance += 1
             ring = ElevationMap.__get_ring(y, x, map_array, distance)
+
+        return omitted_rings, rings
+
+    """
+    Generate rectangles around the specified coordinates as arrays of cell indices. Specify the distance to be excluded
+    from the results. The rings contain the same cells in the same order as the rings from get_rings.
+    
+    :param y: Y coordinate of the viewpoint
+    :param x: X coordinate of the viewpoint
+    :param map_array: numpy array which contains elevation data
+    :param omitted_distance: distance which will be excluded from results
+    :param max_distance: (optional) distance of the last ring, the rings reach the map edge by default
+    :returns: list of omitted rings and list of rings to be solved, each ring is a tuple of (y, x) index arrays
+    """
+
+    @staticmethod
+    def get_ring_arrays(y, x, map_array, omitted_distance, max_distance=None):
+        omitted_rings = []
+        rings = []
+        for distance in range(1, omitted_distance + 1):
+            omitted_rings.append(ElevationMap.get_ring_indices(y, x, map_array.shape, distance))
+
+        distance = omitted_distance + 1
+        ring = ElevationMap.get_ring_indices(y, x, map_array.shape, distance)
+        while len(ring[0]) and (max_distance is None or distance <= max_distance):
+            rings.append(ring)
             distance += 1
+            ring = ElevationMap.get_ring_indices(y, x, map_array.shape, distance)
 
-        len
         return omitted_rings, rings
 
     """
@@ -61,59 +216,85 @@ class ElevationMap:
 
     @staticmethod
     def __get_ring(y, x, map_array, distance):
-        # calculate boundaries
-        inbounds = {'tl': True, 'tr': True, 'br': True, 'bl': True}
-
-        tl = [y - distance, x - distance]  # top-left corner
-        if tl[0] < 0:
-            tl[0] = 0
-            inbounds['tl'] = False
-        if tl[1] < 0:
-            tl[1] = 0
-
-        tr = [y - distance, x + distance]  # top-right corner
-        if tr[0] < 0:
-            tr[0] = 0
-        if tr[1] >= map_array.shape[1]:
-            tr[1] = map_array.shape[1] - 1
-            inbounds['tr'] = False
-
-        br = [y + distance, x + distance]  # bottom-right corner
-        if br[0] >= map_array.shape[0]:
-            br[0] = map_array.shape[0] - 1
-            inbounds['br'] = False
-        if br[1] >= map_array.shape[1]:
-            br[1] = map_array.shape[1] - 1
-
-        bl = [y + distance, x - distance]  # bottom-left corner
-        if bl[0] >= map_array.shape[0]:
-            bl[0] = map_array.shape[0] - 1
-        if bl[1] < 0:
-            bl[0] = 0
-            inbounds['bl'] = False
-
-        # create a list of ring coordinates
-        ring = []
-        # print("Ring bounds {}: {}, {}, {}, {}".format(distance, tl, tr, br, bl))
-
-        if inbounds['tl']:
-            for x in np.arange(tl[1], tr[1]):
-                ring.append((tl[0], x, map_array.item(tl[0], x)))
-
-        if inbounds['tr']:
-            for y in np.arange(tr[0], br[0]):
-                ring.append((y, tr[1], map_array.item(y, tr[1])))
-
-        if inbounds['br']:
-            for x in np.arange(br[1], bl[1], -1):
-                ring.append((br[0], x, map_array.item(br[0], x)))
-
-        if inbounds['bl']:
-            for y in np.arange(bl[0], tl[0], -1):
-                ring.append((y, bl[1], map_array.item(y, bl[1])))
-
-        # print("Ring with distance {} contains {} points\n".format(distance, len(ring)))
-        return ring
+        ring_y, ring_x = ElevationMap.get_ring_indices(y, x, map_array.shape, distance)
+        return list(zip(ring_y.tolist(), ring_x.tolist(), map_array[ring_y, ring_x].tolist()))
+
+    """
+    Get indices of the cells lying on a rectangle around the specified coordinates in the provided distance. The cells
+    are ordered clockwise starting in the top-left corner, cells outside of the map are left out.
+    
+    :param y: Y coordinate of the viewpoint
+    :param x: X coordinate of the viewpoint
+    :param shape: shape of the elevation map
+    :param distance: distance or step from the viewpoint
+    :returns: tuple of arrays with y and x indices of the ring cells
+    """
+
+    @staticmethod
+    def get_ring_indices(y, x, shape, distance):
+        height, width = shape[0], shape[1]
+        sides_y = []
+        sides_x = []
+
+        if y - distance >= 0:  # top side, left to right
+            side = np.arange(max(x - distance, 0), min(x + distance - 1, width - 1) + 1)
+            sides_y.append(np.full(len(side), y - distance, dtype=side.dtype))
+            sides_x.append(side)
+
+        if x + distance < width:  # right side, top to bottom
+            side = np.arange(max(y - distance, 0), min(y + distance - 1, height - 1) + 1)
+            sides_y.append(side)
+            sides_x.append(np.full(len(side), x + distance, dtype=side.dtype))
+
+        if y + distance < height:  # bottom side, right to left
+            side = np.arange(min(x + distance, width - 1), max(x - distance + 1, 0) - 1, -1)
+            sides_y.append(np.full(len(side), y + distance, dtype=side.dtype))
+            sides_x.append(side)
+
+        if x - distance >= 0:  # left side, bottom to top
+            side = np.arange(min(y + distance, height - 1), max(y - distance + 1, 0) - 1, -1)
+            sides_y.append(side)
+            sides_x.append(np.full(len(side), x - distance, dtype=side.dtype))
+
+        if not sides_y:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+        return np.concatenate(sides_y), np.concatenate(sides_x)
+
+    """
+    Get the bounds of the square window around the specified coordinates clipped to the map.
+    
+    :param y: Y coordinate of the viewpoint
+    :param x: X coordinate of the viewpoint
+    :param shape: shape of the elevation map
+    :param max_distance: distance from the viewpoint to the window edge, the whole map if None
+    :returns: top, left, bottom and right bounds of the window (bottom and right are exclusive)
+    """
+
+    @staticmethod
+    def get_window(y, x, shape, max_distance=None):
+        if max_distance is None:
+            return 0, 0, shape[0], shape[1]
+        return (max(y - max_distance, 0), max(x - max_distance, 0),
+                min(y + max_distance + 1, shape[0]), min(x + max_distance + 1, shape[1]))
+
+    """
+    Get the bounds of the tile containing the specified coordinates extended by the maximal distance, i.e. the part of
+    the map needed to solve any viewpoint of the tile.
+    
+    :param y: Y coordinate of the viewpoint
+    :param x: X coordinate of the viewpoint
+    :param shape: shape of the elevation map
+    :param tile_size: size of the tiles
+    :param max_distance: distance from the viewpoint to the window edge
+    :returns: top, left, bottom and right bounds of the window (bottom and right are exclusive)
+    """
+
+    @staticmethod
+    def get_tile_window(y, x, shape, tile_size, max_distance):
+        tile_y = y - y % tile_size
+        tile_x = x - x % tile_size
+        return (max(tile_y - max_distance, 0), max(tile_x - max_distance, 0),
+                min(tile_y + tile_size + max_distance, shape[0]), min(tile_x + tile_size + max_distance, shape[1]))
 
     def get_height(self):
         return self.map.shape[0]
@@ -126,3 +307,193 @@ class ElevationMap:
 
     def get_map(self):
         return self.map
+
+    """
+    Calculate the unit surface normal of every cell of the loaded map. The normals do not depend on the viewpoint, so
+    they are calculated only once for the given resolution and kept with the map. They are calculated in blocks of rows,
+    so the double precision temporaries never span the whole map, and the slope and aspect of the cells are not kept.
+    
+    :param cell_resolution: resolution of a cell
+    :param directory: (optional) directory for a memory-mapped .npy file with the normals
+    :param block_rows: (optional) number of rows processed at once
+    :param dtype: (optional) dtype of the normals, they are calculated in double precision in any case, the floating
+                  point dtype of the map by default (single precision for integer maps up to 16 bits)
+    """
+
+    def compute_terrain_derivatives(self, cell_resolution, directory=None, block_rows=1024, dtype=None):
+        if dtype is None:
+            dtype = np.result_type(self.map.dtype, np.float32)
+        if self.derivatives_resolution == cell_resolution and self.normals.dtype == np.dtype(dtype):
+            return
+        shape = self.map.shape + (3,)
+        if directory is None:
+            self.normals = np.empty(shape, dtype)
+        else:
+            self.normals = np.lib.format.open_memmap(os.path.join(directory, "normals.npy"), "w+", dtype, shape)
+        ElevationMap.fill_normals(self.map, cell_resolution, self.normals, block_rows)
+        if directory is not None:
+            self.normals.flush()
+        self.derivatives_resolution = cell_resolution
+
+    """
+    Calculate the normals of a map block by block. Each block is extended by a row on both sides to get the same values
+    as if the whole map was processed at once.
+    
+    :param map_array: numpy array which contains elevation data
+    :param cell_resolution: resolution of a cell
+    :param normals: raster the normals are written to (height x width x 3)
+    :param block_rows: number of rows processed at once
+    """
+
+    @staticmethod
+    def fill_normals(map_array, cell_resolution, normals, block_rows):
+        height = map_array.shape[0]
+        for row in range(0, height, block_rows):
+            top = max(row - 1, 0)
+            bottom = min(row + block_rows + 1, height)
+            rows = slice(row - top, min(row + block_rows, height) - top)
+            normals[row:row + block_rows] = \
+                ElevationMap.get_terrain_derivatives(map_array[top:bottom], cell_resolution)[2][rows]
+
+    def get_normals(self):
+        return self.normals
+
+    """
+    Build a pyramid of coarser elevation maps. Every level halves the resolution of the previous one, a cell of the
+    level is the mean of a 2 x 2 block of the previous level. The normals of every level are calculated with the
+    resolution of the level.
+    
+    :param levels: number of coarse levels
+    :param cell_resolution: resolution of a cell of the elevation map
+    :param block_rows: (optional) number of rows of the previous level downsampled at once
+    :param dtype: (optional) dtype of the levels and their normals, the levels are downsampled in double precision
+    """
+
+    def build_pyramid(self, levels, cell_resolution, block_rows=1024, dtype="d"):
+        self.pyramid = []
+        level_map = self.map
+        for level in range(1, levels + 1):
+            level_map = ElevationMap.downsample(level_map, block_rows)
+            normals = np.empty(level_map.shape + (3,), dtype)
+            ElevationMap.fill_normals(level_map, cell_resolution * 2 ** level, normals, block_rows)
+            self.pyramid.append((level_map.astype(dtype, copy=False), normals))
+
+    """
+    Get a level of the pyramid built by build_pyramid.
+    
+    :param level: level of the pyramid, 1 is the first coarse level
+    :returns: elevation map and normals of the level
+    """
+
+    def get_pyramid_level(self, level):
+        return self.pyramid[level - 1]
+
+    """
+    Convert a raster to another dtype in a memory-mapped .npy file. The raster is converted in blocks of rows, so a
+    memory-mapped raster is never loaded whole.
+
+    :param raster: numpy array to be converted
+    :param dtype: dtype of the converted raster
+    :param filename: path to the .npy file
+    :param block_rows: (optional) number of rows converted at once
+    :returns: memory-mapped converted raster
+    """
+
+    @staticmethod
+    def convert_raster(raster, dtype, filename, block_rows=1024):
+        converted = np.lib.format.open_memmap(filename, "w+", dtype, raster.shape)
+        for row in range(0, raster.shape[0], block_rows):
+            converted[row:row + block_rows] = raster[row:row + block_rows]
+        converted.flush()
+        return converted
+
+    """
+    Halve the resolution of a map by averaging blocks of 2 x 2 cells. Maps with an odd size are extended by their
+    border cells.
+    
+    :param map_array: numpy array which contains elevation data
+    :param block_rows: (optional) number of rows downsampled at once, so memory-mapped maps are not loaded at once
+    :returns: float64 numpy array
+    """
+
+    @staticmethod
+    def downsample(map_array, block_rows=1024):
+        height, width = map_array.shape
+        block_rows += block_rows % 2
+        downsampled = np.empty(((height + 1) // 2, (width + 1) // 2))
+        for row in range(0, height, block_rows):
+            block = np.asarray(map_array[row:row + block_rows], "d")
+            block = np.pad(block, ((0, block.shape[0] % 2), (0, width % 2)), mode="edge")
+            downsampled[row // 2:(row + block.shape[0]) // 2] = \
+                block.reshape(block.shape[0] // 2, 2, block.shape[1] // 2, 2).mean(axis=(1, 3))
+        return downsampled
+
+    """
+    Calculate slope, aspect and unit surface normal for the whole elevation map. The border cells are extended beyond
+    the map edges, so the cells on the edges get one-sided slope components. The values are the same as the per-cell
+    ones in SpatialUtils.
+    
+    Ref to Shi, Zhu, Burt, et al. (2007), An Experiment Using a Circular Neighborhood to Calculate Slope Gradient 
+    from a DEM, PHOTOGRAMMETRIC ENGINEERING & REMOTE SENSING, (2) 143-154.
+    
+    :param map_array: numpy array which contains elevation data
+    :param cell_resolution: resolution of a cell
+    :returns: slope raster in degrees, aspect raster in degrees and raster of unit normal vectors (height x width x 3)
+    """
+
+    @staticmethod
+    def get_terrain_derivatives(map_array, cell_resolution):
+        hood = np.pad(np.asarray(map_array, "d"), 1, mode="edge")
+        cn = math.sqrt(2)
+
+        westeast = ((cn * hood[:-2, :-2] + hood[1:-1, :-2] + cn * hood[2:, :-2])
+                    - (cn * hood[:-2, 2:] + hood[1:-1, 2:] + cn * hood[2:, 2:])) / (8 * cell_resolution)
+        northsouth = ((cn * hood[:-2, :-2] + hood[:-2, 1:-1] + cn * hood[:-2, 2:])
+                      - (cn * hood[2:, :-2] + hood[2:, 1:-1] + cn * hood[2:, 2:])) / (8 * cell_resolution)
+        del hood
+
+        slope = np.degrees(np.sqrt(westeast * westeast + northsouth * northsouth)) + 90
+        aspect = (np.degrees(np.arctan2(-1 * northsouth, -1 * westeast)) + 630) % 360
+        del westeast, northsouth
+
+        slope_rad = np.radians(slope)
+        aspect_rad = np.radians(aspect)
+        normals = np.empty(slope.shape + (3,))
+        normals[..., 0] = np.sin(aspect_rad) * np.cos(slope_rad)
+        normals[..., 1] = np.cos(aspect_rad) * np.cos(slope_rad)
+        normals[..., 2] = np.sin(slope_rad)
+
+        return slope, aspect, normals
+
+    """
+    Move the map and its normals to shared memory, or to memory-mapped files if a directory is provided. The rasters
+    keep their dtype and the private copies are released, the map object uses the shared rasters from now on. Rasters
+    which are already memory-mapped .npy files are shared without copying. The levels of the pyramid are shared as
+    map1, normals1, map2...
+    
+    :param directory: (optional) directory for the memory-mapped .npy files
+    :returns: dictionary of SharedRaster instances keyed by the raster name (map, normals)
+    """
+
+    def share(self, directory=None):
+        shared = {}
+        for name in ("map", "normals"):
+            array = getattr(self, name)
+            if array is None:
+                continue
+            if isinstance(array, np.memmap) and array.filename is not None:
+                shared[name] = SharedRaster.open(array.filename)
+                continue
+            filename = None if directory is None else os.path.join(directory, name + ".npy")
+            shared[name] = SharedRaster.from_array(array, filename)
+            setattr(self, name, shared[name].attach())
+
+        for level in range(1, len(self.pyramid) + 1):
+            level_arrays = []
+            for name, array in zip(("map", "normals"), self.get_pyramid_level(level)):
+                name += str(level)
+                filename = None if directory is None else os.path.join(directory, name + ".npy")
+                shared[name] = SharedRaster.from_array(array, filename)
+                level_arrays.append(shared[name].attach())
+            self.pyramid[level - 1] = tuple(level_arrays)
+        return shared
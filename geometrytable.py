@@ -0,0 +1,132 @@
+import os
+
+import numpy as np
+
+from sharedraster import SharedRaster
+from spatialutils import SpatialUtils
+
+
+class GeometryTable:
+    def __init__(self, radius, offsets, weights, seam_weights):
+        self.radius = radius
+        self.offsets = offsets
+        self.weights = weights
+        self.seam_weights = seam_weights
+
+    """
+    Build the lookup tables for all cells up to the specified distance from the origin. The LOS neighbours and
+    interpolation weights depend only on the position of the cell relative to the origin, so the tables are shared by
+    all viewpoints.
+
+    The geometry is symmetric to both axes and to the diagonals, so only the octant 0 <= y <= x is stored, packed row
+    by row of x. The only exception are the weights of the two columns next to the north axis, the viewing aspects of
+    their neighbours wrap around 0/360 degrees, so they are stored separately. The weights are kept in double precision,
+    a single octant is small enough and rounding them would change the visibility of cells on near ties of the LOS.
+
+    :param radius: maximal distance from the origin covered by the tables
+    :param cell_resolution: resolution of a cell
+    :returns: GeometryTable instance
+    """
+
+    @staticmethod
+    def build(radius, cell_resolution):
+        relative_x = np.repeat(np.arange(radius + 1), np.arange(radius + 1) + 1)
+        relative_y = np.arange(len(relative_x)) - GeometryTable.get_octant_index(0, relative_x)
+        spatial = SpatialUtils(radius, radius, 0, cell_resolution, None)
+
+        adjacent, offset = spatial.get_los_cell_arrays(relative_y + radius, relative_x + radius)
+        offsets = np.empty((len(relative_x), 4), dtype=np.int8)
+        offsets[:, 0] = adjacent[0] - radius - relative_y
+        offsets[:, 1] = adjacent[1] - radius - relative_x
+        offsets[:, 2] = offset[0] - radius - relative_y
+        offsets[:, 3] = offset[1] - radius - relative_x
+        weights = spatial.interpolate_weights(relative_y + radius, relative_x + radius)
+
+        seam_y, seam_x = np.indices((2 * radius + 1, 2))
+        seam_weights = spatial.interpolate_weights(seam_y.ravel(), seam_x.ravel() + radius - 1)
+
+        return GeometryTable(radius, offsets, weights, seam_weights.reshape(2 * radius + 1, 2))
+
+    """
+    Get the positions of the cells in the stored octant.
+
+    :param low: array of the smaller absolute coordinates of the cells relative to the origin
+    :param high: array of the larger absolute coordinates of the cells relative to the origin
+    :returns: array of indices to the octant tables
+    """
+
+    @staticmethod
+    def get_octant_index(low, high):
+        return high * (high + 1) // 2 + low
+
+    """
+    Get the LOS neighbours of the cells. See SpatialUtils.get_los_cell_arrays.
+
+    :param y: array of y coordinates of the cells
+    :param x: array of x coordinates of the cells
+    :param origin_y: y coordinate of the origin
+    :param origin_x: x coordinate of the origin
+    :returns: tuple of (y, x) index arrays of the adjacent cells and tuple of (y, x) index arrays of the offset cells
+    """
+
+    def get_los_cell_arrays(self, y, x, origin_y, origin_x):
+        relative_y = np.abs(y - origin_y)
+        relative_x = np.abs(x - origin_x)
+        offsets = self.offsets[GeometryTable.get_octant_index(np.minimum(relative_y, relative_x),
+                                                              np.maximum(relative_y, relative_x))]
+        # the octant is mirrored along the diagonal and then along the axes to the position of the cells
+        swapped = relative_y > relative_x
+        sign_y = np.where(y < origin_y, -1, 1)
+        sign_x = np.where(x < origin_x, -1, 1)
+        adjacent_y = y + sign_y * np.where(swapped, offsets[..., 1], offsets[..., 0])
+        adjacent_x = x + sign_x * np.where(swapped, offsets[..., 0], offsets[..., 1])
+        offset_y = y + sign_y * np.where(swapped, offsets[..., 3], offsets[..., 2])
+        offset_x = x + sign_x * np.where(swapped, offsets[..., 2], offsets[..., 3])
+        return (adjacent_y, adjacent_x), (offset_y, offset_x)
+
+    """
+    Get the weights of the cells adjacent to the specified ones. See SpatialUtils.interpolate_weights.
+
+    :param y: array of y coordinates of the cells
+    :param x: array of x coordinates of the cells
+    :param origin_y: y coordinate of the origin
+    :param origin_x: x coordinate of the origin
+    :returns: array of weights of the cells
+    """
+
+    def interpolate_weights(self, y, x, origin_y, origin_x):
+        relative_y = np.abs(y - origin_y)
+        relative_x = np.abs(x - origin_x)
+        weights = self.weights[GeometryTable.get_octant_index(np.minimum(relative_y, relative_x),
+                                                              np.maximum(relative_y, relative_x))]
+        seam = (x - origin_x == -1) | (x == origin_x)
+        if np.any(seam):
+            weights[seam] = self.seam_weights[y[seam] - origin_y + self.radius, x[seam] - origin_x + 1]
+        return weights
+
+    """
+    Copy the tables to shared memory, or to memory-mapped files if a directory is provided.
+
+    :param directory: (optional) directory for the memory-mapped .npy files
+    :returns: dictionary of SharedRaster instances keyed by the table name (offsets, weights, seam_weights)
+    """
+
+    def share(self, directory=None):
+        shared = {}
+        for name in ("offsets", "weights", "seam_weights"):
+            filename = None if directory is None else os.path.join(directory, "geometry_" + name + ".npy")
+            shared[name] = SharedRaster.from_array(getattr(self, name), filename)
+        return shared
+
+    """
+    Create a table backed by shared rasters.
+
+    :param radius: maximal distance from the origin covered by the tables
+    :param shared: dictionary of SharedRaster instances returned by share
+    :returns: GeometryTable instance
+    """
+
+    @staticmethod
+    def attach(radius, shared):
+        return GeometryTable(radius, shared["offsets"].attach(), shared["weights"].attach(),
+                             shared["seam_weights"].attach())
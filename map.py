@@ -4,21 +4,24 @@ import numpy as np
 class Map:
     undefined = -9999999
 
-    def __init__(self, map_height, map_width, init):
+    def __init__(self, map_height, map_width, init, offset_y=0, offset_x=0, dtype="d"):
+        # the map may cover only a window of the elevation map starting at [offset_y, offset_x]
+        self.offset_y = offset_y
+        self.offset_x = offset_x
         if init:
-            self.map = np.zeros([map_height, map_width])
+            self.map = np.zeros([map_height, map_width], dtype)
         else:
-            self.map = np.empty([map_height, map_width])
+            self.map = np.empty([map_height, map_width], dtype)
 
     def set(self, y, x, value):
-        self.map[y][x] = value
+        self.map[y - self.offset_y][x - self.offset_x] = value
 
     def get(self, y, x):
-        return self.map[y][x]
+        return self.map[y - self.offset_y][x - self.offset_x]
 
     def init_omitted_cells(self, omitted, value):
         for cell in omitted:
-            self.map[cell[0]][cell[1]] = value
+            self.set(cell[0], cell[1], value)
 
     def get_array(self):
         return self.map
@@ -0,0 +1,62 @@
+import argparse
+
+import cv2
+import numpy as np
+
+"""
+Show the visual magnitude next to the elevation map. Matplotlib is imported only here, so the computation does not
+depend on the plotting stack.
+
+:param visual_magnitude: visual magnitude raster
+:param map_array: numpy array which contains elevation data
+:param title: (optional) title of the figure
+"""
+
+
+def plot_visual_magnitude(visual_magnitude, map_array, title=None):
+    import matplotlib.pyplot as plt
+    from matplotlib import colors
+
+    fig = plt.figure()
+    a = fig.add_subplot(1, 2, 1)
+    a.set_title("Visual Magnitude")
+    norm = colors.LogNorm(clip=False)
+    # cells without any magnitude cannot be shown on the logarithmic scale
+    im = plt.imshow(np.ma.masked_less_equal(visual_magnitude, 0), norm=norm)
+    plt.colorbar(im, orientation='horizontal')
+
+    c = fig.add_subplot(1, 2, 2)
+    c.set_title("Elevation map")
+    im3 = plt.imshow(map_array, cmap='hot')
+    plt.colorbar(im3, orientation='horizontal')
+
+    if title is not None:
+        plt.suptitle(title)
+    plt.show()
+
+
+"""
+Read a raster written by xdraw.py or an elevation map.
+
+:param filename: path to the .npy file or to a raster readable by OpenCV
+:returns: numpy array
+"""
+
+
+def read_raster(filename):
+    if filename.lower().endswith(".npy"):
+        return np.load(filename, mmap_mode="r")
+    return cv2.imread(filename, -1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plot a visual magnitude raster next to the elevation map.")
+    parser.add_argument("visual_magnitude", help="visual magnitude raster (.npy or GeoTIFF)")
+    parser.add_argument("dem", help="elevation map")
+    parser.add_argument("--title")
+    args = parser.parse_args()
+    plot_visual_magnitude(read_raster(args.visual_magnitude), read_raster(args.dem), args.title)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import time
+
+import numpy as np
+
+from workforcestats import WorkerStats
+
+
+class ResultBatch:
+    def __init__(self, shape, worker=None, dtype="d"):
+        self.shape = shape
+        self.worker = worker
+        # precision of the summed visual magnitudes
+        self.dtype = dtype
+        # stats of the worker collected since the previous batch
+        self.stats = WorkerStats(worker)
+        self.origins = []
+        self.cells = []
+        self.magnitudes = []
+        self.size = 0
+        # time of the last flush, the workers flush the batch also when it gets old
+        self.flush_time = time.time()
+
+    """
+    Add the visible cells of a solved viewpoint to the batch.
+
+    :param origin: the solved viewpoint
+    :param visible_y: y coordinates of the visible cells
+    :param visible_x: x coordinates of the visible cells
+    :param magnitudes: visual magnitudes of the visible cells
+    """
+
+    def add(self, origin, visible_y, visible_x, magnitudes):
+        self.add_cells(origin, np.ravel_multi_index((visible_y, visible_x), self.shape), magnitudes)
+
+    """
+    Add the visible cells of a solved viewpoint to the batch.
+
+    :param origin: the solved viewpoint
+    :param cells: flat indices of the visible cells
+    :param magnitudes: visual magnitudes of the visible cells
+    """
+
+    def add_cells(self, origin, cells, magnitudes):
+        self.origins.append(origin)
+        self.cells.append(cells)
+        self.magnitudes.append(magnitudes)
+        self.size += len(magnitudes)
+
+    """
+    Merge the accumulated results into a message for the sumator and empty the batch. Magnitudes of cells seen from
+    multiple viewpoints of the batch are summed, so every cell is sent only once. The stats of the worker are sent
+    along and reset.
+
+    :returns: list of [solved viewpoints, flat indices of the cells, visual magnitudes of the cells, WorkerStats]
+    """
+
+    def flush(self):
+        if self.cells:
+            cells, inverse = np.unique(np.concatenate(self.cells), return_inverse=True)
+            magnitudes = np.bincount(inverse.ravel(), np.concatenate(self.magnitudes), len(cells)).astype(self.dtype)
+        else:
+            cells = np.empty(0, dtype=np.intp)
+            magnitudes = np.empty(0, self.dtype)
+        message = [self.origins, cells, magnitudes, self.stats]
+
+        self.origins = []
+        self.cells = []
+        self.magnitudes = []
+        self.size = 0
+        self.stats = WorkerStats(self.worker)
+        self.flush_time = time.time()
+        return message
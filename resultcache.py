@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# replace a file atomically, os.rename does the same on POSIX in Python 2 which has no os.replace
+replace_file = getattr(os, "replace", os.rename)
+
+
+class ResultCache:
+    def __init__(self, directory, key):
+        self.directory = os.path.join(directory, key)
+        self.key = key
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # another process might have created the directory in the meantime
+                if not os.path.isdir(self.directory):
+                    raise
+
+    """
+    Calculate a key identifying the results of the viewpoints. The results depend on the content of the elevation map and
+    on the parameters of the calculation.
+
+    :param map_array: numpy array which contains elevation data
+    :param parameters: dictionary of the parameters influencing the results (cell resolution, origin offset...)
+    :returns: hexadecimal key
+    """
+
+    @staticmethod
+    def get_key(map_array, parameters):
+        key = hashlib.sha1(ResultCache.get_map_hash(map_array).encode("ascii"))
+        key.update(json.dumps(parameters, sort_keys=True).encode("ascii"))
+        return key.hexdigest()
+
+    """
+    Calculate a hash of the content of the elevation map. The map is hashed by blocks of rows, so memory-mapped maps
+    are not loaded at once.
+
+    :param map_array: numpy array which contains elevation data
+    :param block_rows: (optional) number of rows hashed at once
+    :returns: hexadecimal hash
+    """
+
+    @staticmethod
+    def get_map_hash(map_array, block_rows=1024):
+        content_hash = hashlib.sha1("{} {}".format(map_array.dtype.str, map_array.shape).encode("ascii"))
+        for row in range(0, map_array.shape[0], block_rows):
+            content_hash.update(np.ascontiguousarray(map_array[row:row + block_rows]).tobytes())
+        return content_hash.hexdigest()
+
+    def get_filename(self, y, x):
+        return os.path.join(self.directory, "{}_{}.npz".format(y, x))
+
+    def contains(self, y, x):
+        return os.path.isfile(self.get_filename(y, x))
+
+    """
+    Find out which viewpoints have their contributions stored in the cache.
+
+    :param viewpoints: array of viewpoints (see ElevationMap.viewpoint_dtype)
+    :returns: boolean array, True for the cached viewpoints
+    """
+
+    def get_cached(self, viewpoints):
+        stored = set(os.listdir(self.directory))
+        return np.array([os.path.basename(self.get_filename(y, x)) in stored
+                         for y, x in zip(viewpoints["y"].tolist(), viewpoints["x"].tolist())], bool)
+
+    """
+    Load the unweighted contribution of a viewpoint.
+
+    :param y: y coordinate of the viewpoint
+    :param x: x coordinate of the viewpoint
+    :returns: flat indices of the visible cells and their visual magnitudes
+    """
+
+    def load(self, y, x):
+        with np.load(self.get_filename(y, x)) as contribution:
+            return contribution["cells"], contribution["magnitudes"]
+
+    """
+    Store the unweighted contribution of a viewpoint. The file is written under a temporary name first, so other
+    processes never read an incomplete file.
+
+    :param y: y coordinate of the viewpoint
+    :param x: x coordinate of the viewpoint
+    :param cells: flat indices of the visible cells
+    :param magnitudes: visual magnitudes of the visible cells
+    """
+
+    def store(self, y, x, cells, magnitudes):
+        filename = self.get_filename(y, x)
+        temporary = "{}.{}.tmp".format(filename, os.getpid())
+        with open(temporary, "wb") as output:
+            np.savez_compressed(output, cells=cells, magnitudes=magnitudes)
+        replace_file(temporary, filename)
@@ -0,0 +1,69 @@
+import numpy as np
+
+
+class RingMap:
+    def __init__(self, max_distance, dtype="d", layers=None):
+        # two buffers for the previous and the current ring, the rings are indexed along the perimeter, with layers
+        # the buffers hold a ring for each layer (e.g. the LOS from several heights of the origin)
+        shape = (max(8 * max_distance, 1),) if layers is None else (layers, max(8 * max_distance, 1))
+        self.previous = np.empty(shape, dtype)
+        self.current = np.empty(shape, dtype)
+        self.origin_y = 0
+        self.origin_x = 0
+        self.distance = 0
+
+    """
+    Start a new viewpoint. The ring in the specified distance (or the origin itself for zero distance) becomes the
+    previous ring and all of its cells are set to the value.
+
+    :param origin_y: y coordinate of the origin
+    :param origin_x: x coordinate of the origin
+    :param distance: distance of the previous ring
+    :param value: value of the cells of the previous ring
+    """
+
+    def reset(self, origin_y, origin_x, distance, value):
+        self.origin_y = origin_y
+        self.origin_x = origin_x
+        self.distance = distance
+        self.previous[..., :max(8 * distance, 1)] = value
+
+    """
+    Get values of the cells of the previous ring.
+
+    :param y: array of y coordinates of the cells
+    :param x: array of x coordinates of the cells
+    :returns: array of values (layers x cells with layers)
+    """
+
+    def get(self, y, x):
+        return self.previous[..., self.get_perimeter_indices(y - self.origin_y, x - self.origin_x, self.distance)]
+
+    """
+    Set values of the cells of the next ring and make it the previous ring.
+
+    :param y: array of y coordinates of the cells
+    :param x: array of x coordinates of the cells
+    :param values: array of values (layers x cells with layers)
+    """
+
+    def push(self, y, x, values):
+        self.distance += 1
+        self.current[..., self.get_perimeter_indices(y - self.origin_y, x - self.origin_x, self.distance)] = values
+        self.previous, self.current = self.current, self.previous
+
+    """
+    Get positions of the cells along the perimeter of a ring. The positions follow the order of
+    ElevationMap.get_ring_indices, i.e. clockwise from the top-left corner.
+
+    :param relative_y: array of y coordinates of the cells relative to the origin
+    :param relative_x: array of x coordinates of the cells relative to the origin
+    :param distance: distance of the ring
+    :returns: array of positions
+    """
+
+    @staticmethod
+    def get_perimeter_indices(relative_y, relative_x, distance):
+        # the top and right sides lie above the diagonal, the bottom and left sides below it
+        diagonal = relative_y + relative_x
+        return np.where(relative_x >= relative_y, 2 * distance + diagonal, 6 * distance - diagonal)
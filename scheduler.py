@@ -0,0 +1,111 @@
+import numpy as np
+
+# overhead of solving a ring expressed in cells
+ring_overhead = 256
+# minimal number of chunks per worker, so the workers can balance their load
+chunks_per_worker = 4
+
+"""
+Split the viewpoints into chunks of spatially adjacent viewpoints and order the chunks by their estimated cost, the most
+expensive first. The workers pull the chunks one by one, so the cheap chunks at the end of the queue balance the load.
+
+Adjacent viewpoints are grouped along the Z-order curve. If the viewpoints are solved in tiles, the chunks do not cross
+tile boundaries. The cost of a viewpoint is estimated from the number of its rings and the cells in them (see
+get_viewpoint_costs).
+Every worker gets at least chunks_per_worker chunks: the chunk size is capped at ceil(n / (chunks_per_worker *
+worker_count)) viewpoints and a chunk is also cut once its cost reaches the same share of the total cost, so the
+expensive parts of the path are split into smaller chunks than the cheap ones.
+
+:param viewpoints: array of viewpoints (see ElevationMap.viewpoint_dtype)
+:param shape: shape of the elevation map
+:param chunk_size: maximal number of viewpoints in a chunk
+:param max_distance: (optional) distance from a viewpoint beyond which the cells are not solved
+:param tile_size: (optional) size of the tiles the viewpoints are solved in
+:param worker_count: number of workers the chunks are distributed to
+:returns: list of viewpoint arrays
+"""
+
+
+def schedule_viewpoints(viewpoints, shape, chunk_size, max_distance=None, tile_size=None, worker_count=1):
+    if not len(viewpoints):
+        return []
+    viewpoint_y = viewpoints["y"]
+    viewpoint_x = viewpoints["x"]
+
+    if tile_size is None:
+        tiles = np.zeros(len(viewpoints), np.uint64)
+    else:
+        tiles = get_morton_codes(viewpoint_y // tile_size, viewpoint_x // tile_size)
+    order = np.lexsort((get_morton_codes(viewpoint_y, viewpoint_x), tiles))
+    viewpoints = viewpoints[order]
+    tiles = tiles[order]
+    costs = get_viewpoint_costs(viewpoints, shape, max_distance)
+
+    # the chunks are cut at every tile boundary, whenever the cost share of a chunk is reached and after chunk_size
+    # viewpoints
+    chunk_count = chunks_per_worker * max(worker_count, 1)
+    chunk_size = max(min(chunk_size, -(-len(viewpoints) // chunk_count)), 1)
+    preceding_costs = np.cumsum(costs) - costs
+    shares = preceding_costs * chunk_count // max(costs.sum(), 1)
+    cuts = np.flatnonzero((np.diff(tiles) != 0) | (np.diff(shares) != 0)) + 1
+    boundaries = np.concatenate(([0], cuts, [len(viewpoints)]))
+    starts = np.concatenate([np.arange(boundaries[i], boundaries[i + 1], chunk_size)
+                             for i in range(len(boundaries) - 1)])
+    chunks = np.split(viewpoints, starts[1:])
+
+    chunk_costs = np.add.reduceat(costs, starts)
+    return [chunks[i] for i in np.argsort(-chunk_costs, kind="mergesort")]
+
+
+"""
+Estimate the cost of the viewpoints. The engines solve the viewpoints ring by ring, so the cost consists of the number
+of solved cells and of the overhead of every ring.
+
+:param viewpoints: array of viewpoints (see ElevationMap.viewpoint_dtype)
+:param shape: shape of the elevation map
+:param max_distance: (optional) distance from a viewpoint beyond which the cells are not solved
+:returns: array of estimated costs expressed in cells
+"""
+
+
+def get_viewpoint_costs(viewpoints, shape, max_distance=None):
+    viewpoint_y = viewpoints["y"].astype(np.int64)
+    viewpoint_x = viewpoints["x"].astype(np.int64)
+    rings = np.maximum(np.maximum(viewpoint_y, shape[0] - 1 - viewpoint_y),
+                       np.maximum(viewpoint_x, shape[1] - 1 - viewpoint_x))
+    if max_distance is None:
+        cells = np.full(len(viewpoints), shape[0] * shape[1], np.int64)
+    else:
+        rings = np.minimum(rings, max_distance)
+        cells = ((np.minimum(viewpoint_y + max_distance + 1, shape[0]) - np.maximum(viewpoint_y - max_distance, 0))
+                 * (np.minimum(viewpoint_x + max_distance + 1, shape[1]) - np.maximum(viewpoint_x - max_distance, 0)))
+    return cells + ring_overhead * rings
+
+
+"""
+Interleave the bits of the coordinates into positions on the Z-order curve.
+
+:param y: array of y coordinates (up to 32 bits)
+:param x: array of x coordinates (up to 32 bits)
+:returns: array of Z-order codes
+"""
+
+
+def get_morton_codes(y, x):
+    return (spread_bits(y) << np.uint64(1)) | spread_bits(x)
+
+
+"""
+Insert a zero bit in front of each of the lower 32 bits of the values.
+
+:param values: array of integers
+:returns: array of spread values
+"""
+
+
+def spread_bits(values):
+    values = np.asarray(values).astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+    return values
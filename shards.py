@@ -0,0 +1,143 @@
+import argparse
+import hashlib
+import json
+
+import numpy as np
+
+from elevationmap import ElevationMap
+
+"""
+Parse the shard specification of a partitioned run.
+
+:param specification: string INDEX/COUNT, e.g. 0/8 for the first of eight shards
+:returns: tuple of the shard index and the number of shards
+"""
+
+
+def parse_shard(specification):
+    try:
+        index, count = [int(part) for part in specification.split("/")]
+    except ValueError:
+        raise ValueError("Invalid shard '{}', expected INDEX/COUNT".format(specification))
+    if count < 1 or not 0 <= index < count:
+        raise ValueError("Invalid shard '{}', the index must be between 0 and COUNT - 1".format(specification))
+    return index, count
+
+
+"""
+Select the viewpoints of a shard. The viewpoints are identified by their position in the array of all viewpoints of
+the run, every shard takes a contiguous range of them, so its viewpoints lie close to each other.
+
+:param viewpoint_count: number of all viewpoints of the run
+:param shard_index: index of the shard
+:param shard_count: number of shards
+:returns: array of the viewpoint IDs of the shard
+"""
+
+
+def get_shard(viewpoint_count, shard_index, shard_count):
+    return np.array_split(np.arange(viewpoint_count), shard_count)[shard_index]
+
+
+"""
+Calculate a hash of all viewpoints of a run. Shards can only be merged if they split the same viewpoints, as the IDs
+refer to the order of the viewpoints.
+
+:param viewpoints: array of all viewpoints of the run (see ElevationMap.viewpoint_dtype)
+:returns: hexadecimal hash
+"""
+
+
+def get_viewpoints_hash(viewpoints):
+    return hashlib.sha1(np.ascontiguousarray(viewpoints.astype(ElevationMap.viewpoint_dtype)).tobytes()).hexdigest()
+
+
+"""
+Write the partial result of a shard.
+
+:param filename: path to the .npz file
+:param visual_magnitude: visual magnitude of the viewpoints of the shard
+:param map_hash: hash of the elevation map (see ResultCache.get_map_hash)
+:param parameters: dictionary of the parameters of the calculation (see VisualMagWorkforce.parameters)
+:param viewpoints: array of all viewpoints of the run
+:param viewpoint_ids: IDs of the viewpoints of the shard (see get_shard)
+"""
+
+
+def write_partial(filename, visual_magnitude, map_hash, parameters, viewpoints, viewpoint_ids):
+    with open(filename, "wb") as output:
+        np.savez(output, visual_magnitude=visual_magnitude, map_hash=np.array(map_hash),
+                 parameters=np.array(json.dumps(parameters, sort_keys=True)),
+                 viewpoints_hash=np.array(get_viewpoints_hash(viewpoints)), viewpoint_count=len(viewpoints),
+                 viewpoint_ids=np.asarray(viewpoint_ids, np.int64))
+
+
+"""
+Sum the partial results of the shards of a run. The shards must be calculated on the same elevation map with the same
+parameters and viewpoints, and no viewpoint may be included twice.
+
+:param filenames: paths to the partial results (see write_partial)
+:param allow_incomplete: (optional) merge even if the viewpoints of some shards are missing
+:returns: summed visual magnitude and the metadata of the run (map hash, parameters, number of merged viewpoints...)
+"""
+
+
+def merge_partials(filenames, allow_incomplete=False):
+    if not filenames:
+        raise ValueError("No partial results to merge")
+    visual_magnitude = None
+    metadata = None
+    merged = None
+    for filename in filenames:
+        with np.load(filename) as partial:
+            partial_metadata = {
+                "map_hash": str(partial["map_hash"]),
+                "parameters": json.loads(str(partial["parameters"])),
+                "viewpoints_hash": str(partial["viewpoints_hash"]),
+                "viewpoint_count": int(partial["viewpoint_count"]),
+                "shape": list(partial["visual_magnitude"].shape)
+            }
+            if metadata is None:
+                metadata = partial_metadata
+                visual_magnitude = np.zeros(partial["visual_magnitude"].shape, "d")
+                merged = np.zeros(metadata["viewpoint_count"], bool)
+            for name in sorted(metadata):
+                if partial_metadata[name] != metadata[name]:
+                    raise ValueError("{} is not compatible with {}: different {}".format(filename, filenames[0],
+                                                                                        name))
+            viewpoint_ids = partial["viewpoint_ids"]
+            if np.any(merged[viewpoint_ids]) or len(np.unique(viewpoint_ids)) != len(viewpoint_ids):
+                raise ValueError("{} contains viewpoints which were already merged".format(filename))
+            merged[viewpoint_ids] = True
+            visual_magnitude += partial["visual_magnitude"]
+
+    missing = len(merged) - np.count_nonzero(merged)
+    if missing and not allow_incomplete:
+        raise ValueError("{} of {} viewpoints are missing in the partial results".format(missing, len(merged)))
+    metadata["merged_viewpoints"] = int(np.count_nonzero(merged))
+    return visual_magnitude, metadata
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge the partial results of a run split into shards.")
+    parser.add_argument("output", help="visual magnitude raster, written as .npy or GeoTIFF depending on the extension")
+    parser.add_argument("partials", nargs="+", help="partial results of the shards (.npz)")
+    parser.add_argument("--reference", help="raster whose georeference is copied to the output, e.g. the elevation map")
+    parser.add_argument("--allow-incomplete", action="store_true", help="merge even if some shards are missing")
+    args = parser.parse_args()
+
+    visual_magnitude, metadata = merge_partials(args.partials, args.allow_incomplete)
+    if visual_magnitude.ndim == 3:
+        # the shards were calculated for several offsets, every offset gets its raster
+        ElevationMap.write_raster_stack(args.output, visual_magnitude,
+                                        ["offset{:g}".format(offset)
+                                         for offset in metadata["parameters"]["origin_offset"]], args.reference)
+    else:
+        ElevationMap.write_raster(args.output, visual_magnitude, args.reference)
+    print("Merged {} partial results with {} of {} viewpoints".format(len(args.partials),
+                                                                      metadata["merged_viewpoints"],
+                                                                      metadata["viewpoint_count"]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import ctypes
+import multiprocessing as mp
+
+import numpy as np
+
+
+class SharedRaster:
+    def __init__(self, shape, dtype, filename=None, create=True):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.filename = filename
+        self.buffer = None
+
+        if filename is None:
+            # raw shared memory without a lock, the workers only read the rasters
+            self.buffer = mp.RawArray(ctypes.c_ubyte, max(self.get_nbytes(), 1))
+        elif create:
+            np.lib.format.open_memmap(filename, "w+", self.dtype, self.shape)
+
+    """
+    Share an existing .npy file without copying it.
+
+    :param filename: name of the .npy file
+    :returns: SharedRaster instance
+    """
+
+    @staticmethod
+    def open(filename):
+        array = np.load(filename, mmap_mode="r")
+        return SharedRaster(array.shape, array.dtype, filename, False)
+
+    """
+    Copy an array into a new shared raster. The array keeps its dtype.
+
+    :param array: numpy array to be shared
+    :param filename: (optional) name of a .npy file to be memory-mapped instead of using shared memory
+    :returns: SharedRaster instance
+    """
+
+    @staticmethod
+    def from_array(array, filename=None):
+        raster = SharedRaster(array.shape, array.dtype, filename)
+        view = raster.attach(True)
+        view[...] = array
+        if filename is not None:
+            view.flush()
+        return raster
+
+    """
+    Get a numpy array backed by the shared memory or the memory-mapped file. Nothing is copied.
+
+    :param writable: (optional) allow writing to the raster
+    :returns: numpy array
+    """
+
+    def attach(self, writable=False):
+        if self.buffer is None:
+            return np.load(self.filename, mmap_mode="r+" if writable else "r")
+
+        array = np.frombuffer(self.buffer, self.dtype, int(np.prod(self.shape))).reshape(self.shape)
+        array.flags.writeable = writable
+        return array
+
+    def get_nbytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
@@ -6,16 +6,38 @@ import numpy as np
 class SpatialUtils:
     light_refraction = 0.13
     pi_pul = math.pi / 2
-
-    def __init__(self, origin_y, origin_x, origin_elevation, cell_resolution, elevation_map, ):
+    # index offsets of the adjacent and offset LOS cells for each orientation code (see __get_orientation)
+    index_offsets = {
+        0x0020: [(0, 1), (0, 1)],
+        0x0100: [(0, 1), (1, 1)],
+        0x1200: [(1, 1), (1, 1)],
+        0x0000: [(1, 0), (1, 1)],
+        0x0002: [(1, 0), (1, 0)],
+        0x0001: [(1, 0), (1, -1)],
+        0x2101: [(1, -1), (1, -1)],
+        0x1001: [(0, -1), (1, -1)],
+        0x0021: [(0, -1), (0, -1)],
+        0x1011: [(0, -1), (-1, -1)],
+        0x1211: [(-1, -1), (-1, -1)],
+        0x1111: [(-1, 0), (-1, -1)],
+        0x0012: [(-1, 0), (-1, 0)],
+        0x1110: [(-1, 0), (-1, 1)],
+        0x2110: [(-1, 1), (-1, 1)],
+        0x0110: [(0, 1), (-1, 1)]
+    }
+
+    def __init__(self, origin_y, origin_x, origin_elevation, cell_resolution, elevation_map, normal_map=None):
         self.origin_y = origin_y
         self.origin_x = origin_x
         self.origin_elevation = origin_elevation
         self.cell_resolution = cell_resolution
         self.elevation_map = elevation_map
+        self.normal_map = normal_map
 
     """
-    Calculate visual magnitude of the cell relative to the origin.
+    Calculate visual magnitude of the cell relative to the origin. The cell normal is looked up in the normal map
+    if one was provided (see ElevationMap.compute_terrain_derivatives), otherwise it is calculated from the elevation
+    map.
     
     :param cell_y: y coordinate of the cell
     :param cell_x: x coordinate of the cell
@@ -25,13 +47,16 @@ class SpatialUtils:
 
     def visual_magnitude(self, cell_y, cell_x):
         distance = self.__get_distance(cell_y, cell_x)
-        cell_slope = self.__get_cell_slope(cell_y, cell_x)
         viewing_slope = self.get_viewing_slope(cell_y, cell_x)
-        cell_aspect = self.__get_cell_aspect(cell_y, cell_x)
         viewing_aspect = self.__get_viewing_aspect(cell_y, cell_x)
 
         view_vector = self.__make_directional_vector(viewing_aspect, viewing_slope)
-        cell_normal = self.__make_directional_vector(cell_aspect, cell_slope)
+        if self.normal_map is None:
+            cell_slope = self.__get_cell_slope(cell_y, cell_x)
+            cell_aspect = self.__get_cell_aspect(cell_y, cell_x)
+            cell_normal = self.__make_directional_vector(cell_aspect, cell_slope)
+        else:
+            cell_normal = np.asarray(self.normal_map[cell_y, cell_x], "d")
 
         vector_angle = self.__get_angle_difference(view_vector, cell_normal)
         # print(math.degrees(vector_angle))
@@ -44,6 +69,50 @@ class SpatialUtils:
 
         return visual_magnitude
 
+    """
+    Calculate visual magnitudes of the cells relative to the origin. Array counterpart of visual_magnitude, the viewing
+    slopes calculated for the LOS can be passed along, so they are not calculated again. The distance is derived from
+    the viewing slope. If the origin has several elevations (see get_viewing_slopes), the viewing slopes and the
+    magnitudes have a row for every elevation, the aspects and the normals of the cells are shared by all rows.
+    
+    :param y: array of y coordinates of the cells
+    :param x: array of x coordinates of the cells
+    :param viewing_slopes: (optional) array of viewing slopes of the cells (see get_viewing_slopes)
+    
+    :returns: array of visual magnitudes
+    """
+
+    def visual_magnitudes(self, y, x, viewing_slopes=None):
+        if viewing_slopes is None:
+            viewing_slopes = self.get_viewing_slopes(y, x)
+        slope_rad = np.radians(np.asarray(viewing_slopes, "d"))
+        aspect_rad = np.radians(self.get_viewing_aspects(y, x))
+        cos_slope = np.cos(slope_rad)
+        view_vectors = np.stack((np.sin(aspect_rad) * cos_slope, np.cos(aspect_rad) * cos_slope,
+                                 np.sin(slope_rad)), axis=-1)
+
+        if self.normal_map is None:
+            cell_normals = self.__get_cell_normal_arrays(y, x)
+        else:
+            cell_normals = np.asarray(self.normal_map[y, x], "d")
+
+        cosine = np.einsum("...j,...j->...", view_vectors, cell_normals) \
+            / (np.sqrt(np.einsum("...j,...j->...", view_vectors, view_vectors))
+               * np.sqrt(np.einsum("ij,ij->i", cell_normals, cell_normals)))
+        vector_angles = np.arccos(np.clip(cosine, -1, 1))
+
+        dist_y = (y - self.origin_y) * float(self.cell_resolution)
+        dist_x = (x - self.origin_x) * float(self.cell_resolution)
+        # the 3D distance is the horizontal distance divided by the cosine of the viewing slope
+        squared_distance = (dist_y * dist_y + dist_x * dist_x) / (cos_slope * cos_slope)
+
+        magnitudes = np.zeros(vector_angles.shape)
+        # the plane is not visible if the angle is not obtuse
+        seen = vector_angles > SpatialUtils.pi_pul
+        magnitudes[seen] = self.cell_resolution * self.cell_resolution / squared_distance[seen] \
+            * np.abs(np.cos(vector_angles[seen]))
+        return magnitudes
+
     """
     Calculate the angle from origin to the specified point. The angle is compensated for Earth's curvature and light 
     diffraction.
@@ -62,6 +131,24 @@ class SpatialUtils:
 
         return math.degrees(math.atan2(elevation_diff, direct_distance))
 
+    """
+    Calculate the angles from origin to the specified points. Array counterpart of get_viewing_slope. The points may
+    lie between the cell centres if their elevations are provided. If the origin elevation is a column of several
+    elevations (shape elevations x 1), the angles have a row for every elevation.
+    
+    :param y: array of y coordinates of the points
+    :param x: array of x coordinates of the points
+    :param elevation: (optional) array of elevations of the points, read from the elevation map by default
+    
+    :returns: array of vertical angles from origin to the specified points in degrees relative to horizon
+    """
+
+    def get_viewing_slopes(self, y, x, elevation=None):
+        dist_y, dist_x, elevation_diff = self.__get_yxz_difference_arrays(y, x, elevation)
+        direct_distance = np.sqrt(dist_x * dist_x + dist_y * dist_y)
+
+        return np.degrees(np.arctan2(elevation_diff, direct_distance))
+
     """
     Calculate cell slope.
     
@@ -111,6 +198,25 @@ class SpatialUtils:
         else:
             return abs(offset_angle - cell_angle) / total
 
+    """
+    Calculate the weights of the cells adjacent to the specified ones. Array counterpart of interpolate_weight.
+    
+    :param y: array of y coordinates of the cells
+    :param x: array of x coordinates of the cells
+    :returns: array of weights of the cells
+    """
+
+    def interpolate_weights(self, y, x):
+        adjacent, offset = self.get_los_cell_arrays(y, x)
+        cell_angle = self.get_viewing_aspects(y, x)
+        adjacent_angle = np.abs(self.get_viewing_aspects(adjacent[0], adjacent[1]) - cell_angle)
+        offset_angle = np.abs(self.get_viewing_aspects(offset[0], offset[1]) - cell_angle)
+        total = adjacent_angle + offset_angle
+
+        weights = np.ones(len(total))
+        np.divide(offset_angle, total, out=weights, where=total != 0)
+        return weights
+
     """
     Get the neighborhood cells in the line of sight based on a orientation code. 
 
@@ -122,27 +228,34 @@ class SpatialUtils:
 
     def get_los_cells(self, y, x):
         code = self.__get_orientation(y, x)
-        index_offsets = {
-            0x0020: [(0, 1), (0, 1)],
-            0x0100: [(0, 1), (1, 1)],
-            0x1200: [(1, 1), (1, 1)],
-            0x0000: [(1, 0), (1, 1)],
-            0x0002: [(1, 0), (1, 0)],
-            0x0001: [(1, 0), (1, -1)],
-            0x2101: [(1, -1), (1, -1)],
-            0x1001: [(0, -1), (1, -1)],
-            0x0021: [(0, -1), (0, -1)],
-            0x1011: [(0, -1), (-1, -1)],
-            0x1211: [(-1, -1), (-1, -1)],
-            0x1111: [(-1, 0), (-1, -1)],
-            0x0012: [(-1, 0), (-1, 0)],
-            0x1110: [(-1, 0), (-1, 1)],
-            0x2110: [(-1, 1), (-1, 1)],
-            0x0110: [(0, 1), (-1, 1)]
-        }.get(code, None)
+        index_offsets = SpatialUtils.index_offsets.get(code, None)
         return {"adjacent": [y + index_offsets[0][0], x + index_offsets[0][1]],
                 "offset": [y + index_offsets[1][0], x + index_offsets[1][1]]}
 
+    """
+    Get the neighborhood cells in the line of sight for arrays of cells. Array counterpart of get_los_cells, the
+    adjacent cell lies on the dominant axis towards the origin (or on the diagonal if there is none) and the offset
+    cell always lies on the diagonal towards the origin.
+    
+    :param y: array of y coordinates of the cells
+    :param x: array of x coordinates of the cells
+    
+    :returns: tuple of (y, x) index arrays of the adjacent cells and tuple of (y, x) index arrays of the offset cells
+    """
+
+    def get_los_cell_arrays(self, y, x):
+        relative_y = y - self.origin_y
+        relative_x = x - self.origin_x
+        step_y = -np.sign(relative_y)
+        step_x = -np.sign(relative_x)
+
+        abs_y = np.abs(relative_y)
+        abs_x = np.abs(relative_x)
+        adjacent_y = y + np.where(abs_x > abs_y, 0, step_y)
+        adjacent_x = x + np.where(abs_y > abs_x, 0, step_x)
+
+        return (adjacent_y, adjacent_x), (y + step_y, x + step_x)
+
     """
     Calculate an orientation code relative to the origin.
     
@@ -211,6 +324,20 @@ class SpatialUtils:
             math.atan2((y - self.origin_y) * self.cell_resolution, (x - self.origin_x) * self.cell_resolution))
         return (aspect + 450) % 360
 
+    """
+    Get the angles in degrees at which the cells are viewed. Array counterpart of __get_viewing_aspect.
+    North = 0, East = 90, South = 180, West = 270
+    
+    :param y: array of y coordinates of the cells
+    :param x: array of x coordinates of the cells
+    :returns: array of angles to the cells
+    """
+
+    def get_viewing_aspects(self, y, x):
+        aspect = np.degrees(
+            np.arctan2((y - self.origin_y) * self.cell_resolution, (x - self.origin_x) * self.cell_resolution))
+        return (aspect + 450) % 360
+
     """
     Calculate 3D distance between origin and the cell.
     
@@ -235,7 +362,7 @@ class SpatialUtils:
     """
 
     def __get_yxz_differences(self, y, x):
-        elevation = self.elevation_map[y, x]
+        elevation = float(self.elevation_map[y, x])
         dist_y = abs(self.origin_y - y) * self.cell_resolution
         dist_x = abs(self.origin_x - x) * self.cell_resolution
 
@@ -246,6 +373,62 @@ class SpatialUtils:
 
         return dist_y, dist_x, elevation_diff
 
+    """
+    Calculate differences between origin and cells for y, x coordinates and elevation adjusted for Earth's curvature.
+    Array counterpart of __get_yxz_differences.
+    
+    :param y: array of y coordinates of the cells
+    :param x: array of x coordinates of the cells
+    :param elevation: (optional) array of elevations of the cells, read from the elevation map by default
+    
+    :return: y-distances, x-distances, elevation differences
+    """
+
+    def __get_yxz_difference_arrays(self, y, x, elevation=None):
+        if elevation is None:
+            elevation = self.elevation_map[y, x]
+        dist_y = np.abs(self.origin_y - y) * float(self.cell_resolution)
+        dist_x = np.abs(self.origin_x - x) * float(self.cell_resolution)
+
+        direct_distance = np.sqrt(dist_x * dist_x + dist_y * dist_y)
+        curvature = direct_distance * direct_distance / 12740000
+
+        elevation_diff = elevation - curvature + SpatialUtils.light_refraction * curvature - self.origin_elevation
+
+        return dist_y, dist_x, elevation_diff
+
+    """
+    Calculate unit normals of the cells from the elevation map. Array counterpart of the normals made from
+    __get_cell_slope and __get_cell_aspect.
+    
+    :param cell_y: array of y coordinates of the cells
+    :param cell_x: array of x coordinates of the cells
+    
+    :returns: array of normal vectors (cells x 3)
+    """
+
+    def __get_cell_normal_arrays(self, cell_y, cell_x):
+        cn = math.sqrt(2)
+        top = np.maximum(cell_y - 1, 0)
+        bottom = np.minimum(cell_y + 1, self.elevation_map.shape[0] - 1)
+        left = np.maximum(cell_x - 1, 0)
+        right = np.minimum(cell_x + 1, self.elevation_map.shape[1] - 1)
+
+        def hood(y, x):
+            return np.asarray(self.elevation_map[y, x], "d")
+
+        westeast = ((cn * hood(top, left) + hood(cell_y, left) + cn * hood(bottom, left))
+                    - (cn * hood(top, right) + hood(cell_y, right) + cn * hood(bottom, right))) \
+            / (8 * self.cell_resolution)
+        northsouth = ((cn * hood(top, left) + hood(top, cell_x) + cn * hood(top, right))
+                      - (cn * hood(bottom, left) + hood(bottom, cell_x) + cn * hood(bottom, right))) \
+            / (8 * self.cell_resolution)
+
+        slope_rad = np.radians(np.degrees(np.sqrt(westeast * westeast + northsouth * northsouth)) + 90)
+        aspect_rad = np.radians((np.degrees(np.arctan2(-1 * northsouth, -1 * westeast)) + 630) % 360)
+        return np.stack((np.sin(aspect_rad) * np.cos(slope_rad), np.cos(aspect_rad) * np.cos(slope_rad),
+                         np.sin(slope_rad)), axis=-1)
+
     """
     Calculate East-West and North-South components of the cell slope.
     
@@ -277,31 +460,23 @@ class SpatialUtils:
                       (cn * hood[2][0] + hood[2][1] + hood[2][2])) / (8 * self.cell_resolution)
         """
         # following mess works the same as the commented out code above
+        # the neighbourhood is clamped to the map, i.e. the border cells are extended beyond the edges
         cn = math.sqrt(2)
-        # TODO: Border cases
-        try:
-            westeast = (
-                           (cn * self.elevation_map[cell_y - 1, cell_x - 1]
-                            + self.elevation_map[cell_y, cell_x - 1]
-                            + cn * self.elevation_map[cell_y + 1, cell_x - 1])
-                           - (cn * self.elevation_map[cell_y - 1, cell_x + 1]
-                              + self.elevation_map[cell_y, cell_x + 1]
-                              + cn * self.elevation_map[cell_y + 1, cell_x + 1])) \
-                       / (8 * self.cell_resolution)
-        except IndexError:
-            westeast = 0
-
-        try:
-            northsouth = (
-                             (cn * self.elevation_map[cell_y - 1, cell_x - 1]
-                              + self.elevation_map[cell_y - 1, cell_x]
-                              + cn * self.elevation_map[cell_y - 1, cell_x + 1])
-                             - (cn * self.elevation_map[cell_y + 1, cell_x - 1]
-                                + self.elevation_map[cell_y + 1, cell_x]
-                                + cn * self.elevation_map[cell_y + 1, cell_x + 1])) \
-                         / (8 * self.cell_resolution)
-        except IndexError:
-            northsouth = 0
+        top = max(cell_y - 1, 0)
+        bottom = min(cell_y + 1, self.elevation_map.shape[0] - 1)
+        left = max(cell_x - 1, 0)
+        right = min(cell_x + 1, self.elevation_map.shape[1] - 1)
+
+        def hood(y, x):
+            # numpy 2 keeps the arithmetic of single precision elevations in single precision
+            return float(self.elevation_map[y, x])
+
+        westeast = ((cn * hood(top, left) + hood(cell_y, left) + cn * hood(bottom, left))
+                    - (cn * hood(top, right) + hood(cell_y, right) + cn * hood(bottom, right))) \
+            / (8 * self.cell_resolution)
+        northsouth = ((cn * hood(top, left) + hood(top, cell_x) + cn * hood(top, right))
+                      - (cn * hood(bottom, left) + hood(bottom, cell_x) + cn * hood(bottom, right))) \
+            / (8 * self.cell_resolution)
 
         return westeast, northsouth
 
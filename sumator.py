@@ -1,22 +1,91 @@
+import os
+import sys
+import time
+
 import numpy as np
 
+from elevationmap import ElevationMap
+from workforcestats import WorkforceStats
+
+
+"""
+Sum the visual magnitude batches sent by the workers. The sumator blocks on the shared queue until a batch arrives and
+finishes when every worker has sent its end-of-work signal.
+The stats sent with the batches are aggregated into WorkforceStats. If a progress interval is specified, the stats are
+sent to the main process through the pipe at most once per interval. The final stats are always sent right before the
+result.
+If a checkpoint is provided, the accumulated visual magnitude and the completed viewpoints are saved to it periodically
+and at the end. A resumed run starts from the saved state. A memory-mapped output is not copied to the checkpoint, it
+is flushed in place and its changes are journaled (see Checkpoint.record), a run resumed with the same output file
+continues in it.
+
+:param results: queue shared with the workers
+:param main_pipe: pipe to the main process which receives the summed visual magnitude
+:param shape: shape of the elevation map
+:param num_workers: number of workers sending the results
+:param output_file: (optional) .npy file the visual magnitude is accumulated in, the raster is kept in memory if None
+:param total_viewpoints: (optional) number of viewpoints to be calculated, used for the progress
+:param progress_interval: (optional) minimal time in seconds between two progress messages, None for no progress
+:param checkpoint: (optional) Checkpoint instance
+:param dtype: (optional) dtype of the visual magnitude
+"""
+
+
+def sumator(results, main_pipe, shape, num_workers, output_file=None, total_viewpoints=0, progress_interval=None,
+            checkpoint=None, dtype="d"):
+    stats = WorkforceStats(total_viewpoints)
+    resume = checkpoint is not None and checkpoint.resume
+    if output_file is None:
+        visual_magnitude = np.zeros(shape, dtype)
+    elif resume and checkpoint.get_raster_file() == os.path.abspath(output_file):
+        # the checkpoint was saved in place of the output
+        visual_magnitude = np.load(output_file, mmap_mode="r+")
+    else:
+        # a new memory-mapped file is filled with zeros
+        visual_magnitude = np.lib.format.open_memmap(output_file, "w+", dtype, shape)
+    flat_magnitude = visual_magnitude.reshape(-1)
+    journaled = checkpoint is not None and output_file is not None
+    completed = []
+    if resume:
+        completed.append(checkpoint.restore(visual_magnitude))
+    last_progress = time.time()
+    active_workers = num_workers
+    while active_workers > 0:
+        start_time = time.time()
+        data = results.get()
+        stats.sumator_wait += time.time() - start_time
+        if data is None:
+            active_workers -= 1
+            continue
+
+        start_time = time.time()
+        origins, cells, magnitudes, worker_stats = data
+        if journaled:
+            checkpoint.record(flat_magnitude, cells)
+        np.add.at(flat_magnitude, cells, magnitudes)
+        stats.sumator_time += time.time() - start_time
+        stats.add(worker_stats)
+        if checkpoint is not None:
+            completed.append(np.array(origins, ElevationMap.viewpoint_dtype))
+            if checkpoint.is_due():
+                completed = [np.concatenate(completed)]
+                checkpoint.save(visual_magnitude, completed[0])
+        if progress_interval is not None and time.time() - last_progress >= progress_interval:
+            main_pipe.send(stats)
+            last_progress = time.time()
 
-def sumator(connections, main_pipe, shape):
-    visual_magnitude = np.zeros(shape, "d")
-    received_objects = 0
-    active_conns = len(connections)
-    while active_conns > 0:
-        for conn in connections:
-            if conn.poll():
-                data = conn.recv()
-                if data is None:
-                    active_conns -= 1
-                else:
-                    visual_magnitude[data[0]][data[1]] += data[2]
-                    received_objects += 1
-
-    # clean up, return the results to the main process and die
-    for conn in connections:
-        conn.close()
-    main_pipe.send(visual_magnitude)
-    print("Received {} results".format(received_objects))
+    # return the stats and the results (or the name of the file containing them) to the main process and die
+    if checkpoint is not None:
+        checkpoint.save(visual_magnitude, np.concatenate(completed) if completed
+                        else np.empty(0, ElevationMap.viewpoint_dtype))
+    stats.elapsed = time.time() - stats.start_time
+    # the line is written at once and before the results are sent, so the output of the main process does not run
+    # into it
+    sys.stdout.write("Received {} results\n".format(stats.get_completed()))
+    sys.stdout.flush()
+    main_pipe.send(stats)
+    if output_file is None:
+        main_pipe.send(visual_magnitude)
+    else:
+        visual_magnitude.flush()
+        main_pipe.send(output_file)
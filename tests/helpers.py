@@ -0,0 +1,48 @@
+import os
+import sys
+
+import numpy as np
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPOSITORY not in sys.path:
+    sys.path.insert(0, REPOSITORY)
+
+from elevationmap import ElevationMap  # noqa: E402
+
+DEM_FILE = os.path.join(REPOSITORY, "testData", "mhkdem.tif")
+XDRAW = os.path.join(REPOSITORY, "xdraw.py")
+CELL_RESOLUTION = 31
+OFFSET = 1.8
+
+"""
+Read a crop of the bundled elevation map, small enough for the engines to solve in a fraction of a second.
+
+:param rows: number of rows of the crop
+:param columns: number of columns of the crop
+:returns: ElevationMap instance with the crop
+"""
+
+
+def get_cropped_map(rows=80, columns=100):
+    elevation_map = ElevationMap()
+    elevation_map.read_map_file(DEM_FILE)
+    # a hilly part of the map, so both visible and hidden cells occur
+    elevation_map.set_map(np.ascontiguousarray(elevation_map.get_map()[150:150 + rows, 250:250 + columns]))
+    return elevation_map
+
+
+"""
+Get viewpoints along a diagonal path through a map.
+
+:param shape: shape of the map
+:param count: number of viewpoints
+:returns: array of viewpoints (see ElevationMap.viewpoint_dtype) with weights between 1 and 2
+"""
+
+
+def get_path(shape, count):
+    viewpoints = np.empty(count, ElevationMap.viewpoint_dtype)
+    viewpoints["y"] = np.linspace(2, shape[0] - 3, count).astype(np.intp)
+    viewpoints["x"] = np.linspace(3, shape[1] - 4, count).astype(np.intp)
+    viewpoints["weight"] = 1 + np.arange(count) / float(count)
+    return viewpoints
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from adaptivesampling import get_viewshed_difference, order_path, reweight_samples, sample_path
+from elevationmap import ElevationMap
+from helpers import CELL_RESOLUTION, OFFSET, get_cropped_map
+from visualmag_workforce import VisualMagWorkforce
+
+
+class AdaptiveSamplingTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="xdraw_test_")
+        # a straight path along a row of the map
+        self.viewpoints = np.empty(40, ElevationMap.viewpoint_dtype)
+        self.viewpoints["y"] = 40
+        self.viewpoints["x"] = np.arange(30, 70)
+        self.viewpoints["weight"] = 1 + np.arange(40) / 40.0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_workforce(self):
+        return VisualMagWorkforce(get_cropped_map(), CELL_RESOLUTION, OFFSET, 2, max_distance=30,
+                                  cache_directory=os.path.join(self.directory, "cache"))
+
+    def test_reweight_preserves_total_weight(self):
+        viewpoints = self.viewpoints[:5].copy()
+        viewpoints["weight"] = 1
+        # the viewpoint halfway between two samples splits its weight evenly
+        np.testing.assert_array_equal(reweight_samples(viewpoints, np.array([0, 4]))["weight"], [2.5, 2.5])
+        np.testing.assert_array_equal(reweight_samples(viewpoints, np.array([0, 2, 4]))["weight"], [1.5, 2, 1.5])
+        for samples in ([0, 39], [0, 8, 16, 24, 32, 39], [3, 4, 20], [39], list(range(40))):
+            sampled = reweight_samples(self.viewpoints, np.array(samples))
+            np.testing.assert_array_equal(sampled[["y", "x"]], self.viewpoints[samples][["y", "x"]])
+            self.assertAlmostEqual(sampled["weight"].sum(), self.viewpoints["weight"].sum(), places=12)
+
+    def test_refinement_stops_at_tolerance(self):
+        path = order_path(self.viewpoints)
+        positions = dict(((y, x), i) for i, (y, x, weight) in enumerate(path.tolist()))
+        for tolerance in (0.1, 0.3):
+            workforce = self.get_workforce()
+            sampled = sample_path(workforce, self.viewpoints, tolerance, initial_step=8)
+            self.assertAlmostEqual(sampled["weight"].sum(), self.viewpoints["weight"].sum(), places=12)
+            samples = sorted(positions[(y, x)] for y, x, weight in sampled.tolist())
+            self.assertEqual(samples[0], 0)
+            self.assertEqual(samples[-1], len(path) - 1)
+            # the consecutive samples are neighbours or their viewsheds are within the tolerance
+            for start, end in zip(samples[:-1], samples[1:]):
+                if end - start > 1:
+                    difference = get_viewshed_difference(workforce.cache.load(path[start]["y"], path[start]["x"]),
+                                                         workforce.cache.load(path[end]["y"], path[end]["x"]))
+                    self.assertLessEqual(difference, tolerance)
+
+    def test_zero_tolerance_samples_every_viewpoint(self):
+        sampled = sample_path(self.get_workforce(), self.viewpoints, 0, initial_step=8)
+        np.testing.assert_array_equal(np.sort(sampled), np.sort(self.viewpoints))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+from approximation import compare_precision, compare_with_exact
+from helpers import CELL_RESOLUTION, OFFSET, get_cropped_map, get_path
+
+
+class ApproximationTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.elevation_map = get_cropped_map(120, 150)
+        cls.viewpoints = get_path(cls.elevation_map.get_map().shape, 8)
+
+    def test_error_within_tolerance(self):
+        # the far cells are solved on coarse levels, so their magnitudes are only approximately right and the cells
+        # near the horizon may flip between visible and hidden, the total and the L1 error stay small
+        for band_distances in ([20], [40], [20, 40]):
+            report = compare_with_exact(self.elevation_map, self.viewpoints, CELL_RESOLUTION, OFFSET, band_distances)
+            self.assertLess(report["relative_total_error"], 5e-3)
+            self.assertLess(report["relative_l1_error"], 1e-2)
+            self.assertGreater(report["visibility_agreement"], 0.5)
+
+    def test_bands_beyond_map_are_exact(self):
+        report = compare_with_exact(self.elevation_map, self.viewpoints, CELL_RESOLUTION, OFFSET, [500])
+        self.assertEqual(report["relative_l1_error"], 0)
+        self.assertEqual(report["visibility_agreement"], 1)
+
+
+class PrecisionTest(unittest.TestCase):
+    def test_single_precision_error(self):
+        map_array = get_cropped_map(120, 150).get_map()
+        viewpoints = get_path(map_array.shape, 8)
+        for engine in ("vectorized", "sweep"):
+            for max_distance in (None, 30):
+                report = compare_precision(map_array, viewpoints, CELL_RESOLUTION, OFFSET, max_distance=max_distance,
+                                           engine=engine)
+                # the magnitudes are rounded to single precision, about 3e-8 relative, but no cell flips
+                self.assertLess(report["relative_l1_error"], 1e-6)
+                self.assertLess(report["relative_total_error"], 1e-6)
+                self.assertEqual(report["visibility_agreement"], 1)
+                self.assertEqual(report["single_raster_bytes"] * 2, report["double_raster_bytes"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import cv2
+import numpy as np
+
+from checkpoint import Checkpoint
+from elevationmap import ElevationMap
+from helpers import XDRAW, get_cropped_map, get_path
+
+
+class CheckpointResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="xdraw_test_")
+        elevation_map = get_cropped_map(200, 250)
+        self.dem = os.path.join(self.directory, "dem.npy")
+        np.save(self.dem, elevation_map.get_map())
+        viewpoints = get_path(elevation_map.get_map().shape, 60)
+        path = np.zeros(elevation_map.get_map().shape, np.float32)
+        path[viewpoints["y"], viewpoints["x"]] = viewpoints["weight"]
+        self.path = os.path.join(self.directory, "path.tif")
+        cv2.imwrite(self.path, path)
+        self.viewpoint_count = len(viewpoints)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_xdraw(self, output, *options):
+        return [sys.executable, XDRAW, self.dem, self.path, os.path.join(self.directory, output), "--workers", "1",
+                "--engine", "reference", "--max-distance", "40"] + list(options)
+
+    """
+    Count the viewpoints saved in the checkpoint, the checkpoint may be replaced while it is read.
+    """
+
+    @staticmethod
+    def get_completed(checkpoint_file):
+        try:
+            with np.load(checkpoint_file) as checkpoint:
+                return len(checkpoint["completed"])
+        except (IOError, OSError, ValueError, KeyError):
+            return 0
+
+    @unittest.skipIf(not hasattr(os, "killpg"), "requires process groups")
+    def test_resume_after_kill(self):
+        checkpoint_file = os.path.join(self.directory, "checkpoint.npz")
+        options = ["--checkpoint", checkpoint_file, "--checkpoint-interval", "0.2"]
+        with open(os.devnull, "w") as devnull:
+            # the run gets its own process group, so the sumator and the workers are killed with it
+            process = subprocess.Popen(self.run_xdraw("resumed.npy", *options), stdout=devnull, stderr=devnull,
+                                       preexec_fn=os.setsid)
+            deadline = time.time() + 120
+            while process.poll() is None and time.time() < deadline and not self.get_completed(checkpoint_file):
+                time.sleep(0.05)
+            finished = process.poll() is not None
+            if not finished:
+                os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+        self.assertFalse(finished, "the run finished before it could be interrupted")
+        completed = self.get_completed(checkpoint_file)
+        self.assertGreater(completed, 0)
+        self.assertLess(completed, self.viewpoint_count)
+
+        output = subprocess.check_output(self.run_xdraw("resumed.npy", *options), stderr=subprocess.STDOUT)
+        self.assertIn("Resumed from the checkpoint, {} viewpoints were completed".format(completed),
+                      output.decode("utf-8"))
+        subprocess.check_call(self.run_xdraw("uninterrupted.npy"), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+        resumed = np.load(os.path.join(self.directory, "resumed.npy"))
+        uninterrupted = np.load(os.path.join(self.directory, "uninterrupted.npy"))
+        self.assertGreater(np.count_nonzero(uninterrupted), 0)
+        np.testing.assert_allclose(resumed, uninterrupted, rtol=1e-12, atol=0)
+        with np.load(checkpoint_file) as checkpoint:
+            self.assertEqual(len(checkpoint["completed"]), self.viewpoint_count)
+
+
+class InPlaceCheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="xdraw_test_")
+        self.filename = os.path.join(self.directory, "checkpoint.npz")
+        self.output = os.path.join(self.directory, "output.npy")
+        self.completed = get_path((50, 60), 3)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    """
+    Save a memory-mapped raster in place, change it further as the sumator does and stop without saving, as if the run
+    was killed.
+    """
+
+    def interrupt_run(self):
+        random = np.random.RandomState(0)
+        visual_magnitude = np.lib.format.open_memmap(self.output, "w+", "d", (2, 50, 60))
+        visual_magnitude[...] = random.rand(2, 50, 60)
+        checkpoint = Checkpoint(self.filename, "key")
+        checkpoint.save(visual_magnitude, self.completed)
+        saved = np.array(visual_magnitude)
+
+        flat_magnitude = visual_magnitude.reshape(-1)
+        for batch in range(3):
+            cells = random.randint(0, flat_magnitude.size, 500)
+            checkpoint.record(flat_magnitude, cells)
+            np.add.at(flat_magnitude, cells, random.rand(500))
+        visual_magnitude.flush()
+        checkpoint.close_journal()
+        self.assertFalse(np.array_equal(np.load(self.output), saved))
+        return saved
+
+    def restore(self, visual_magnitude):
+        checkpoint = Checkpoint(self.filename, "key")
+        self.assertTrue(checkpoint.exists())
+        self.assertEqual(checkpoint.get_raster_file(), os.path.abspath(self.output))
+        completed = checkpoint.restore(visual_magnitude, block_rows=7)
+        np.testing.assert_array_equal(completed, self.completed.astype(ElevationMap.viewpoint_dtype))
+
+    def test_restore_in_place(self):
+        saved = self.interrupt_run()
+        visual_magnitude = np.load(self.output, mmap_mode="r+")
+        self.restore(visual_magnitude)
+        np.testing.assert_array_equal(visual_magnitude, saved)
+
+    def test_restore_into_other_raster(self):
+        saved = self.interrupt_run()
+        visual_magnitude = np.zeros(saved.shape)
+        self.restore(visual_magnitude)
+        np.testing.assert_array_equal(visual_magnitude, saved)
+
+    def test_missing_raster_is_not_resumed(self):
+        self.interrupt_run()
+        os.remove(self.output)
+        self.assertFalse(Checkpoint(self.filename, "key").exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
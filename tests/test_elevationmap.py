@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from elevationmap import ElevationMap
+from helpers import CELL_RESOLUTION, get_cropped_map
+from spatialutils import SpatialUtils
+
+
+class TerrainDerivativesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="xdraw_test_")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_cell_normal(self, elevation_map, y, x):
+        utils = SpatialUtils(0, 0, 0.0, CELL_RESOLUTION, elevation_map)
+        # the per-cell slope and aspect clamp the neighbourhood to the map
+        return utils._SpatialUtils__make_directional_vector(utils._SpatialUtils__get_cell_aspect(y, x),
+                                                            utils._SpatialUtils__get_cell_slope(y, x))
+
+    def test_border_normals_equal_cell_normals(self):
+        elevation_map = get_cropped_map(30, 40)
+        map_array = elevation_map.get_map()
+        height, width = map_array.shape
+        border = [(y, x) for y in range(height) for x in range(width)
+                  if y in (0, 1, height - 2, height - 1) or x in (0, 1, width - 2, width - 1)]
+        # a single block, blocks not aligned with the map and blocks of a memory-mapped file
+        for directory, block_rows in ((None, 1024), (None, 7), (self.directory, 4)):
+            elevation_map.set_map(map_array)
+            elevation_map.compute_terrain_derivatives(CELL_RESOLUTION, directory, block_rows, "d")
+            normals = elevation_map.get_normals()
+            self.assertEqual(normals.shape, (height, width, 3))
+            for y, x in border:
+                np.testing.assert_allclose(normals[y, x], self.get_cell_normal(map_array, y, x), rtol=0, atol=1e-12)
+            # the rows between the blocks are the same as if the whole map was processed at once
+            np.testing.assert_array_equal(normals, ElevationMap.get_terrain_derivatives(map_array, CELL_RESOLUTION)[2])
+
+
+class ViewpointTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="xdraw_test_")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read_per_pixel(self, path):
+        # the viewpoints as read before the vectorized version
+        viewpoints = []
+        for y in range(path.shape[0]):
+            for x in range(path.shape[1]):
+                if path[y][x] > 0:
+                    viewpoints.append([y, x, path[y][x]])
+        return viewpoints
+
+    def test_read_viewpoints_equals_per_pixel(self):
+        random = np.random.RandomState(0)
+        for dtype in (np.uint8, np.uint16, np.float32):
+            path = np.zeros((20, 30), dtype)
+            # a diagonal, a branch along a row, zero weights and, for floats, negative and fractional weights
+            path[np.arange(20), np.arange(20)] = random.randint(1, 200, 20)
+            path[7, 10:30] = 3
+            path[7, 15] = 0
+            path[12, :5] = 0
+            if dtype == np.float32:
+                path[0, 29] = -2.5
+                path[19, 25] = 0.25
+            filename = os.path.join(self.directory, "path_{}.tif".format(np.dtype(dtype).name))
+            self.assertTrue(cv2.imwrite(filename, path))
+
+            viewpoints = ElevationMap().read_viewpoints(filename)
+            self.assertEqual(viewpoints.dtype, ElevationMap.viewpoint_dtype)
+            self.assertEqual(viewpoints.tolist(), [tuple(viewpoint) for viewpoint in self.read_per_pixel(path)])
+            self.assertTrue(np.all(viewpoints["weight"] > 0))
+
+    def test_missing_viewpoints(self):
+        with self.assertRaises(IOError):
+            ElevationMap().read_viewpoints(os.path.join(self.directory, "missing.tif"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+import numpy as np
+
+from helpers import get_path
+from scheduler import get_viewpoint_costs, schedule_viewpoints
+
+
+class ScheduleViewpointsTest(unittest.TestCase):
+    shape = (419, 546)
+
+    def test_chunks_are_balanced_between_workers(self):
+        viewpoints = get_path(self.shape, 60)
+        chunks = schedule_viewpoints(viewpoints, self.shape, 64, worker_count=4)
+        self.assertGreaterEqual(len(chunks), 16)
+        self.assertTrue(all(len(chunk) <= 4 for chunk in chunks))
+        # every viewpoint is scheduled exactly once
+        scheduled = np.sort(np.concatenate(chunks), order=["y", "x"])
+        np.testing.assert_array_equal(scheduled, np.sort(viewpoints, order=["y", "x"]))
+
+    def test_expensive_chunks_are_smaller(self):
+        # the viewpoints in the corner see only a quarter of the cells within the maximal distance
+        viewpoints = np.concatenate([get_path((40, 40), 200), get_path((200, 200), 40)])
+        viewpoints["y"][200:] += 100
+        viewpoints["x"][200:] += 100
+        chunks = schedule_viewpoints(viewpoints, self.shape, 64, max_distance=60, worker_count=2)
+        costs = [get_viewpoint_costs(chunk, self.shape, 60).sum() for chunk in chunks]
+        total = sum(costs)
+        self.assertTrue(all(cost <= total / 8.0 + get_viewpoint_costs(viewpoints, self.shape, 60).max()
+                            for cost in costs))
+        self.assertEqual(list(costs), sorted(costs, reverse=True))
+        expensive = max(len(chunk) for chunk in chunks if chunk["y"][0] >= 100)
+        cheap = max(len(chunk) for chunk in chunks if chunk["y"][0] < 100)
+        self.assertLess(expensive, cheap)
+
+    def test_chunks_do_not_cross_tiles(self):
+        viewpoints = get_path(self.shape, 60)
+        for chunk in schedule_viewpoints(viewpoints, self.shape, 64, max_distance=40, tile_size=100, worker_count=4):
+            self.assertEqual(len(set(zip(chunk["y"] // 100, chunk["x"] // 100))), 1)
+
+    def test_no_viewpoints(self):
+        self.assertEqual(schedule_viewpoints(get_path(self.shape, 0), self.shape, 64, worker_count=4), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
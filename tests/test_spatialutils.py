@@ -0,0 +1,51 @@
+import unittest
+
+import numpy as np
+
+from helpers import CELL_RESOLUTION, OFFSET, get_cropped_map
+from spatialutils import SpatialUtils
+
+
+class VisualMagnitudeTest(unittest.TestCase):
+    origin_y = 40
+    origin_x = 50
+
+    @classmethod
+    def setUpClass(cls):
+        elevation_map = get_cropped_map()
+        elevation_map.compute_terrain_derivatives(CELL_RESOLUTION)
+        cls.map = elevation_map.get_map()
+        cls.normals = elevation_map.get_normals()
+        cells_y, cells_x = np.nonzero(np.ones(cls.map.shape, bool))
+        origin = (cells_y == cls.origin_y) & (cells_x == cls.origin_x)
+        cls.cells_y = cells_y[~origin]
+        cls.cells_x = cells_x[~origin]
+
+    def get_expected(self, origin_elevation, normal_map):
+        utils = SpatialUtils(self.origin_y, self.origin_x, origin_elevation, CELL_RESOLUTION, self.map, normal_map)
+        return np.array([utils.visual_magnitude(y, x) for y, x in zip(self.cells_y.tolist(), self.cells_x.tolist())])
+
+    def test_batch_equals_single_cells(self):
+        origin_elevation = float(self.map[self.origin_y, self.origin_x]) + OFFSET
+        for normal_map in (self.normals, None):
+            utils = SpatialUtils(self.origin_y, self.origin_x, origin_elevation, CELL_RESOLUTION, self.map, normal_map)
+            expected = self.get_expected(origin_elevation, normal_map)
+            result = utils.visual_magnitudes(self.cells_y, self.cells_x)
+            self.assertGreater(np.count_nonzero(expected), 0)
+            np.testing.assert_array_equal(result > 0, expected > 0)
+            np.testing.assert_allclose(result, expected, rtol=1e-10, atol=0)
+
+    def test_heights_equal_separate_elevations(self):
+        # a column of origin elevations gives a row of magnitudes for every elevation
+        origin_elevations = float(self.map[self.origin_y, self.origin_x]) + np.array([[OFFSET], [5.0], [25.0]])
+        utils = SpatialUtils(self.origin_y, self.origin_x, origin_elevations, CELL_RESOLUTION, self.map, self.normals)
+        result = utils.visual_magnitudes(self.cells_y, self.cells_x)
+        self.assertEqual(result.shape, (3, len(self.cells_y)))
+        for row, origin_elevation in zip(result, origin_elevations[:, 0].tolist()):
+            expected = self.get_expected(origin_elevation, self.normals)
+            np.testing.assert_array_equal(row > 0, expected > 0)
+            np.testing.assert_allclose(row, expected, rtol=1e-10, atol=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from helpers import CELL_RESOLUTION, OFFSET, get_cropped_map, get_path
+from viewshedstore import ViewshedStore
+from visualmag_workforce import VisualMagWorkforce
+from xdrawengine import VectorizedEngine
+
+
+class ViewshedStoreTest(unittest.TestCase):
+    max_distance = 30
+
+    @classmethod
+    def setUpClass(cls):
+        elevation_map = get_cropped_map()
+        elevation_map.compute_terrain_derivatives(CELL_RESOLUTION)
+        cls.map = elevation_map.get_map()
+        cls.engine = VectorizedEngine(cls.map, CELL_RESOLUTION, 0, cls.max_distance, elevation_map.get_normals())
+        cls.viewpoints = get_path(cls.map.shape, 8)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="xdraw_test_")
+        self.filename = os.path.join(self.directory, "viewsheds.npy")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_visible(self):
+        visible = {}
+        for y, x, weight in self.viewpoints.tolist():
+            visible_y, visible_x, magnitudes = self.engine.solve(y, x, float(self.map[y, x]) + OFFSET)
+            visible[(y, x)] = set(zip(visible_y.tolist(), visible_x.tolist()))
+        return visible
+
+    def check_store(self, store, visible):
+        for (y, x), cells in visible.items():
+            visible_y, visible_x = store.get_visible_cells(y, x)
+            self.assertEqual(set(zip(visible_y.tolist(), visible_x.tolist())), cells)
+        for cell in ((40, 50), (10, 20), (70, 90), (0, 0)):
+            observers_y, observers_x = store.get_observers(*cell)
+            self.assertEqual(set(zip(observers_y.tolist(), observers_x.tolist())),
+                             set(viewpoint for viewpoint, cells in visible.items() if cell in cells))
+
+    def test_workforce_run_round_trip(self):
+        workforce = VisualMagWorkforce(get_cropped_map(), CELL_RESOLUTION, OFFSET, 2, max_distance=self.max_distance,
+                                       viewshed_file=self.filename)
+        workforce.add_tasks(self.viewpoints)
+        workforce.start_workers()
+        workforce.get_result()
+        workforce.wait_to_finish()
+
+        store = ViewshedStore(self.filename)
+        self.assertEqual(len(store.get_unsolved()[0]), 0)
+        self.check_store(store, self.get_visible())
+
+    def test_unsolved_viewpoints(self):
+        visible = self.get_visible()
+        store = ViewshedStore.create(self.filename, self.viewpoints, self.map.shape, self.max_distance)
+        for (y, x), cells in visible.items():
+            visible_y, visible_x = zip(*cells)
+            store.write(y, x, np.array(visible_y), np.array(visible_x))
+        # the masks of the viewpoints which were being solved when a run was interrupted may already be written
+        unsolved = self.viewpoints[[0, 5]][["y", "x"]].tolist()
+        for y, x in unsolved:
+            store.index["solved"][store.find(y, x)] = False
+        store.flush()
+        del store
+
+        store = ViewshedStore(self.filename)
+        unsolved_y, unsolved_x = store.get_unsolved()
+        self.assertEqual(sorted(zip(unsolved_y.tolist(), unsolved_x.tolist())), sorted(unsolved))
+        for y, x in unsolved:
+            with self.assertRaises(ValueError):
+                store.get_viewshed(y, x)
+        self.check_store(store, dict((viewpoint, cells) for viewpoint, cells in visible.items()
+                                     if viewpoint not in unsolved))
+
+if __name__ == "__main__":
+    unittest.main()
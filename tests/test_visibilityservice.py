@@ -0,0 +1,80 @@
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from helpers import CELL_RESOLUTION, OFFSET, get_cropped_map
+
+if sys.version_info >= (3, 6):
+    import asyncio
+    from visibilityservice import VisibilityService, query
+
+
+@unittest.skipIf(sys.version_info < (3, 6) or not hasattr(socket, "AF_UNIX"),
+                 "requires Python 3.6 and Unix domain sockets")
+class VisibilityServiceTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp(prefix="xdraw_test_")
+        cls.output_directory = os.path.join(cls.directory, "results")
+        os.mkdir(cls.output_directory)
+        cls.path = os.path.join(cls.directory, "service.sock")
+        elevation_map = get_cropped_map()
+        cls.shape = elevation_map.get_map().shape
+        cls.service = VisibilityService(elevation_map, CELL_RESOLUTION, OFFSET, max_distance=30,
+                                        output_directory=cls.output_directory)
+
+        def serve():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(cls.service.serve(cls.path))
+            loop.close()
+
+        cls.thread = threading.Thread(target=serve)
+        cls.thread.start()
+        deadline = time.time() + 30
+        while not os.path.exists(cls.path) and time.time() < deadline:
+            time.sleep(0.01)
+
+    @classmethod
+    def tearDownClass(cls):
+        list(query({"type": "shutdown"}, cls.path))
+        cls.thread.join()
+        shutil.rmtree(cls.directory)
+
+    def test_visual_magnitude_is_sum_of_viewsheds(self):
+        viewpoints = [[20, 30, 1.0], [40, 60, 2.0]]
+        expected = np.zeros(self.shape).reshape(-1)
+        responses = list(query({"id": 1, "type": "viewshed", "viewpoints": viewpoints}, self.path))
+        self.assertEqual(len(responses), len(viewpoints))
+        for response in responses:
+            weight = [viewpoint[2] for viewpoint in viewpoints if viewpoint[:2] == [response["y"], response["x"]]][0]
+            np.add.at(expected, response["cells"], np.array(response["magnitudes"]) * weight)
+
+        responses = list(query({"id": 2, "type": "visual_magnitude", "viewpoints": viewpoints,
+                                "output": "result.npy"}, self.path))
+        self.assertEqual(responses[-1]["type"], "result")
+        self.assertEqual(responses[-1]["output"], os.path.join(self.output_directory, "result.npy"))
+        np.testing.assert_allclose(np.load(responses[-1]["output"]).reshape(-1), expected, rtol=1e-12, atol=0)
+
+    def test_output_outside_directory_is_rejected(self):
+        for output in ("../result.npy", os.path.join(self.directory, "result.npy")):
+            responses = list(query({"id": 3, "type": "visual_magnitude", "viewpoints": [[20, 30, 1.0]],
+                                    "output": output}, self.path))
+            self.assertEqual([response["type"] for response in responses], ["error"])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "result.npy")))
+
+    def test_request_without_viewpoints_is_answered(self):
+        for request_type in ("viewshed", "visual_magnitude"):
+            responses = list(query({"id": 4, "type": request_type, "viewpoints": []}, self.path))
+            self.assertEqual([response["type"] for response in responses], ["error"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from elevationmap import ElevationMap
+from helpers import CELL_RESOLUTION, OFFSET, get_cropped_map, get_path
+from resultcache import ResultCache
+from shards import get_shard, merge_partials, write_partial
+from visualmag_workforce import VisualMagWorkforce
+from xdrawengine import VectorizedEngine
+
+
+class WorkforceTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="xdraw_test_")
+        self.viewpoints = get_path(get_cropped_map().get_map().shape, 12)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_workforce(self, viewpoints, elevation_map=None, **options):
+        workforce = VisualMagWorkforce(elevation_map or get_cropped_map(), CELL_RESOLUTION, OFFSET, 2, max_distance=30,
+                                       **options)
+        workforce.add_tasks(viewpoints)
+        workforce.start_workers()
+        result = np.array(workforce.get_result())
+        workforce.wait_to_finish()
+        return result, workforce
+
+    def test_cache_hit_equals_solve(self):
+        cache_directory = os.path.join(self.directory, "cache")
+        solved, workforce = self.run_workforce(self.viewpoints, cache_directory=cache_directory)
+        self.assertEqual(workforce.get_stats().get_totals().cached_viewpoints, 0)
+        cached, workforce = self.run_workforce(self.viewpoints, cache_directory=cache_directory)
+        self.assertEqual(workforce.get_stats().get_totals().cached_viewpoints, len(self.viewpoints))
+        self.assertGreater(np.count_nonzero(solved), 0)
+        np.testing.assert_allclose(cached, solved, rtol=1e-12, atol=0)
+
+    def test_stats_count_viewpoints_and_cells(self):
+        elevation_map = get_cropped_map()
+        elevation_map.compute_terrain_derivatives(CELL_RESOLUTION)
+        map_array = elevation_map.get_map()
+        engine = VectorizedEngine(map_array, CELL_RESOLUTION, 0, 30, elevation_map.get_normals())
+        visible_cells = 0
+        cells = 0
+        for y, x, weight in self.viewpoints.tolist():
+            visible_cells += len(engine.solve(y, x, float(map_array[y, x]) + OFFSET)[0])
+            # every cell of the window around the viewpoint except the viewpoint itself
+            top, left, bottom, right = ElevationMap.get_window(y, x, map_array.shape, 30)
+            cells += (bottom - top) * (right - left) - 1
+
+        result, workforce = self.run_workforce(self.viewpoints)
+        stats = workforce.get_stats()
+        totals = stats.get_totals()
+        self.assertEqual(stats.get_completed(), len(self.viewpoints))
+        self.assertEqual(stats.get_progress(), 1.0)
+        self.assertEqual(totals.viewpoints, len(self.viewpoints))
+        self.assertEqual(totals.cached_viewpoints, 0)
+        self.assertEqual(totals.visible_cells, visible_cells)
+        self.assertEqual(totals.cells, cells)
+        self.assertAlmostEqual(totals.get_visible_ratio(), float(visible_cells) / cells)
+        self.assertLessEqual(len(stats.workers), 2)
+
+    def test_shard_merge_equals_single_run(self):
+        expected, workforce = self.run_workforce(self.viewpoints)
+        partials = []
+        for shard_index in range(3):
+            viewpoint_ids = get_shard(len(self.viewpoints), shard_index, 3)
+            result, workforce = self.run_workforce(self.viewpoints[viewpoint_ids])
+            partials.append(os.path.join(self.directory, "part{}.npz".format(shard_index)))
+            write_partial(partials[-1], result, ResultCache.get_map_hash(get_cropped_map().get_map()),
+                          workforce.parameters, self.viewpoints, viewpoint_ids)
+
+        merged, metadata = merge_partials(partials)
+        self.assertEqual(metadata["merged_viewpoints"], len(self.viewpoints))
+        np.testing.assert_allclose(merged, expected, rtol=1e-12, atol=0)
+        with self.assertRaises(ValueError):
+            merge_partials(partials[:2])
+
+    def test_tiled_run_equals_untiled_run(self):
+        expected, workforce = self.run_workforce(self.viewpoints)
+        memmap_directory = os.path.join(self.directory, "memmap")
+        os.mkdir(memmap_directory)
+        result, workforce = self.run_workforce(self.viewpoints, tile_size=32, memmap_directory=memmap_directory)
+        np.testing.assert_allclose(result, expected, rtol=1e-12, atol=1e-18)
+        self.assertTrue(os.path.isfile(os.path.join(memmap_directory, "visual_magnitude.npy")))
+
+    def test_memmapped_input_and_output_equal_in_memory_run(self):
+        expected, workforce = self.run_workforce(self.viewpoints)
+        map_file = os.path.join(self.directory, "dem.npy")
+        np.save(map_file, get_cropped_map().get_map())
+        memmap_directory = os.path.join(self.directory, "memmap")
+        os.mkdir(memmap_directory)
+        elevation_map = ElevationMap()
+        elevation_map.read_map_file(map_file)
+        output_file = os.path.join(self.directory, "visual_magnitude.npy")
+        workforce = VisualMagWorkforce(elevation_map, CELL_RESOLUTION, OFFSET, 2, max_distance=30,
+                                       memmap_directory=memmap_directory, output_file=output_file)
+        workforce.add_tasks(self.viewpoints)
+        workforce.start_workers()
+        result = workforce.get_result()
+        workforce.wait_to_finish()
+        self.assertIsInstance(result, np.memmap)
+        np.testing.assert_allclose(result, expected, rtol=1e-12, atol=1e-18)
+        np.testing.assert_allclose(np.load(output_file), expected, rtol=1e-12, atol=1e-18)
+
+    def test_memmapped_map_is_converted_out_of_core(self):
+        map_file = os.path.join(self.directory, "dem.npy")
+        np.save(map_file, get_cropped_map().get_map().astype(np.float64))
+        memmap_directory = os.path.join(self.directory, "memmap")
+        os.mkdir(memmap_directory)
+        elevation_map = ElevationMap()
+        elevation_map.read_map_file(map_file)
+        result, workforce = self.run_workforce(self.viewpoints, elevation_map, precision="single",
+                                               memmap_directory=memmap_directory)
+
+        # the single precision map is a memory-mapped file in the memmap directory, not a copy in the memory
+        converted = elevation_map.get_map()
+        self.assertIsInstance(converted, np.memmap)
+        self.assertEqual(converted.dtype, np.float32)
+        self.assertEqual(os.path.dirname(os.path.abspath(converted.filename)), os.path.abspath(memmap_directory))
+        np.testing.assert_array_equal(converted, np.load(map_file).astype(np.float32))
+        expected, workforce = self.run_workforce(self.viewpoints, precision="single")
+        # the float32 sums depend on the order the batches of the workers arrive in
+        np.testing.assert_allclose(result, expected, rtol=1e-5, atol=1e-9)
+
+
+if __name__ == '__main__':
+    unittest.main()
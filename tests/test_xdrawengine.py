@@ -0,0 +1,126 @@
+import unittest
+
+import numpy as np
+
+from geometrytable import GeometryTable
+from elevationmap import ElevationMap
+from helpers import CELL_RESOLUTION, OFFSET, get_cropped_map
+from spatialutils import SpatialUtils
+from xdrawengine import ReferenceEngine, SweepEngine, VectorizedEngine
+
+
+class EngineTest(unittest.TestCase):
+    # inside the map, on its border and in its corners
+    viewpoints = [(40, 50), (0, 0), (79, 99), (0, 60), (25, 99), (60, 3)]
+
+    @classmethod
+    def setUpClass(cls):
+        elevation_map = get_cropped_map()
+        elevation_map.compute_terrain_derivatives(CELL_RESOLUTION)
+        cls.map = elevation_map.get_map()
+        cls.normals = elevation_map.get_normals()
+
+    def get_raster(self, result):
+        raster = np.zeros(self.map.shape)
+        np.add.at(raster, (result[0], result[1]), result[2])
+        return raster
+
+    def solve(self, engine, y, x, offset=OFFSET):
+        return self.get_raster(engine.solve(y, x, float(self.map[y, x]) + offset))
+
+    def test_vectorized_equals_reference(self):
+        for omitted_rings, max_distance in ((0, None), (2, 30)):
+            reference = ReferenceEngine(self.map, CELL_RESOLUTION, omitted_rings, max_distance, self.normals)
+            geometry = GeometryTable.build(max_distance or max(self.map.shape) - 1, CELL_RESOLUTION)
+            for engine in (VectorizedEngine(self.map, CELL_RESOLUTION, omitted_rings, max_distance, self.normals),
+                           VectorizedEngine(self.map, CELL_RESOLUTION, omitted_rings, max_distance, self.normals,
+                                            geometry)):
+                for y, x in self.viewpoints:
+                    expected = self.solve(reference, y, x)
+                    result = self.solve(engine, y, x)
+                    np.testing.assert_array_equal(result > 0, expected > 0)
+                    np.testing.assert_allclose(result, expected, rtol=1e-12, atol=0)
+
+    def test_geometry_table_equals_calculated_geometry(self):
+        # the octants are folded, otherwise the weights are the calculated ones, rounded weights would flip the
+        # visibility of the cells on near ties of the LOS
+        radius = 30
+        geometry = GeometryTable.build(radius, CELL_RESOLUTION)
+        for origin_y, origin_x in ((40, 50), (30, 31)):
+            cells_y, cells_x = np.indices((2 * radius + 1, 2 * radius + 1)).reshape(2, -1)
+            cells_y += origin_y - radius
+            cells_x += origin_x - radius
+            origin = (cells_y == origin_y) & (cells_x == origin_x)
+            cells_y, cells_x = cells_y[~origin], cells_x[~origin]
+            spatial = SpatialUtils(origin_y, origin_x, 0, CELL_RESOLUTION, None)
+            np.testing.assert_allclose(geometry.interpolate_weights(cells_y, cells_x, origin_y, origin_x),
+                                       spatial.interpolate_weights(cells_y, cells_x), rtol=0, atol=1e-12)
+
+    def test_sectors_sum_to_solve(self):
+        for engine, sector_count in ((VectorizedEngine, 8), (SweepEngine, 1), (SweepEngine, 5), (SweepEngine, 64)):
+            for max_distance in (None, 30):
+                solver = engine(self.map, CELL_RESOLUTION, 0, max_distance, self.normals)
+                for y, x in self.viewpoints:
+                    elevation = float(self.map[y, x]) + OFFSET
+                    expected = self.solve(solver, y, x)
+                    total = np.zeros(self.map.shape)
+                    counts = np.zeros(self.map.shape, int)
+                    for sector in range(sector_count):
+                        result = solver.solve_sector(y, x, elevation, sector, sector_count)
+                        total += self.get_raster(result)
+                        np.add.at(counts, (result[0], result[1]), 1)
+                    # every visible cell belongs to exactly one sector
+                    self.assertLessEqual(counts.max(), 1)
+                    np.testing.assert_array_equal(total > 0, expected > 0)
+                    np.testing.assert_allclose(total, expected, rtol=1e-12, atol=0)
+
+    def test_solve_heights_equals_separate_solves(self):
+        offsets = [OFFSET, 5.0, 25.0]
+        for max_distance in (None, 30):
+            engine = VectorizedEngine(self.map, CELL_RESOLUTION, 1, max_distance, self.normals)
+            for y, x in self.viewpoints:
+                elevations = [float(self.map[y, x]) + offset for offset in offsets]
+                for offset, result in zip(offsets, engine.solve_heights(y, x, elevations)):
+                    np.testing.assert_array_equal(self.get_raster(result), self.solve(engine, y, x, offset))
+
+
+class SyntheticTerrainTest(unittest.TestCase):
+    # on both sides of the ridges, not on them where the cells along a ridge are seen at grazing angles
+    viewpoints = [(20, 25), (0, 0), (40, 50), (10, 40), (33, 8)]
+
+    def get_terrains(self):
+        flat = np.full((41, 51), 100.0)
+        # a wall across the columns and one across the rows, the cells behind them are hidden
+        column_ridge = flat.copy()
+        column_ridge[:, 30] += 20
+        row_ridge = flat.copy()
+        row_ridge[25, :] += 15
+        return flat, column_ridge, row_ridge
+
+    def get_raster(self, shape, result):
+        raster = np.zeros(shape)
+        np.add.at(raster, (result[0], result[1]), result[2])
+        return raster
+
+    def test_sweep_equals_reference(self):
+        # the sight lines of the sweep and the LOS of XDraw only differ where the terrain between the rings is uneven,
+        # on a flat terrain and behind a straight ridge both engines see the same cells
+        for terrain in self.get_terrains():
+            elevation_map_obj = ElevationMap()
+            elevation_map_obj.set_map(terrain)
+            elevation_map_obj.compute_terrain_derivatives(CELL_RESOLUTION)
+            elevation_map = elevation_map_obj.get_map()
+            normals = elevation_map_obj.get_normals()
+            for omitted_rings, max_distance in ((0, None), (2, 15)):
+                reference = ReferenceEngine(elevation_map, CELL_RESOLUTION, omitted_rings, max_distance, normals)
+                sweep = SweepEngine(elevation_map, CELL_RESOLUTION, omitted_rings, max_distance, normals)
+                for y, x in self.viewpoints:
+                    elevation = float(elevation_map[y, x]) + OFFSET
+                    expected = self.get_raster(terrain.shape, reference.solve(y, x, elevation))
+                    result = self.get_raster(terrain.shape, sweep.solve(y, x, elevation))
+                    np.testing.assert_array_equal(result > 0, expected > 0)
+                    np.testing.assert_allclose(result, expected, rtol=1e-12, atol=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
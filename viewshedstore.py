@@ -0,0 +1,198 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from elevationmap import ElevationMap
+
+
+class ViewshedStore:
+    # record of a viewpoint in the index, the mask of the window [top:bottom, left:right] starts at the offset
+    index_dtype = np.dtype([("y", np.int64), ("x", np.int64), ("top", np.int64), ("left", np.int64),
+                            ("bottom", np.int64), ("right", np.int64), ("offset", np.int64), ("solved", np.bool_)])
+
+    """
+    Open a file with the viewsheds of the viewpoints. The file starts with the index of the viewpoints stored as a .npy
+    array (see index_dtype), sorted by the coordinates of the viewpoints. The bit-packed visibility masks of the
+    windows around the viewpoints follow, every mask starts at a whole byte.
+
+    :param filename: path to the file written by create
+    :param mode: (optional) "r" to read the viewsheds, "r+" to write them
+    """
+
+    def __init__(self, filename, mode="r"):
+        self.filename = filename
+        self.index = np.load(filename, mmap_mode=mode)
+        # the masks fill the rest of the file
+        size = max(int(np.sum(ViewshedStore.get_mask_bytes(self.index))), 1)
+        self.data = np.memmap(filename, np.uint8, mode, os.path.getsize(filename) - size, (size,))
+        self.keys = self.index["y"] * (self.index["x"].max() + 1 if len(self.index) else 1) + self.index["x"]
+
+    """
+    Create a file for the viewsheds of the viewpoints. Every viewpoint gets a mask of the window within the maximal
+    distance, a viewpoint present several times is stored once.
+
+    :param filename: path to the file
+    :param viewpoints: array of viewpoints (see ElevationMap.viewpoint_dtype)
+    :param shape: shape of the elevation map
+    :param max_distance: (optional) distance from a viewpoint beyond which the cells are not solved, None for the
+    whole map
+    :returns: ViewshedStore opened for writing
+    """
+
+    @staticmethod
+    def create(filename, viewpoints, shape, max_distance=None):
+        positions = np.unique(np.stack((viewpoints["y"].astype(np.int64), viewpoints["x"].astype(np.int64)), 1),
+                              axis=0).reshape(-1, 2)
+        index = np.zeros(len(positions), ViewshedStore.index_dtype)
+        index["y"] = positions[:, 0]
+        index["x"] = positions[:, 1]
+        windows = np.array([ElevationMap.get_window(y, x, shape, max_distance) for y, x in positions.tolist()],
+                           np.int64).reshape(-1, 4)
+        for i, name in enumerate(("top", "left", "bottom", "right")):
+            index[name] = windows[:, i]
+        sizes = ViewshedStore.get_mask_bytes(index)
+        index["offset"] = np.cumsum(sizes) - sizes
+        with open(filename, "wb") as store:
+            np.lib.format.write_array(store, index)
+            # the masks are filled with zeros, so unsolved viewpoints see nothing
+            store.truncate(store.tell() + max(int(np.sum(sizes)), 1))
+        return ViewshedStore(filename, "r+")
+
+    """
+    Calculate the number of bytes of the masks.
+
+    :param index: records of the viewpoints (see index_dtype)
+    :returns: number of bytes of every mask
+    """
+
+    @staticmethod
+    def get_mask_bytes(index):
+        return ((index["bottom"] - index["top"]) * (index["right"] - index["left"]) + 7) // 8
+
+    """
+    Find the record of a viewpoint in the index.
+
+    :param y: y coordinate of the viewpoint
+    :param x: x coordinate of the viewpoint
+    :returns: position of the record
+    """
+
+    def find(self, y, x):
+        if len(self.index) and 0 <= x <= self.index["x"].max():
+            position = int(np.searchsorted(self.keys, y * (self.index["x"].max() + 1) + x))
+            if position < len(self.index) and self.index["y"][position] == y and self.index["x"][position] == x:
+                return position
+        raise KeyError("Viewpoint [{}, {}] is not stored".format(y, x))
+
+    """
+    Store the visible cells of a viewpoint. The masks of different viewpoints do not share bytes, so the workers can
+    write them at the same time.
+
+    :param y: y coordinate of the viewpoint
+    :param x: x coordinate of the viewpoint
+    :param visible_y: y coordinates of the visible cells
+    :param visible_x: x coordinates of the visible cells
+    """
+
+    def write(self, y, x, visible_y, visible_x):
+        position = self.find(y, x)
+        top, left, bottom, right, offset = [int(self.index[name][position])
+                                            for name in ("top", "left", "bottom", "right", "offset")]
+        mask = np.zeros((bottom - top) * (right - left), bool)
+        mask[(visible_y - top) * (right - left) + visible_x - left] = True
+        packed = np.packbits(mask)
+        self.data[offset:offset + len(packed)] = packed
+        self.index["solved"][position] = True
+
+    def flush(self):
+        self.data.flush()
+        self.index.flush()
+
+    """
+    Read the viewshed of a viewpoint.
+
+    :param y: y coordinate of the viewpoint
+    :param x: x coordinate of the viewpoint
+    :returns: boolean mask of the visible cells of the window around the viewpoint and the window (top, left, bottom,
+    right)
+    :raises ValueError: if the viewpoint was not solved yet, its mask is empty
+    """
+
+    def get_viewshed(self, y, x):
+        position = self.find(y, x)
+        if not self.index["solved"][position]:
+            raise ValueError("Viewpoint [{}, {}] is not solved".format(y, x))
+        top, left, bottom, right, offset = [int(self.index[name][position])
+                                            for name in ("top", "left", "bottom", "right", "offset")]
+        size = (bottom - top) * (right - left)
+        mask = np.unpackbits(self.data[offset:offset + (size + 7) // 8])[:size].astype(bool)
+        return mask.reshape(bottom - top, right - left), (top, left, bottom, right)
+
+    """
+    Read the visible cells of a viewpoint.
+
+    :param y: y coordinate of the viewpoint
+    :param x: x coordinate of the viewpoint
+    :returns: y and x coordinates of the visible cells
+    """
+
+    def get_visible_cells(self, y, x):
+        mask, (top, left, bottom, right) = self.get_viewshed(y, x)
+        visible_y, visible_x = np.nonzero(mask)
+        return visible_y + top, visible_x + left
+
+    """
+    Find the viewpoints which see a cell. Only the bits of the cell are read from the masks. The viewpoints which were
+    not solved yet are skipped (see get_unsolved).
+
+    :param y: y coordinate of the cell
+    :param x: x coordinate of the cell
+    :returns: y and x coordinates of the viewpoints
+    """
+
+    def get_observers(self, y, x):
+        index = self.index
+        candidates = np.flatnonzero((index["top"] <= y) & (y < index["bottom"]) & (index["left"] <= x)
+                                    & (x < index["right"]) & index["solved"])
+        positions = (y - index["top"][candidates]) * (index["right"][candidates] - index["left"][candidates]) \
+            + x - index["left"][candidates]
+        bits = self.data[index["offset"][candidates] + positions // 8] >> (7 - positions % 8) & 1
+        observers = candidates[bits.astype(bool)]
+        return np.asarray(index["y"][observers]), np.asarray(index["x"][observers])
+
+    """
+    Find the viewpoints whose viewsheds were not stored, e.g. by a run which was interrupted.
+
+    :returns: y and x coordinates of the viewpoints
+    """
+
+    def get_unsolved(self):
+        unsolved = np.flatnonzero(~self.index["solved"])
+        return np.asarray(self.index["y"][unsolved]), np.asarray(self.index["x"][unsolved])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read the viewsheds stored by xdraw.py --viewsheds.")
+    parser.add_argument("viewsheds", help="file with the viewsheds")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--viewpoint", type=int, nargs=2, metavar=("Y", "X"), help="print the cells seen from a "
+                                                                                  "viewpoint")
+    group.add_argument("--cell", type=int, nargs=2, metavar=("Y", "X"), help="print the viewpoints which see a cell")
+    args = parser.parse_args()
+
+    store = ViewshedStore(args.viewsheds)
+    if args.viewpoint is not None:
+        cells_y, cells_x = store.get_visible_cells(*args.viewpoint)
+    else:
+        cells_y, cells_x = store.get_observers(*args.cell)
+        unsolved = len(store.get_unsolved()[0])
+        if unsolved:
+            sys.stderr.write("{} of {} viewpoints are not solved and were skipped\n".format(unsolved, len(store.index)))
+    for y, x in zip(cells_y.tolist(), cells_x.tolist()):
+        print("{} {}".format(y, x))
+
+
+if __name__ == '__main__':
+    main()
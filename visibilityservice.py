@@ -0,0 +1,318 @@
+"""
+Resident visibility service. The elevation map, its terrain derivatives and the geometry table are loaded once and a
+warm pool of worker processes answers viewshed and visual magnitude jobs sent over a local socket. The front end uses
+asyncio, so this module requires Python 3.6 or newer.
+
+The protocol is line-delimited JSON. Every request is an object with an optional "id" which is copied to the responses:
+
+    {"id": 1, "type": "viewshed", "viewpoints": [[y, x], ...], "offset": 1.8}
+        one response per viewpoint as soon as it is solved:
+        {"id": 1, "type": "viewshed", "y": y, "x": x, "cells": [flat indices], "magnitudes": [...]}
+    {"id": 2, "type": "visual_magnitude", "viewpoints": [[y, x, weight], ...], "output": "result.npy"}
+        progress responses {"id": 2, "type": "progress", "completed": n, "total": m} as the viewpoints are solved and
+        a final {"id": 2, "type": "result", "output": "/results/result.npy"}, without "output" the result contains the
+        "cells" and "values" of the non-zero cells instead
+    {"type": "shutdown"}
+
+The output of a visual magnitude job is a path relative to the output directory of the service, the jobs cannot write
+anywhere else and without an output directory they cannot write at all. Failed requests, including requests without
+viewpoints, are answered with {"id": ..., "type": "error", "message": ...}.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import freeze_support
+
+import numpy as np
+
+from elevationmap import ElevationMap
+from geometrytable import GeometryTable
+from visualmag_workforce import ENGINES
+
+# state of a pool process, see init_worker
+worker_state = {}
+
+
+"""
+Attach the shared rasters in a pool process and create the engine. Called once when the process starts.
+
+:param rasters: shared rasters of the elevation map (see ElevationMap.share)
+:param geometry: shared rasters of the geometry table (see GeometryTable.share)
+:param geometry_radius: distance from the origin covered by the geometry table
+:param cell_resolution: resolution of a cell
+:param omitted_rings: rings around a viewpoint not included in the visual magnitude
+:param max_distance: distance from a viewpoint beyond which the cells are not solved, None for the whole map
+:param engine: name of the engine which solves the viewpoints (see ENGINES)
+"""
+
+
+def init_worker(rasters, geometry, geometry_radius, cell_resolution, omitted_rings, max_distance, engine):
+    elevation_map = rasters["map"].attach()
+    worker_state["map"] = elevation_map
+    worker_state["solver"] = ENGINES[engine](elevation_map, cell_resolution, omitted_rings, max_distance,
+                                             rasters["normals"].attach(),
+                                             GeometryTable.attach(geometry_radius, geometry))
+
+
+"""
+Solve a viewpoint in a pool process.
+
+:param origin_y: y coordinate of the viewpoint
+:param origin_x: x coordinate of the viewpoint
+:param origin_offset: elevation offset of the viewpoint
+:returns: flat indices of the visible cells and their visual magnitudes
+"""
+
+
+def solve_viewpoint(origin_y, origin_x, origin_offset):
+    elevation_map = worker_state["map"]
+    visible_y, visible_x, magnitudes = worker_state["solver"].solve(
+        origin_y, origin_x, float(elevation_map[origin_y, origin_x]) + origin_offset)
+    return np.ravel_multi_index((visible_y, visible_x), elevation_map.shape), magnitudes
+
+
+class VisibilityService:
+    def __init__(self, elevation_map_obj, cell_resolution, origin_offset, num_workers=1, omitted_rings=0,
+                 engine="vectorized", max_distance=None, output_directory=None):
+        if engine not in ENGINES:
+            raise ValueError("Unknown engine '{}', choose one of: {}".format(engine, ", ".join(sorted(ENGINES))))
+        self.origin_offset = origin_offset
+        self.num_workers = num_workers
+        self.output_directory = None if output_directory is None else os.path.realpath(output_directory)
+        self.server = None
+        self.stopped = None
+        # writers of the open client connections, closed on shutdown
+        self.writers = set()
+
+        # the same warm state as in VisualMagWorkforce, prepared once for all jobs
+        elevation_map_obj.compute_terrain_derivatives(cell_resolution)
+        self.rasters = elevation_map_obj.share()
+        self.shape = elevation_map_obj.get_map().shape
+        geometry_radius = max(self.shape) - 1
+        if max_distance is not None:
+            geometry_radius = min(geometry_radius, max_distance)
+        self.geometry = GeometryTable.build(geometry_radius, cell_resolution).share()
+        self.executor = ProcessPoolExecutor(num_workers, initializer=init_worker,
+                                            initargs=(self.rasters, self.geometry, geometry_radius, cell_resolution,
+                                                      omitted_rings, max_distance, engine))
+
+    """
+    Start the pool processes, so the first job does not wait for them.
+    """
+
+    def warm_up(self):
+        y, x = self.shape[0] // 2, self.shape[1] // 2
+        for future in [self.executor.submit(solve_viewpoint, y, x, self.origin_offset)
+                       for i in range(self.num_workers)]:
+            future.result()
+
+    """
+    Serve the requests until a shutdown request arrives. The open connections are closed and their handlers finish
+    before the coroutine returns, so the event loop can be closed afterwards.
+
+    :param path: (optional) path of a Unix domain socket
+    :param port: (optional) TCP port on localhost, used if no path is given or Unix sockets are not available
+    """
+
+    async def serve(self, path=None, port=8765):
+        self.stopped = asyncio.Event()
+        if path is not None and hasattr(socket, "AF_UNIX"):
+            self.server = await asyncio.start_unix_server(self.handle_connection, path)
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, "127.0.0.1", port)
+        try:
+            await self.stopped.wait()
+        finally:
+            self.server.close()
+            await self.server.wait_closed()
+            for writer in list(self.writers):
+                writer.close()
+            while self.writers:
+                await asyncio.sleep(0.01)
+        self.executor.shutdown()
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+    """
+    Answer the requests of a client connection one by one.
+
+    :param reader: asyncio.StreamReader of the connection
+    :param writer: asyncio.StreamWriter of the connection
+    """
+
+    async def handle_connection(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            line = await reader.readline()
+            while line:
+                request = None
+                try:
+                    request = json.loads(line)
+                    await self.handle_request(request, writer)
+                except Exception as error:
+                    request_id = request.get("id") if isinstance(request, dict) else None
+                    await self.send(writer, {"id": request_id, "type": "error", "message": str(error)})
+                if self.stopped.is_set():
+                    break
+                line = await reader.readline()
+        finally:
+            writer.close()
+            self.writers.discard(writer)
+
+    async def handle_request(self, request, writer):
+        request_type = request.get("type")
+        if request_type == "viewshed":
+            await self.handle_viewshed(request, writer)
+        elif request_type == "visual_magnitude":
+            await self.handle_visual_magnitude(request, writer)
+        elif request_type == "shutdown":
+            self.stopped.set()
+        else:
+            raise ValueError("Unknown request type '{}'".format(request_type))
+
+    """
+    Solve the viewpoints of the request in the pool. The results are yielded in the order the viewpoints are solved.
+
+    :param request: request with the viewpoints and optionally the offset
+    :returns: asynchronous generator of (viewpoint, (cells, magnitudes)) tuples
+    """
+
+    async def solve(self, request):
+        loop = asyncio.get_event_loop()
+        origin_offset = float(request.get("offset", self.origin_offset))
+        viewpoints = [[int(viewpoint[0]), int(viewpoint[1])] + [float(weight) for weight in viewpoint[2:3]]
+                      for viewpoint in request.get("viewpoints") or []]
+        if not viewpoints:
+            # the client waits for a response per viewpoint, a request without them would never be answered
+            raise ValueError("The request contains no viewpoints")
+        for viewpoint in viewpoints:
+            if not (0 <= viewpoint[0] < self.shape[0] and 0 <= viewpoint[1] < self.shape[1]):
+                raise ValueError("Viewpoint {} lies outside the map".format(viewpoint[:2]))
+
+        async def solve_one(viewpoint):
+            result = await loop.run_in_executor(self.executor, solve_viewpoint, viewpoint[0], viewpoint[1],
+                                                origin_offset)
+            return viewpoint, result
+
+        for future in asyncio.as_completed([solve_one(viewpoint) for viewpoint in viewpoints]):
+            yield await future
+
+    async def handle_viewshed(self, request, writer):
+        async for viewpoint, (cells, magnitudes) in self.solve(request):
+            await self.send(writer, {"id": request.get("id"), "type": "viewshed", "y": viewpoint[0],
+                                     "x": viewpoint[1], "cells": cells.tolist(), "magnitudes": magnitudes.tolist()})
+
+    async def handle_visual_magnitude(self, request, writer):
+        output = None
+        if request.get("output"):
+            output = self.get_output_path(request["output"])
+        visual_magnitude = np.zeros(self.shape).reshape(-1)
+        total = len(request.get("viewpoints") or [])
+        completed = 0
+        async for viewpoint, (cells, magnitudes) in self.solve(request):
+            weight = viewpoint[2] if len(viewpoint) > 2 else 1.0
+            np.add.at(visual_magnitude, cells, magnitudes * weight)
+            completed += 1
+            await self.send(writer, {"id": request.get("id"), "type": "progress", "completed": completed,
+                                     "total": total})
+
+        response = {"id": request.get("id"), "type": "result"}
+        if output is not None:
+            np.save(output, visual_magnitude.reshape(self.shape))
+            response["output"] = output
+        else:
+            cells = np.flatnonzero(visual_magnitude)
+            response["cells"] = cells.tolist()
+            response["values"] = visual_magnitude[cells].tolist()
+        await self.send(writer, response)
+
+    """
+    Resolve the output of a visual magnitude job in the output directory. The output may not leave the directory, e.g.
+    through an absolute path, .. or a symbolic link.
+
+    :param output: path of the .npy file relative to the output directory
+    :returns: absolute path of the .npy file
+    """
+
+    def get_output_path(self, output):
+        if self.output_directory is None:
+            raise ValueError("The service has no output directory, the result can be returned only in the response")
+        path = os.path.realpath(os.path.join(self.output_directory, output))
+        if path == self.output_directory or os.path.commonpath([self.output_directory, path]) != self.output_directory:
+            raise ValueError("The output {} lies outside the output directory".format(output))
+        if not path.lower().endswith(".npy"):
+            path += ".npy"
+        return path
+
+    @staticmethod
+    async def send(writer, response):
+        writer.write(json.dumps(response).encode("utf-8") + b"\n")
+        await writer.drain()
+
+
+"""
+Send a request to a running service and yield its responses. The generator ends after the last response of the
+request (the result of a visual magnitude job, the last viewshed or an error).
+
+:param request: request dictionary (see the module documentation)
+:param path: (optional) path of the Unix domain socket of the service
+:param port: (optional) TCP port of the service on localhost, used if no path is given
+:returns: generator of response dictionaries
+"""
+
+
+def query(request, path=None, port=8765):
+    if path is not None:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(path)
+    else:
+        connection = socket.create_connection(("127.0.0.1", port))
+    with connection, connection.makefile("rb") as responses:
+        connection.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        if request.get("type") == "shutdown":
+            return
+        remaining = len(request.get("viewpoints", []))
+        for line in responses:
+            response = json.loads(line)
+            yield response
+            if response["type"] == "viewshed":
+                remaining -= 1
+            if response["type"] in ("result", "error") or (request["type"] == "viewshed" and not remaining):
+                return
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve viewshed and visual magnitude jobs for an elevation map.")
+    parser.add_argument("dem", help="elevation map (GeoTIFF or .npy)")
+    parser.add_argument("--socket", help="path of the Unix domain socket")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port on localhost if no socket is given")
+    parser.add_argument("--cell-resolution", type=float, default=31)
+    parser.add_argument("--offset", type=float, default=1.8, help="default elevation offset of the viewpoints")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--omitted-rings", type=int, default=0)
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="vectorized")
+    parser.add_argument("--max-distance", type=int)
+    parser.add_argument("--output-directory",
+                        help="directory the visual magnitude jobs may write their results to (default: the results "
+                             "are only returned in the responses)")
+    args = parser.parse_args()
+
+    elevation_map = ElevationMap()
+    elevation_map.read_map_file(args.dem)
+    service = VisibilityService(elevation_map, args.cell_resolution, args.offset, args.workers, args.omitted_rings,
+                                args.engine, args.max_distance, args.output_directory)
+    service.warm_up()
+    print("Serving {} on {}".format(args.dem, args.socket or "127.0.0.1:{}".format(args.port)))
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(service.serve(args.socket, args.port))
+    finally:
+        loop.close()
+
+
+if __name__ == '__main__':
+    freeze_support()
+    main()
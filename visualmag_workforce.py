@@ -1,60 +1,294 @@
-import Queue
 import multiprocessing as mp
+import os
+import time
 
 import numpy as np
 
+from checkpoint import Checkpoint
 from elevationmap import ElevationMap
-from map import Map
-from spatialutils import SpatialUtils
+from geometrytable import GeometryTable
+from resultbatch import ResultBatch
+from resultcache import ResultCache
+from scheduler import schedule_viewpoints
 from sumator import sumator
+from viewshedstore import ViewshedStore
+from workforcestats import WorkforceStats
+from xdrawengine import MultiResolutionEngine, ReferenceEngine, SweepEngine, VectorizedEngine
+
+ENGINES = {
+    "reference": ReferenceEngine,
+    "vectorized": VectorizedEngine,
+    "sweep": SweepEngine
+}
+
+# dtypes of the rasters, LOS buffers and accumulators in the precision modes
+PRECISIONS = {
+    "double": np.float64,
+    "single": np.float32
+}
 
 
 class VisualMagWorkforce:
-    def __init__(self, elevation_map_obj, cell_resolution, origin_offset, num_workers=1, omitted_rings=0):
+    # viewpoint with the sector solved by a task if the viewpoints are split into sectors
+    sector_task_dtype = np.dtype(ElevationMap.viewpoint_dtype.descr + [("sector", np.intp)])
+
+    def __init__(self, elevation_map_obj, cell_resolution, origin_offset, num_workers=1, omitted_rings=0,
+                 engine="vectorized", batch_size=1000000, memmap_directory=None, max_distance=None, tile_size=None,
+                 output_file=None, chunk_size=64, cache_directory=None, progress_interval=None,
+                 band_distances=None, checkpoint_file=None, checkpoint_interval=600, precision="double",
+                 viewshed_file=None, sectors=None, flush_interval=60):
+        if engine not in ENGINES:
+            raise ValueError("Unknown engine '{}', choose one of: {}".format(engine, ", ".join(sorted(ENGINES))))
+        if precision not in PRECISIONS:
+            raise ValueError("Unknown precision '{}', choose one of: {}".format(precision,
+                                                                              ", ".join(sorted(PRECISIONS))))
+        if tile_size is not None and max_distance is None:
+            raise ValueError("Tiled processing requires max_distance")
+        if memmap_directory is None and (tile_size is not None or isinstance(elevation_map_obj.get_map(), np.memmap)):
+            # the terrain derivatives of a map too large for the memory are calculated into files block by block
+            raise ValueError("Tiled processing and memory-mapped maps require memmap_directory")
+        if band_distances is not None:
+            if engine != "vectorized" or tile_size is not None:
+                raise ValueError("The approximate mode works only with the vectorized engine without tiles")
+            MultiResolutionEngine.check_band_distances(band_distances, omitted_rings)
+        if np.ndim(origin_offset) != 0:
+            VisualMagWorkforce.check_heights(origin_offset, engine, band_distances, viewshed_file, sectors)
+        if sectors is not None:
+            VisualMagWorkforce.check_sectors(engine, sectors, tile_size, band_distances, cache_directory,
+                                             checkpoint_file, viewshed_file)
         self.num_workers = num_workers
+        self.engine = engine
         self.queue = mp.Queue()
+        self.tasks = []
+        self.chunk_size = chunk_size
+        self.results = mp.Queue()
+        self.batch_size = batch_size
+        # the worker stats and results reach the sumator only with the batches, so they are sent at least once per
+        # progress and checkpoint interval
+        intervals = [interval for interval in (flush_interval, progress_interval) if interval is not None]
+        if checkpoint_file is not None:
+            intervals.append(checkpoint_interval)
+        self.flush_interval = min(intervals) if intervals else None
         self.cell_resolution = cell_resolution
         self.omitted_rings = omitted_rings
+        self.max_distance = max_distance
+        self.tile_size = tile_size
+        self.output_file = output_file
+        if output_file is None and tile_size is not None:
+            # a tiled run is meant for maps which do not fit into the memory, so the result is accumulated in a
+            # memory-mapped file too, next to the checkpoint if there is one, so an interrupted run can continue in it
+            self.output_file = os.path.join(memmap_directory, "visual_magnitude.npy") if checkpoint_file is None \
+                else os.path.splitext(checkpoint_file)[0] + "_visual_magnitude.npy"
         self.sumator_pipe = None
-        self.origin_offset = origin_offset
+        self.progress_interval = progress_interval
+        self.band_distances = None if band_distances is None else list(band_distances)
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        self.resumed_viewpoints = 0
+        self.stats = None
+        # several offsets are solved in one pass into a stack of rasters, one for every offset
+        self.origin_offset = origin_offset if np.ndim(origin_offset) == 0 \
+            else [float(offset) for offset in origin_offset]
+        self.dtype = PRECISIONS[precision]
+        self.viewshed_file = viewshed_file
+        self.sectors = sectors
         self.processes = []
+        self.sumator_process = None
 
+        map_array = elevation_map_obj.get_map()
+        if map_array.dtype.kind == "f" and map_array.dtype.itemsize > np.dtype(self.dtype).itemsize:
+            # a map with a lower precision than the mode (e.g. integers or float32 in the double mode) is kept as is, a
+            # memory-mapped map is converted into the memmap directory, so it is never loaded whole
+            if isinstance(map_array, np.memmap):
+                elevation_map_obj.set_map(ElevationMap.convert_raster(
+                    map_array, self.dtype, os.path.join(memmap_directory, "converted_map.npy")))
+            else:
+                elevation_map_obj.set_map(map_array.astype(self.dtype))
+
+        # terrain derivatives do not depend on the viewpoint, calculate them once for all workers
+        normals_dtype = VisualMagWorkforce.get_normals_dtype(elevation_map_obj.get_map(), precision)
+        elevation_map_obj.compute_terrain_derivatives(cell_resolution, memmap_directory, dtype=normals_dtype)
+        if band_distances is not None:
+            # the distant bands are solved on coarser levels of the map
+            elevation_map_obj.build_pyramid(len(band_distances), cell_resolution, dtype=self.dtype)
+
+        # the rasters are moved to lock-free shared memory (or memory-mapped files) in their native dtype
+        self.rasters = elevation_map_obj.share(memmap_directory)
         self.map_array = elevation_map_obj.get_map()
-        self.mp_elevation_map = mp.Array("d", self.map_array.flatten())
+        self.result_shape = self.map_array.shape if np.ndim(origin_offset) == 0 \
+            else (len(self.origin_offset),) + self.map_array.shape
+
+        # LOS neighbours and interpolation weights depend only on the position relative to the viewpoint
+        self.geometry_radius = max(self.map_array.shape) - 1
+        if max_distance is not None:
+            self.geometry_radius = min(self.geometry_radius, max_distance)
+        self.geometry = GeometryTable.build(self.geometry_radius, cell_resolution).share(memmap_directory)
+
+        # contributions of the viewpoints are cached (and checkpoints are resumed) for the map and all parameters
+        # which influence them
+        self.parameters = {"cell_resolution": cell_resolution, "origin_offset": self.origin_offset,
+                           "omitted_rings": omitted_rings, "max_distance": max_distance, "engine": engine,
+                           "band_distances": self.band_distances, "precision": precision,
+                           "normals_dtype": normals_dtype.name}
+        self.result_key = None
+        if cache_directory is not None or checkpoint_file is not None:
+            self.result_key = ResultCache.get_key(self.map_array, self.parameters)
+        self.cache = None
+        if cache_directory is not None:
+            self.cache = ResultCache(cache_directory, self.result_key)
+
+    """
+    Get the dtype of the normals of a map in a precision mode. The normals are not more precise than the map they are
+    derived from.
+
+    :param map_array: numpy array which contains elevation data
+    :param precision: name of the precision mode (see PRECISIONS)
+    :returns: numpy dtype
+    """
+
+    @staticmethod
+    def get_normals_dtype(map_array, precision):
+        normals_dtype = np.result_type(map_array.dtype, np.float32)
+        if normals_dtype.itemsize > np.dtype(PRECISIONS[precision]).itemsize:
+            return np.dtype(PRECISIONS[precision])
+        return normals_dtype
+
+    """
+    Check that the viewpoints can be solved for several offsets in one pass with the selected engine and options.
+
+    :param origin_offsets: list of elevation offsets of the viewpoints
+    :param engine: name of the engine (see ENGINES)
+    :param band_distances: distances of the approximate mode or None
+    :param viewshed_file: viewshed file or None
+    :param sectors: number of sectors or None
+    """
+
+    @staticmethod
+    def check_heights(origin_offsets, engine, band_distances, viewshed_file, sectors):
+        if not len(origin_offsets):
+            raise ValueError("At least one offset of the viewpoints is required")
+        if not hasattr(ENGINES[engine], "solve_heights") or band_distances is not None:
+            raise ValueError("Several offsets work only with the vectorized engine without the approximate mode")
+        for name, value in (("stored viewsheds", viewshed_file), ("sectors", sectors)):
+            if value is not None:
+                raise ValueError("Several offsets cannot be combined with {}".format(name))
+
+    """
+    Check that the viewpoints can be split into sectors with the selected engine and options. The sectors of a viewpoint
+    are solved by different workers, so the options which store or load whole viewpoints cannot be used.
+
+    :param engine: name of the engine (see ENGINES)
+    :param sectors: number of sectors of every viewpoint
+    :param tile_size: size of the tiles or None
+    :param band_distances: distances of the approximate mode or None
+    :param cache_directory: directory of the result cache or None
+    :param checkpoint_file: checkpoint file or None
+    :param viewshed_file: viewshed file or None
+    """
+
+    @staticmethod
+    def check_sectors(engine, sectors, tile_size, band_distances, cache_directory, checkpoint_file, viewshed_file):
+        if not hasattr(ENGINES[engine], "solve_sector"):
+            raise ValueError("The {} engine cannot split the viewpoints into sectors".format(engine))
+        if engine == "vectorized" and sectors != len(VectorizedEngine.octant_directions):
+            raise ValueError("The vectorized engine splits the viewpoints into {} sectors".format(
+                len(VectorizedEngine.octant_directions)))
+        if sectors < 1:
+            raise ValueError("The number of sectors must be positive")
+        for name, value in (("tiles", tile_size), ("the approximate mode", band_distances),
+                            ("the cache", cache_directory), ("checkpoints", checkpoint_file),
+                            ("stored viewsheds", viewshed_file)):
+            if value is not None:
+                raise ValueError("Sectors cannot be combined with {}".format(name))
 
     """
-    Add a new viewpoint to the processing queue. If the viewpoint is added when the workers are running,
-    there's no guarantee the point will be calculated.
+    Add a new viewpoint to be calculated. Viewpoints added after the workers were started are not calculated.
     
-    :param task: coordinates of the viewpoint
+    :param task: coordinates and weight of the viewpoint
     """
 
     def add_task(self, task):
-        self.queue.put(task)
+        self.tasks.append(np.array([tuple(task)], ElevationMap.viewpoint_dtype))
 
     """
-    Spawn the selected number of processes and begin computation.    
+    Add viewpoints to be calculated. Viewpoints added after the workers were started are not calculated.
+    
+    :param tasks: array of viewpoints (see ElevationMap.read_viewpoints) or list of [y, x, weight]
+    """
+
+    def add_tasks(self, tasks):
+        if not isinstance(tasks, np.ndarray):
+            tasks = np.array([tuple(task) for task in tasks], ElevationMap.viewpoint_dtype)
+        self.tasks.append(tasks.astype(ElevationMap.viewpoint_dtype))
+
+    """
+    Spawn the selected number of processes and begin computation. The viewpoints are scheduled in chunks of spatially
+    adjacent viewpoints, the most expensive chunks first (see schedule_viewpoints), and each worker receives an
+    end-of-work signal after the last chunk. Viewpoints found in the cache are only loaded after all the others.
+    The workers can be started again for new viewpoints once the previous result was received.
+    If a checkpoint file was specified and it belongs to the same map, parameters and viewpoints, the run is resumed
+    from it and the completed viewpoints are skipped.
+    If a viewshed file was specified, the visible cells of every viewpoint of the run are stored in it (see
+    ViewshedStore). A resumed run keeps the viewsheds stored before it was interrupted.
+    If the viewpoints are split into sectors, every chunk is queued once for each sector, so the sectors of the most
+    expensive viewpoints are solved by all workers in parallel. The progress then counts the sectors.
     """
 
     def start_workers(self):
-        # initialize pipes for communication with sumator
-        recv_connections = []
-        send_connections = []
+        self.processes = []
+        viewpoints = np.concatenate(self.tasks) if self.tasks else np.empty(0, ElevationMap.viewpoint_dtype)
+        all_viewpoints = viewpoints
+        self.tasks = []
+        checkpoint = None
+        self.resumed_viewpoints = 0
+        if self.checkpoint_file is not None:
+            checkpoint = Checkpoint(self.checkpoint_file, Checkpoint.get_key(self.result_key, viewpoints),
+                                    self.checkpoint_interval)
+            if checkpoint.exists():
+                checkpoint.resume = True
+                remaining = Checkpoint.get_remaining(viewpoints, checkpoint.load_completed())
+                self.resumed_viewpoints = len(viewpoints) - len(remaining)
+                viewpoints = remaining
+        if self.viewshed_file is not None and not (self.resumed_viewpoints and os.path.isfile(self.viewshed_file)):
+            ViewshedStore.create(self.viewshed_file, all_viewpoints, self.map_array.shape, self.max_distance).flush()
+        cached = np.zeros(len(viewpoints), bool)
+        if self.cache is not None:
+            cached = self.cache.get_cached(viewpoints)
+        for chunk in schedule_viewpoints(viewpoints[~cached], self.map_array.shape, self.chunk_size,
+                                         self.max_distance, self.tile_size, self.num_workers):
+            if self.sectors is None:
+                self.queue.put(chunk)
+                continue
+            for sector in range(self.sectors):
+                tasks = np.empty(len(chunk), VisualMagWorkforce.sector_task_dtype)
+                for name in ElevationMap.viewpoint_dtype.names:
+                    tasks[name] = chunk[name]
+                tasks["sector"] = sector
+                self.queue.put(tasks)
+        for start in range(0, np.count_nonzero(cached), self.chunk_size):
+            self.queue.put(viewpoints[cached][start:start + self.chunk_size])
         for i in range(self.num_workers):
-            recv_conn, send_conn = mp.Pipe(False)
-            recv_connections.append(recv_conn)
-            send_connections.append(send_conn)
+            self.queue.put(None)
+        task_count = len(viewpoints) * (self.sectors or 1)
+        self.stats = WorkforceStats(task_count)
 
-        # start the processes
+        # start the processes, the workers send their results to the sumator in batches through a shared queue
         self.sumator_pipe, sumator_connection = mp.Pipe(False)
-        sumator_process = mp.Process(target=sumator, args=(recv_connections, sumator_connection, self.map_array.shape))
-        sumator_process.daemon = False
-        sumator_process.start()
+        self.sumator_process = mp.Process(target=sumator, args=(self.results, sumator_connection,
+                                                                self.result_shape, self.num_workers,
+                                                                self.output_file, task_count,
+                                                                self.progress_interval, checkpoint, self.dtype))
+        self.sumator_process.daemon = False
+        self.sumator_process.start()
 
         for i in range(self.num_workers):
-            t = mp.Process(target=visual_mag_worker, args=(send_connections[i],
-                                                           self.mp_elevation_map, self.map_array.shape, self.queue, self.cell_resolution, self.omitted_rings,
-                                                           self.origin_offset))
+            t = mp.Process(target=visual_mag_worker, args=(self.results, self.batch_size, self.rasters,
+                                                           self.geometry, self.geometry_radius, self.queue,
+                                                           self.cell_resolution, self.omitted_rings,
+                                                           self.max_distance, self.tile_size, self.origin_offset,
+                                                           self.engine, self.cache, self.band_distances,
+                                                           self.dtype, self.viewshed_file, self.sectors,
+                                                           self.flush_interval))
             self.processes.append(t)
             t.daemon = False
             t.start()
@@ -70,72 +304,157 @@ class VisualMagWorkforce:
     def get_sumator_pipe(self):
         return self.sumator_pipe
 
+    def get_stats(self):
+        return self.stats
+
+    """
+    Receive the summed visual magnitude from the sumator. Blocking call!
+    The stats received in the meantime are stored in the stats attribute (see WorkforceStats) and passed to the
+    callback. Intermediate stats are sent only if a progress interval was specified, the final stats always.
+    
+    :param progress_callback: (optional) function called with the WorkforceStats instance whenever stats arrive
+    :returns: visual magnitude raster (a stack of rasters for several offsets, see result_shape), memory-mapped from
+    the output file if one was specified or the run is tiled
+    """
+
+    def get_result(self, progress_callback=None):
+        result = self.sumator_pipe.recv()
+        while isinstance(result, WorkforceStats):
+            self.stats = result
+            if progress_callback is not None:
+                progress_callback(result)
+            result = self.sumator_pipe.recv()
+        if self.output_file is not None:
+            return np.load(result, mmap_mode="r")
+        return result
+
 
 """
-Calculate the visual magnitude from a viewpoint. The viewpoints are retrieved from the queue shared among processes.
+Calculate the visual magnitude from a viewpoint. The chunks of viewpoints are retrieved from the queue shared among
+processes until the end-of-work signal (None) is received.
+The results are accumulated in the worker and sent to the sumator in batches of at least batch_size cells, or when
+flush_interval seconds passed since the previous batch, so the sumator receives the results of slow viewpoints in time.
+The visual magnitude of a viewpoint is multiplied by its weight. Each batch carries the stats of the worker collected
+since the previous batch (see WorkerStats).
 
-:param mp_elevation_map: shared multiprocessing array containing elevation data
-:param shape: shape of the array
+:param results: queue shared with the sumator
+:param batch_size: number of visible cells accumulated before the batch is sent to the sumator
+:param rasters: shared rasters of the elevation map (see ElevationMap.share)
+:param geometry: shared rasters of the geometry table (see GeometryTable.share)
+:param geometry_radius: distance from the origin covered by the geometry table
 :param cell_resolution: resolution of a cell
 :param omitted_distance: distance from a viewpoint which will not be included in visual magnitude calculation
-:param origin_offset: elevation offset for the viewpoints
+:param max_distance: distance from a viewpoint beyond which the cells are not solved, None for the whole map
+:param tile_size: size of the tiles loaded from the rasters at once, None to solve the viewpoints on the whole map
+:param origin_offset: elevation offset for the viewpoints, or a list of offsets solved in one pass, the visual
+magnitudes of the offsets are then sent as the cells of a stack of rasters (see VisualMagWorkforce.result_shape)
+:param engine: name of the engine which solves the viewpoints (see ENGINES)
+:param cache: (optional) ResultCache the contributions of the viewpoints are loaded from and stored to
+:param band_distances: (optional) distances where the bands solved on the coarse levels of the map begin (see
+MultiResolutionEngine), None to solve the viewpoints exactly
+:param dtype: (optional) precision of the LOS and of the visual magnitudes (see PRECISIONS)
+:param viewshed_file: (optional) file the visible cells of the viewpoints are stored in (see ViewshedStore)
+:param sectors: (optional) number of sectors the viewpoints are split into, the chunks then carry the sector of every
+viewpoint (see VisualMagWorkforce.sector_task_dtype)
+:param flush_interval: (optional) seconds after which a batch is sent even if it is not full, None to send only full
+batches
 """
 
 
-def visual_mag_worker(sumator, mp_elevation_map, shape, queue, cell_resolution, omitted_distance, origin_offset):
+def visual_mag_worker(results, batch_size, rasters, geometry, geometry_radius, queue, cell_resolution,
+                      omitted_distance, max_distance, tile_size, origin_offset, engine, cache=None,
+                      band_distances=None, dtype="d", viewshed_file=None, sectors=None, flush_interval=None):
     print("Worker started")
-    elevation_map = np.frombuffer(mp_elevation_map.get_obj()).reshape(shape)
-    while not queue.empty():
-        # other threads might empty the queue before this command
-        try:
-            origin = queue.get()
-        except Queue.Empty:
-            break
-        origin_y = origin[0]
-        origin_x = origin[1]
-        origin_weight = origin[2]
-
-        los_map = Map(shape[0], shape[1], False)
-        spatial = SpatialUtils(origin_y, origin_x,
-                               elevation_map[origin_y, origin_x] + origin_offset,
-                               cell_resolution,
-                               elevation_map)
-
-        omitted_rings, rings = ElevationMap.get_rings(origin_y, origin_x, elevation_map, omitted_distance)
-
-        # initialize LOS value and visual magnitude of omitted rings and remove them from queue
-        los_map.init_omitted_cells([[origin_y, origin_x]], Map.undefined)
-        for ring in omitted_rings:
-            los_map.init_omitted_cells(ring, Map.undefined)
-
-        visible_count = invisible_count = 0  # DEBUG
-
-        for ring in rings:
-            for cell in ring:
-                cell_y = cell[0]
-                cell_x = cell[1]
-
-                # calculate viewing LOS of the cell and interpolated LOS of the point directly in front of the cell
-                interpolated_weight = spatial.interpolate_weight(cell_y, cell_x)
-                los_cells = spatial.get_los_cells(cell_y, cell_x)
-                adjacent_los = los_map.get(los_cells["adjacent"][0], los_cells["adjacent"][1]) * interpolated_weight
-                offset_los = los_map.get(los_cells["offset"][0], los_cells["offset"][1]) * (1 - interpolated_weight)
-                # print(adjacent_los, offset_los)
-
-                viewing_los = spatial.get_viewing_slope(cell_y, cell_x)
-                cell_los = adjacent_los + offset_los
-                # print(viewing_los, cell_los)
-
-                if viewing_los < cell_los:
-                    # not visible
-                    los_map.set(cell_y, cell_x, cell_los)
-                    invisible_count += 1
+    elevation_map = rasters["map"].attach()
+    normal_map = rasters["normals"].attach()
+    geometry = GeometryTable.attach(geometry_radius, geometry)
+    if band_distances is None:
+        solver = ENGINES[engine](elevation_map, cell_resolution, omitted_distance, max_distance, normal_map, geometry,
+                                 dtype)
+    else:
+        levels = [(rasters["map{}".format(level)].attach(), rasters["normals{}".format(level)].attach())
+                  for level in range(1, len(band_distances) + 1)]
+        solver = MultiResolutionEngine(elevation_map, cell_resolution, omitted_distance, max_distance, normal_map,
+                                       geometry, levels, band_distances, dtype)
+    batch = ResultBatch(elevation_map.shape, os.getpid(), dtype)
+    viewsheds = None if viewshed_file is None else ViewshedStore(viewshed_file, "r+")
+    window = None
+    top = left = 0
+    start_time = time.time()
+    chunk = queue.get()
+    batch.stats.queue_wait += time.time() - start_time
+    while chunk is not None:
+        for origin in chunk:
+            origin_y = int(origin[0])
+            origin_x = int(origin[1])
+            origin_weight = float(origin[2])
+
+            if cache is not None and cache.contains(origin_y, origin_x):
+                start_time = time.time()
+                cells, magnitudes = cache.load(origin_y, origin_x)
+                batch.stats.add_cached(time.time() - start_time)
+            else:
+                if tile_size is not None:
+                    tile_window = ElevationMap.get_tile_window(origin_y, origin_x, elevation_map.shape, tile_size,
+                                                               max_distance)
+                    if tile_window != window:
+                        # only the tile and its surroundings are loaded from the (memory-mapped) rasters
+                        window = tile_window
+                        top, left, bottom, right = window
+                        solver = ENGINES[engine](np.array(elevation_map[top:bottom, left:right]), cell_resolution,
+                                                 omitted_distance, max_distance,
+                                                 np.array(normal_map[top:bottom, left:right]), geometry, dtype)
+
+                origin_elevation = float(elevation_map[origin_y, origin_x])
+                if np.ndim(origin_offset) != 0:
+                    solutions = solver.solve_heights(origin_y - top, origin_x - left,
+                                                     [origin_elevation + offset for offset in origin_offset])
+                    # the raster of every offset follows the raster of the previous one
+                    cells = np.concatenate([np.ravel_multi_index((visible_y + top, visible_x + left),
+                                                                 elevation_map.shape) + height * elevation_map.size
+                                            for height, (visible_y, visible_x, height_magnitudes)
+                                            in enumerate(solutions)])
+                    magnitudes = np.concatenate([height_magnitudes for visible_y, visible_x, height_magnitudes
+                                                 in solutions])
                 else:
-                    # visible
-                    los_map.set(cell_y, cell_x, viewing_los)
-                    visible_count += 1
-                    visual_magnitude = spatial.visual_magnitude(cell_y, cell_x)
-                    sumator.send([cell_y, cell_x, visual_magnitude])
-        print(visible_count, invisible_count)
-    sumator.send(None)
+                    if sectors is None:
+                        visible_y, visible_x, magnitudes = solver.solve(origin_y - top, origin_x - left,
+                                                                        origin_elevation + origin_offset)
+                    else:
+                        visible_y, visible_x, magnitudes = solver.solve_sector(origin_y, origin_x,
+                                                                               origin_elevation + origin_offset,
+                                                                               int(origin["sector"]), sectors)
+                    cells = np.ravel_multi_index((visible_y + top, visible_x + left), elevation_map.shape)
+                if cache is not None:
+                    cache.store(origin_y, origin_x, cells, magnitudes)
+                batch.stats.add_solved(solver)
+
+            if viewsheds is not None:
+                viewsheds.write(origin_y, origin_x, *np.unravel_index(cells, elevation_map.shape))
+            batch.add_cells(origin, cells, magnitudes * origin_weight)
+            if batch.size >= batch_size or (flush_interval is not None
+                                            and time.time() - batch.flush_time >= flush_interval):
+                send_batch(results, batch)
+        start_time = time.time()
+        chunk = queue.get()
+        batch.stats.queue_wait += time.time() - start_time
+    if viewsheds is not None:
+        viewsheds.flush()
+    # the last batch is sent even if it is empty to deliver the final stats
+    send_batch(results, batch)
+    results.put(None)
     print("Worker starved to death")
+
+
+"""
+Send the batch to the sumator. The time spent sending is recorded in the stats of the next batch.
+
+:param results: queue shared with the sumator
+:param batch: ResultBatch instance
+"""
+
+
+def send_batch(results, batch):
+    start_time = time.time()
+    results.put(batch.flush())
+    batch.stats.send_wait += time.time() - start_time
@@ -0,0 +1,155 @@
+import time
+
+
+class WorkerStats:
+    def __init__(self, worker=None):
+        self.worker = worker
+        self.viewpoints = 0
+        self.cached_viewpoints = 0
+        self.cells = 0
+        self.visible_cells = 0
+        self.ring_time = 0.0
+        self.los_time = 0.0
+        self.magnitude_time = 0.0
+        self.cache_time = 0.0
+        self.queue_wait = 0.0
+        self.send_wait = 0.0
+
+    """
+    Record a viewpoint solved by an engine. The engine provides the counts of the cells and the time spent in the
+    phases of the last solve.
+
+    :param solver: engine which solved the viewpoint (see ENGINES)
+    """
+
+    def add_solved(self, solver):
+        self.viewpoints += 1
+        self.cells += solver.visible_count + solver.invisible_count
+        self.visible_cells += solver.visible_count
+        self.ring_time += solver.timings["rings"]
+        self.los_time += solver.timings["los"]
+        self.magnitude_time += solver.timings["magnitude"]
+
+    """
+    Record a viewpoint loaded from the cache.
+
+    :param load_time: time spent loading the viewpoint
+    """
+
+    def add_cached(self, load_time):
+        self.viewpoints += 1
+        self.cached_viewpoints += 1
+        self.cache_time += load_time
+
+    """
+    Add the counters of other stats to these.
+
+    :param other: WorkerStats instance
+    """
+
+    def merge(self, other):
+        for name, value in vars(other).items():
+            if name != "worker":
+                setattr(self, name, getattr(self, name) + value)
+
+    """
+    Get the share of the evaluated cells which are visible.
+
+    :returns: visible ratio, None before any cell was evaluated
+    """
+
+    def get_visible_ratio(self):
+        if not self.cells:
+            return None
+        return float(self.visible_cells) / self.cells
+
+    def to_dict(self):
+        stats = dict(vars(self))
+        stats["visible_ratio"] = self.get_visible_ratio()
+        return stats
+
+
+class WorkforceStats:
+    def __init__(self, total_viewpoints, start_time=None):
+        self.total_viewpoints = total_viewpoints
+        self.start_time = time.time() if start_time is None else start_time
+        self.elapsed = 0.0
+        self.workers = {}
+        self.batches = 0
+        # time the sumator spent waiting for the batches and summing them
+        self.sumator_wait = 0.0
+        self.sumator_time = 0.0
+
+    """
+    Add the stats sent by a worker with a batch.
+
+    :param stats: WorkerStats instance collected since the previous batch of the worker
+    """
+
+    def add(self, stats):
+        if stats.worker not in self.workers:
+            self.workers[stats.worker] = WorkerStats(stats.worker)
+        self.workers[stats.worker].merge(stats)
+        self.batches += 1
+        self.elapsed = time.time() - self.start_time
+
+    """
+    Sum the stats of all workers.
+
+    :returns: WorkerStats instance
+    """
+
+    def get_totals(self):
+        totals = WorkerStats()
+        for stats in self.workers.values():
+            totals.merge(stats)
+        return totals
+
+    def get_completed(self):
+        return sum(stats.viewpoints for stats in self.workers.values())
+
+    """
+    Get the share of the viewpoints which have been completed.
+
+    :returns: fraction between 0 and 1
+    """
+
+    def get_progress(self):
+        if not self.total_viewpoints:
+            return 1.0
+        return float(self.get_completed()) / self.total_viewpoints
+
+    """
+    Estimate the remaining time from the throughput so far. The most expensive chunks of viewpoints are scheduled
+    first, so the estimate is pessimistic at the beginning of the computation.
+
+    :returns: estimated remaining time in seconds, None before any viewpoint was completed
+    """
+
+    def get_eta(self):
+        completed = self.get_completed()
+        if not completed:
+            return None
+        return self.elapsed * (self.total_viewpoints - completed) / completed
+
+    def format_progress(self):
+        totals = self.get_totals()
+        visible_ratio = totals.get_visible_ratio()
+        eta = self.get_eta()
+        return "{}/{} viewpoints ({:.1f} %), {} cells, {} visible, elapsed {:.1f} s, ETA {}".format(
+            self.get_completed(), self.total_viewpoints, 100 * self.get_progress(), totals.cells,
+            "-" if visible_ratio is None else "{:.1f} %".format(100 * visible_ratio), self.elapsed,
+            "-" if eta is None else "{:.1f} s".format(eta))
+
+    def to_dict(self):
+        return {
+            "total_viewpoints": self.total_viewpoints,
+            "completed_viewpoints": self.get_completed(),
+            "elapsed": self.elapsed,
+            "eta": self.get_eta(),
+            "batches": self.batches,
+            "sumator_wait": self.sumator_wait,
+            "sumator_time": self.sumator_time,
+            "totals": self.get_totals().to_dict(),
+            "workers": [stats.to_dict() for worker, stats in sorted(self.workers.items())]
+        }
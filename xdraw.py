@@ -1,59 +1,189 @@
+import argparse
+import multiprocessing as mp
+import shutil
+import sys
+import tempfile
 import time
 from multiprocessing import freeze_support
 
-import matplotlib.pyplot as plt
-from matplotlib import colors
+import numpy as np
 
+from adaptivesampling import sample_path
+from approximation import compare_precision, compare_with_exact
 from elevationmap import ElevationMap
-from visualmag_workforce import VisualMagWorkforce
+from resultcache import ResultCache
+from shards import get_shard, parse_shard, write_partial
+from visualmag_workforce import ENGINES, PRECISIONS, VisualMagWorkforce
+
+
+def print_progress(stats):
+    # the line is written at once, so the output of the other processes does not run into it
+    sys.stdout.write(stats.format_progress() + "\n")
+    sys.stdout.flush()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Calculate the visual magnitude of the terrain seen from a path.")
+    parser.add_argument("dem", help="elevation map (GeoTIFF or .npy, see ElevationMap.convert_map_file)")
+    parser.add_argument("viewpoints", help="raster of the viewpoints, every positive cell is a viewpoint weighted by "
+                                           "its value")
+    parser.add_argument("output", help="visual magnitude raster, written as .npy or GeoTIFF depending on the extension "
+                                       "(.npz partial result with --shard)")
+    parser.add_argument("--cell-resolution", type=float, default=31, help="resolution of a cell (default: 31)")
+    parser.add_argument("--offset", type=float, nargs="+", default=[1.8],
+                        help="elevation offset of the viewpoints (default: 1.8), several offsets are solved in one "
+                             "pass and written to separate rasters with the offset appended to the output name")
+    parser.add_argument("--workers", type=int, default=mp.cpu_count(),
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--omitted-rings", type=int, default=0,
+                        help="rings around a viewpoint not included in the visual magnitude (default: 0)")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="vectorized")
+    parser.add_argument("--max-distance", type=int, help="distance from a viewpoint beyond which the cells are not "
+                                                         "solved (default: whole map)")
+    parser.add_argument("--tile-size", type=int,
+                        help="solve the viewpoints in tiles, requires --max-distance, the result is accumulated in a "
+                             "memory-mapped file and converted to the output format at the end")
+    parser.add_argument("--memmap-directory",
+                        help="keep the shared rasters in memory-mapped files in this directory (default: a temporary "
+                             "directory if --tile-size is given or the map is a .npy file, shared memory otherwise)")
+    parser.add_argument("--cache-directory", help="cache the contributions of the viewpoints in this directory")
+    parser.add_argument("--approximate", type=int, nargs="+", metavar="DISTANCE",
+                        help="solve the cells farther than each distance on a coarser level of the map, the first "
+                             "distance uses 2x coarser cells, the second 4x...")
+    parser.add_argument("--precision", choices=sorted(PRECISIONS), default="double",
+                        help="precision of the rasters, LOS buffers and accumulators (default: double)")
+    parser.add_argument("--error-sample", type=int, default=0,
+                        help="report the error of the approximate mode or of the single precision against the exact "
+                             "double precision result on this number of viewpoints (default: 0)")
+    parser.add_argument("--adaptive", type=float, metavar="TOLERANCE",
+                        help="sample the path adaptively, adding viewpoints where the viewsheds of neighbouring samples "
+                             "differ by more than the tolerance (share of the cells not visible from both)")
+    parser.add_argument("--initial-step", type=int, default=16,
+                        help="viewpoints between the samples of the first adaptive round (default: 16)")
+    parser.add_argument("--checkpoint", help="save the partial result periodically to this file and resume from it")
+    parser.add_argument("--checkpoint-interval", type=float, default=600,
+                        help="seconds between checkpoints (default: 600)")
+    parser.add_argument("--viewsheds", help="store the visible cells of every viewpoint in this file, read them with "
+                                            "viewshedstore.py")
+    parser.add_argument("--sectors", type=int,
+                        help="split every viewpoint into this number of angular sectors solved by different workers, "
+                             "for few viewpoints on a large map (the vectorized engine requires 8)")
+    parser.add_argument("--shard", help="calculate only the shard INDEX/COUNT of the viewpoints and write a partial "
+                                        "result, merge the shards with shards.py")
+    parser.add_argument("--batch-size", type=int, default=1000000,
+                        help="visible cells a worker accumulates before sending them to the sumator (default: "
+                             "1000000)")
+    parser.add_argument("--flush-interval", type=float, default=60,
+                        help="seconds after which a worker sends its results even if the batch is not full "
+                             "(default: 60)")
+    parser.add_argument("--progress-interval", type=float, default=10,
+                        help="seconds between progress reports (default: 10)")
+    parser.add_argument("--plot", action="store_true", help="plot the result when finished (requires matplotlib)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    start_time = time.time()
 
-num_workers = 6
-
-# TEST VALUES
-origin_y = 275
-origin_x = 350
-omitted_rings = 0
-origin_offset = 1.8
-cell_resolution = 31
-# /TEST VALUES
+    elevation_map = ElevationMap()
+    elevation_map.read_map_file(args.dem)
+    viewpoints = elevation_map.read_viewpoints(args.viewpoints)
+    all_viewpoints = viewpoints
+    # the workforce may convert the map to the precision, the error is reported against the map as read
+    map_array = elevation_map.get_map()
+    origin_offset = args.offset[0] if len(args.offset) == 1 else args.offset
+    if args.sectors is not None and args.adaptive is not None:
+        raise ValueError("Adaptive sampling cannot be combined with sectors")
+    if args.shard is not None:
+        if args.adaptive is not None:
+            raise ValueError("Adaptive sampling cannot be combined with shards")
+        if not args.output.lower().endswith(".npz"):
+            raise ValueError("The partial result of a shard must be written to a .npz file")
+        viewpoint_ids = get_shard(len(viewpoints), *parse_shard(args.shard))
+        viewpoints = viewpoints[viewpoint_ids]
+
+    # a .npy output is accumulated directly in the file by the sumator, a stack of rasters is split after the run
+    output_file = args.output if args.output.lower().endswith(".npy") and len(args.offset) == 1 else None
+    # the adaptive sampling compares the contributions of the viewpoints through the cache
+    cache_directory = args.cache_directory
+    if args.adaptive is not None and cache_directory is None:
+        cache_directory = tempfile.mkdtemp(prefix="xdraw_cache_")
+    # the terrain derivatives of a tiled or memory-mapped map are calculated into files, so they need not fit into
+    # memory
+    memmap_directory = args.memmap_directory
+    if memmap_directory is None and (args.tile_size is not None or isinstance(elevation_map.get_map(), np.memmap)):
+        memmap_directory = tempfile.mkdtemp(prefix="xdraw_memmap_")
+    # the temporary directories are removed even if the run fails
+    try:
+        workforce = VisualMagWorkforce(elevation_map, args.cell_resolution, origin_offset, args.workers,
+                                       args.omitted_rings, args.engine, memmap_directory=memmap_directory,
+                                       max_distance=args.max_distance, tile_size=args.tile_size,
+                                       output_file=output_file, cache_directory=cache_directory,
+                                       progress_interval=args.progress_interval, band_distances=args.approximate,
+                                       checkpoint_file=args.checkpoint, checkpoint_interval=args.checkpoint_interval,
+                                       precision=args.precision, viewshed_file=args.viewsheds, sectors=args.sectors,
+                                       batch_size=args.batch_size, flush_interval=args.flush_interval)
+
+        if args.adaptive is not None:
+            path_length = len(viewpoints)
+            viewpoints = sample_path(workforce, viewpoints, args.adaptive, args.initial_step)
+            print("Adaptive sampling selected {} of {} viewpoints".format(len(viewpoints), path_length))
+
+        print("Calculating {} viewpoints".format(len(viewpoints)))
+        workforce.add_tasks(viewpoints)
+
+        print("Initialization finished in: {} s".format(time.time() - start_time))
+
+        start_time = time.time()
+
+        workforce.start_workers()
+        if workforce.resumed_viewpoints:
+            print("Resumed from the checkpoint, {} viewpoints were completed".format(workforce.resumed_viewpoints))
+        visual_magnitude = workforce.get_result(print_progress)
+        workforce.wait_to_finish()
+        if args.shard is not None:
+            write_partial(args.output, visual_magnitude, ResultCache.get_map_hash(elevation_map.get_map()),
+                          workforce.parameters, all_viewpoints, viewpoint_ids)
+        elif len(args.offset) > 1:
+            for filename in ElevationMap.write_raster_stack(args.output, visual_magnitude,
+                                                            ["offset{:g}".format(offset) for offset in args.offset],
+                                                            args.dem):
+                print("Written {}".format(filename))
+        elif output_file is None:
+            ElevationMap.write_raster(args.output, visual_magnitude, args.dem)
+
+        print("Calculation in: {} s".format(time.time() - start_time))
+
+        if args.error_sample > 0:
+            sample = viewpoints[np.sort(np.random.RandomState(0).permutation(len(viewpoints))[:args.error_sample])]
+            for offset in args.offset:
+                report = None
+                if args.approximate:
+                    report = compare_with_exact(elevation_map, sample, args.cell_resolution, offset, args.approximate,
+                                                args.omitted_rings, args.max_distance)
+                    print("Approximation error on {} viewpoints with offset {}:".format(report["viewpoints"], offset))
+                elif args.precision == "single":
+                    report = compare_precision(map_array, sample, args.cell_resolution, offset, args.omitted_rings,
+                                               args.max_distance, args.engine)
+                    print("Single precision error on {} viewpoints with offset {}:".format(report["viewpoints"],
+                                                                                           offset))
+                for name in sorted(report or {}):
+                    print("  {}: {}".format(name, report[name]))
+
+        if args.plot:
+            from plotting import plot_visual_magnitude
+            rasters = [visual_magnitude] if len(args.offset) == 1 else visual_magnitude
+            for offset, raster in zip(args.offset, rasters):
+                plot_visual_magnitude(raster, elevation_map.get_map(),
+                                      "Visual magnitude with elevation offset {}".format(offset))
+    finally:
+        if cache_directory != args.cache_directory:
+            shutil.rmtree(cache_directory, ignore_errors=True)
+        if memmap_directory != args.memmap_directory:
+            shutil.rmtree(memmap_directory, ignore_errors=True)
 
-start_time = time.clock()
 
 if __name__ == '__main__':
     freeze_support()
-
-    elevation_map = ElevationMap()
-    elevation_map.read_map_file("testData\mhkdem.tif")
-    workforce = VisualMagWorkforce(elevation_map, cell_resolution, origin_offset, 10)
-
-    viewpoints = elevation_map.read_viewpoints("testData\path2.tif")
-
-    print("Calculating {} viewpoints".format(len(viewpoints)))
-    for vp in viewpoints:
-        workforce.add_task(vp)
-
-    print("Initialization finished in: {} s".format(time.clock() - start_time))
-
-    start_time = time.clock()
-
-    workforce.start_workers()
-    visual_magnitude = workforce.get_sumator_pipe().recv()
-
-    print("Calculation in: {} s".format(time.clock() - start_time))
-
-    fig = plt.figure()
-    a = fig.add_subplot(1, 2, 1)
-    a.set_title("Visual Magnitude")
-    image = visual_magnitude
-    norm = colors.LogNorm(clip='False')
-    im = plt.imshow(image, norm=norm)
-    plt.colorbar(im, orientation='horizontal')
-
-    c = fig.add_subplot(1, 2, 2)
-    c.set_title("Elevation map")
-    image3 = elevation_map.get_map()
-    im3 = plt.imshow(image3, cmap='hot')
-    plt.colorbar(im3, orientation='horizontal')
-
-    plt.suptitle("Viewpoint [{}, {}] with elevation offset {}".format(origin_x, origin_y, origin_offset))
-    plt.show()
+    main()
@@ -0,0 +1,825 @@
+import math
+import time
+
+import numpy as np
+
+from elevationmap import ElevationMap
+from map import Map
+from ringmap import RingMap
+from spatialutils import SpatialUtils
+
+
+class ReferenceEngine:
+    def __init__(self, elevation_map, cell_resolution, omitted_distance, max_distance=None, normal_map=None,
+                 geometry=None, dtype="d"):
+        self.elevation_map = elevation_map
+        self.cell_resolution = cell_resolution
+        self.omitted_distance = omitted_distance
+        self.max_distance = max_distance
+        self.normal_map = normal_map
+        self.geometry = geometry
+        # precision of the LOS and of the visual magnitudes
+        self.dtype = dtype
+        self.visible_count = 0
+        self.invisible_count = 0
+        # time spent generating the rings, evaluating the LOS and the visual magnitude in the last solve
+        self.timings = {"rings": 0.0, "los": 0.0, "magnitude": 0.0}
+
+    """
+    Calculate the visibility and visual magnitude of the cells around a viewpoint cell by cell. This is the original
+    XDraw implementation and serves as a reference for the other engines.
+
+    :param origin_y: y coordinate of the viewpoint
+    :param origin_x: x coordinate of the viewpoint
+    :param origin_elevation: elevation of the viewpoint including the offset
+
+    :returns: y coordinates, x coordinates and visual magnitudes of the visible cells
+    """
+
+    def solve(self, origin_y, origin_x, origin_elevation):
+        top, left, bottom, right = ElevationMap.get_window(origin_y, origin_x, self.elevation_map.shape,
+                                                           self.max_distance)
+        los_map = Map(bottom - top, right - left, False, top, left, self.dtype)
+        spatial = SpatialUtils(origin_y, origin_x, origin_elevation, self.cell_resolution, self.elevation_map,
+                               self.normal_map)
+
+        start_time = time.time()
+        omitted_rings, rings = ElevationMap.get_rings(origin_y, origin_x, self.elevation_map, self.omitted_distance,
+                                                      self.max_distance)
+        self.timings["rings"] = time.time() - start_time
+        start_time = time.time()
+        magnitude_time = 0.0
+
+        # initialize LOS value and visual magnitude of omitted rings and remove them from queue
+        los_map.init_omitted_cells([[origin_y, origin_x]], Map.undefined)
+        for ring in omitted_rings:
+            los_map.init_omitted_cells(ring, Map.undefined)
+
+        self.visible_count = self.invisible_count = 0
+        visible_y = []
+        visible_x = []
+        magnitudes = []
+
+        for ring in rings:
+            for cell in ring:
+                cell_y = cell[0]
+                cell_x = cell[1]
+
+                # calculate viewing LOS of the cell and interpolated LOS of the point directly in front of the cell
+                interpolated_weight = spatial.interpolate_weight(cell_y, cell_x)
+                los_cells = spatial.get_los_cells(cell_y, cell_x)
+                adjacent_los = los_map.get(los_cells["adjacent"][0], los_cells["adjacent"][1]) * interpolated_weight
+                offset_los = los_map.get(los_cells["offset"][0], los_cells["offset"][1]) * (1 - interpolated_weight)
+
+                viewing_los = spatial.get_viewing_slope(cell_y, cell_x)
+                cell_los = adjacent_los + offset_los
+
+                if viewing_los < cell_los:
+                    # not visible
+                    los_map.set(cell_y, cell_x, cell_los)
+                    self.invisible_count += 1
+                else:
+                    # visible
+                    los_map.set(cell_y, cell_x, viewing_los)
+                    self.visible_count += 1
+                    visible_y.append(cell_y)
+                    visible_x.append(cell_x)
+                    magnitude_start = time.time()
+                    magnitudes.append(spatial.visual_magnitude(cell_y, cell_x))
+                    magnitude_time += time.time() - magnitude_start
+
+        self.timings["los"] = time.time() - start_time - magnitude_time
+        self.timings["magnitude"] = magnitude_time
+        return np.array(visible_y, dtype=np.intp), np.array(visible_x, dtype=np.intp), np.array(magnitudes,
+                                                                                                 self.dtype)
+
+
+class VectorizedEngine:
+    # directions (y, x) of the lines where the octants begin, counterclockwise in the x-y frame
+    octant_directions = [(0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1)]
+    # number of cells of an octant whose geometry is evaluated at once
+    octant_block = 65536
+
+    def __init__(self, elevation_map, cell_resolution, omitted_distance, max_distance=None, normal_map=None,
+                 geometry=None, dtype="d"):
+        self.elevation_map = elevation_map
+        self.cell_resolution = cell_resolution
+        self.omitted_distance = omitted_distance
+        self.max_distance = max_distance
+        self.normal_map = normal_map
+        self.geometry = geometry
+        self.dtype = dtype
+        self.los_distance = max(elevation_map.shape) if max_distance is None \
+            else min(max_distance, max(elevation_map.shape))
+        self.los_map = RingMap(self.los_distance, dtype)
+        # ring map with a layer for every elevation, created by solve_heights
+        self.height_los_map = None
+        self.visible_count = 0
+        self.invisible_count = 0
+        # time spent generating the rings, evaluating the LOS and the visual magnitude in the last solve
+        self.timings = {"rings": 0.0, "los": 0.0, "magnitude": 0.0}
+
+    """
+    Calculate the visibility and visual magnitude of the cells around a viewpoint. Each ring is processed at once as
+    arrays of cells, the results are the same as with the ReferenceEngine.
+
+    :param origin_y: y coordinate of the viewpoint
+    :param origin_x: x coordinate of the viewpoint
+    :param origin_elevation: elevation of the viewpoint including the offset
+
+    :returns: y coordinates, x coordinates and visual magnitudes of the visible cells
+    """
+
+    def solve(self, origin_y, origin_x, origin_elevation):
+        spatial = SpatialUtils(origin_y, origin_x, origin_elevation, self.cell_resolution, self.elevation_map,
+                               self.normal_map)
+
+        start_time = time.time()
+        omitted_rings, rings = ElevationMap.get_ring_arrays(origin_y, origin_x, self.elevation_map,
+                                                            self.omitted_distance, self.max_distance)
+        self.timings["rings"] = time.time() - start_time
+        start_time = time.time()
+
+        # LOS is stored only for the previous and the current ring, the omitted rings are undefined
+        los_map = self.los_map
+        los_map.reset(origin_y, origin_x, len(omitted_rings), Map.undefined)
+
+        self.visible_count = self.invisible_count = 0
+        visible_y = []
+        visible_x = []
+        visible_slopes = []
+
+        for ring_y, ring_x in rings:
+            visible, viewing_slopes = VectorizedEngine.solve_ring(ring_y, ring_x, spatial, los_map, self.geometry)
+            visible_y.append(ring_y[visible])
+            visible_x.append(ring_x[visible])
+            visible_slopes.append(viewing_slopes[visible])
+
+        if rings:
+            visible_y = np.concatenate(visible_y)
+            visible_x = np.concatenate(visible_x)
+            visible_slopes = np.concatenate(visible_slopes)
+        else:
+            visible_y = visible_x = np.empty(0, dtype=np.intp)
+            visible_slopes = np.empty(0)
+        self.visible_count = len(visible_y)
+        self.invisible_count = sum(len(ring_y) for ring_y, ring_x in rings) - self.visible_count
+        self.timings["los"] = time.time() - start_time
+
+        start_time = time.time()
+        magnitudes = spatial.visual_magnitudes(visible_y, visible_x, visible_slopes).astype(self.dtype)
+        self.timings["magnitude"] = time.time() - start_time
+        return visible_y, visible_x, magnitudes
+
+    """
+    Calculate the visibility and visual magnitude of the cells around a viewpoint for several elevations of the
+    viewpoint in one pass. The rings, the LOS geometry, the elevations of the cells and the magnitude terms of the cells
+    are shared, the LOS is kept and compared for every elevation in a layer of the ring map. The result for every
+    elevation equals the result of solve.
+
+    :param origin_y: y coordinate of the viewpoint
+    :param origin_x: x coordinate of the viewpoint
+    :param origin_elevations: list of elevations of the viewpoint including the offsets
+
+    :returns: list of (y coordinates, x coordinates, visual magnitudes) of the visible cells for every elevation
+    """
+
+    def solve_heights(self, origin_y, origin_x, origin_elevations):
+        spatial = SpatialUtils(origin_y, origin_x, np.reshape(np.asarray(origin_elevations, "d"), (-1, 1)),
+                               self.cell_resolution, self.elevation_map, self.normal_map)
+
+        start_time = time.time()
+        omitted_rings, rings = ElevationMap.get_ring_arrays(origin_y, origin_x, self.elevation_map,
+                                                            self.omitted_distance, self.max_distance)
+        self.timings["rings"] = time.time() - start_time
+        start_time = time.time()
+
+        if self.height_los_map is None or len(self.height_los_map.previous) != len(origin_elevations):
+            self.height_los_map = RingMap(self.los_distance, self.dtype, len(origin_elevations))
+        los_map = self.height_los_map
+        los_map.reset(origin_y, origin_x, len(omitted_rings), Map.undefined)
+
+        # the cells visible from any of the elevations
+        seen_y = [np.empty(0, dtype=np.intp)]
+        seen_x = [np.empty(0, dtype=np.intp)]
+        seen_slopes = [np.empty((len(origin_elevations), 0))]
+        seen_visible = [np.empty((len(origin_elevations), 0), bool)]
+        for ring_y, ring_x in rings:
+            visible, viewing_los = VectorizedEngine.solve_ring(ring_y, ring_x, spatial, los_map, self.geometry)
+            seen = visible.any(axis=0)
+            seen_y.append(ring_y[seen])
+            seen_x.append(ring_x[seen])
+            seen_slopes.append(viewing_los[:, seen])
+            seen_visible.append(visible[:, seen])
+        seen_y = np.concatenate(seen_y)
+        seen_x = np.concatenate(seen_x)
+        seen_visible = np.concatenate(seen_visible, axis=1)
+        self.visible_count = np.count_nonzero(seen_visible)
+        self.invisible_count = len(origin_elevations) * sum(len(ring_y) for ring_y, ring_x in rings) \
+            - self.visible_count
+        self.timings["los"] = time.time() - start_time
+
+        start_time = time.time()
+        magnitudes = spatial.visual_magnitudes(seen_y, seen_x, np.concatenate(seen_slopes, axis=1)).astype(self.dtype)
+        self.timings["magnitude"] = time.time() - start_time
+        return [(seen_y[visible], seen_x[visible], height_magnitudes[visible])
+                for visible, height_magnitudes in zip(seen_visible, magnitudes)]
+
+    """
+    Calculate the visibility and visual magnitude of the cells of an octant around a viewpoint. The LOS of a cell
+    depends only on cells of the previous ring closer to the axis or the diagonal bounding its octant, and the cells on
+    the axes and diagonals depend only on their own line. An octant is therefore solved exactly together with both of
+    its bounding lines, the line where the next octant begins is solved by both octants but belongs to the next one.
+    The results of the eight octants add up to the result of solve.
+
+    Within an octant a ring is a straight segment, the cell at distance d and position t along the segment lies at
+    d * start + t * (end - start), where start and end are the directions of the bounding lines. The geometry of
+    blocks of rings is evaluated at once and the LOS is propagated ring by ring on the segments.
+
+    :param origin_y: y coordinate of the viewpoint
+    :param origin_x: x coordinate of the viewpoint
+    :param origin_elevation: elevation of the viewpoint including the offset
+    :param sector: index of the octant, counterclockwise from the positive x axis (see octant_directions)
+    :param sector_count: number of sectors, must be 8
+
+    :returns: y coordinates, x coordinates and visual magnitudes of the visible cells of the octant
+    """
+
+    def solve_sector(self, origin_y, origin_x, origin_elevation, sector, sector_count):
+        if sector_count != len(VectorizedEngine.octant_directions):
+            raise ValueError("The vectorized engine solves a viewpoint in {} octants".format(
+                len(VectorizedEngine.octant_directions)))
+        spatial = SpatialUtils(origin_y, origin_x, origin_elevation, self.cell_resolution, self.elevation_map,
+                               self.normal_map)
+        start_y, start_x = VectorizedEngine.octant_directions[sector]
+        end_y, end_x = VectorizedEngine.octant_directions[(sector + 1) % sector_count]
+        top, left, bottom, right = ElevationMap.get_window(origin_y, origin_x, self.elevation_map.shape,
+                                                           self.max_distance)
+        last_distance = max(origin_y - top, bottom - 1 - origin_y, origin_x - left, right - 1 - origin_x)
+        self.timings = {"rings": 0.0, "los": 0.0, "magnitude": 0.0}
+
+        # LOS of the last omitted ring (or the origin) along the segment
+        previous = np.full(self.omitted_distance + 1, float(Map.undefined), self.dtype)
+        solved = 0
+        visible_y = [np.empty(0, dtype=np.intp)]
+        visible_x = [np.empty(0, dtype=np.intp)]
+        visible_slopes = [np.empty(0)]
+        first_distance = self.omitted_distance + 1
+        while first_distance <= last_distance:
+            start_time = time.time()
+            # the rings of a block have about octant_block cells together
+            block_end = min(last_distance + 1, max(first_distance + 1, int(math.sqrt(
+                first_distance * first_distance + 2 * self.octant_block))))
+            sizes = np.arange(first_distance, block_end) + 1
+            starts = np.cumsum(sizes) - sizes
+            distance = np.repeat(np.arange(first_distance, block_end), sizes)
+            position = np.arange(len(distance)) - np.repeat(starts, sizes)
+            cell_y = origin_y + distance * start_y + position * (end_y - start_y)
+            cell_x = origin_x + distance * start_x + position * (end_x - start_x)
+            inside = (cell_y >= top) & (cell_y < bottom) & (cell_x >= left) & (cell_x < right)
+            # the cells outside the window are never in front of the cells inside it, any geometry will do for them
+            adjacent_position = np.minimum(position, distance - 1)
+            offset_position = adjacent_position.copy()
+            weights = np.ones(len(distance))
+            viewing_slopes = np.zeros(len(distance))
+            cell_y, cell_x = cell_y[inside], cell_x[inside]
+            adjacent_position[inside], offset_position[inside], weights[inside] = self.__get_segment_geometry(
+                spatial, cell_y, cell_x, distance[inside] - 1, start_y, start_x)
+            viewing_slopes[inside] = spatial.get_viewing_slopes(cell_y, cell_x)
+            self.timings["rings"] += time.time() - start_time
+
+            start_time = time.time()
+            visible = np.empty(len(distance), bool)
+            for ring, ring_start in enumerate(starts.tolist()):
+                ring_cells = slice(ring_start, ring_start + first_distance + ring + 1)
+                ring_weights = weights[ring_cells]
+                cell_los = previous[adjacent_position[ring_cells]] * ring_weights \
+                    + previous[offset_position[ring_cells]] * (1 - ring_weights)
+                ring_visible = viewing_slopes[ring_cells] >= cell_los
+                visible[ring_cells] = ring_visible
+                previous = np.where(ring_visible, viewing_slopes[ring_cells], cell_los).astype(self.dtype)
+
+            # the end of the segment lies on the line of the next octant
+            owned = inside & (position < distance)
+            solved += np.count_nonzero(owned)
+            visible &= owned
+            visible_y.append(cell_y[visible[inside]])
+            visible_x.append(cell_x[visible[inside]])
+            visible_slopes.append(viewing_slopes[visible])
+            self.timings["los"] += time.time() - start_time
+            first_distance = block_end
+
+        visible_y = np.concatenate(visible_y)
+        visible_x = np.concatenate(visible_x)
+        self.visible_count = len(visible_y)
+        self.invisible_count = solved - self.visible_count
+
+        start_time = time.time()
+        magnitudes = spatial.visual_magnitudes(visible_y, visible_x, np.concatenate(visible_slopes)).astype(self.dtype)
+        self.timings["magnitude"] = time.time() - start_time
+        return visible_y, visible_x, magnitudes
+
+    """
+    Look up the cells in front of the cells of an octant and convert them to positions along the segment of the
+    previous ring.
+
+    :param spatial: SpatialUtils instance of the viewpoint
+    :param cell_y: array of y coordinates of the cells
+    :param cell_x: array of x coordinates of the cells
+    :param previous_distance: array of distances of the previous rings
+    :param start_y: y direction of the line where the octant begins
+    :param start_x: x direction of the line where the octant begins
+    :returns: positions of the adjacent and of the offset cells and the interpolation weights
+    """
+
+    def __get_segment_geometry(self, spatial, cell_y, cell_x, previous_distance, start_y, start_x):
+        if self.geometry is None:
+            weights = spatial.interpolate_weights(cell_y, cell_x)
+            adjacent, offset = spatial.get_los_cell_arrays(cell_y, cell_x)
+        else:
+            weights = self.geometry.interpolate_weights(cell_y, cell_x, spatial.origin_y, spatial.origin_x)
+            adjacent, offset = self.geometry.get_los_cell_arrays(cell_y, cell_x, spatial.origin_y, spatial.origin_x)
+        # the position is the distance from the start of the segment
+        line_y = spatial.origin_y + previous_distance * start_y
+        line_x = spatial.origin_x + previous_distance * start_x
+        adjacent_position = np.maximum(np.abs(adjacent[0] - line_y), np.abs(adjacent[1] - line_x))
+        offset_position = np.maximum(np.abs(offset[0] - line_y), np.abs(offset[1] - line_x))
+        return adjacent_position, offset_position, weights
+
+    """
+    Calculate the visibility of the cells of a ring from the LOS of the previous ring and push the LOS of the ring to
+    the ring map.
+
+    :param ring_y: array of y coordinates of the cells of the ring
+    :param ring_x: array of x coordinates of the cells of the ring
+    :param spatial: SpatialUtils instance of the viewpoint
+    :param los_map: RingMap holding the LOS of the previous ring
+    :param geometry: (optional) GeometryTable the LOS neighbours and interpolation weights are looked up in
+    :returns: boolean array, True for the visible cells, and array of the viewing slopes of the cells
+    """
+
+    @staticmethod
+    def solve_ring(ring_y, ring_x, spatial, los_map, geometry=None):
+        # interpolate LOS of the points directly in front of the cells from the previous ring
+        if geometry is None:
+            interpolated_weights = spatial.interpolate_weights(ring_y, ring_x)
+            adjacent, offset = spatial.get_los_cell_arrays(ring_y, ring_x)
+        else:
+            interpolated_weights = geometry.interpolate_weights(ring_y, ring_x, spatial.origin_y, spatial.origin_x)
+            adjacent, offset = geometry.get_los_cell_arrays(ring_y, ring_x, spatial.origin_y, spatial.origin_x)
+        cell_los = (los_map.get(adjacent[0], adjacent[1]) * interpolated_weights
+                    + los_map.get(offset[0], offset[1]) * (1 - interpolated_weights))
+
+        viewing_los = spatial.get_viewing_slopes(ring_y, ring_x)
+        visible = viewing_los >= cell_los
+        los_map.push(ring_y, ring_x, np.where(visible, viewing_los, cell_los))
+        return visible, viewing_los
+
+
+class MultiResolutionEngine:
+    def __init__(self, elevation_map, cell_resolution, omitted_distance, max_distance=None, normal_map=None,
+                 geometry=None, levels=None, band_distances=None, dtype="d"):
+        MultiResolutionEngine.check_band_distances(band_distances, omitted_distance)
+        if levels is None or len(levels) < len(band_distances):
+            raise ValueError("Every distance band requires a level of the pyramid (see ElevationMap.build_pyramid)")
+        self.elevation_map = elevation_map
+        self.cell_resolution = cell_resolution
+        self.omitted_distance = omitted_distance
+        self.max_distance = max_distance
+        self.geometry = geometry
+        self.levels = levels
+        self.band_distances = list(band_distances)
+        self.dtype = dtype
+        # the rings up to the first band are solved exactly
+        exact_distance = band_distances[0] if max_distance is None else min(band_distances[0], max_distance)
+        self.exact_engine = VectorizedEngine(elevation_map, cell_resolution, omitted_distance, exact_distance,
+                                             normal_map, geometry, dtype)
+        self.los_maps = [RingMap(max(level_map.shape), dtype) for level_map, level_normals in levels]
+        self.visible_count = 0
+        self.invisible_count = 0
+        self.timings = {"rings": 0.0, "los": 0.0, "magnitude": 0.0}
+
+    """
+    Check the distances where the bands of coarser levels begin. The distances must increase and leave at least two
+    cells of the level before each band, so the LOS can be handed over.
+
+    :param band_distances: list of distances, cells farther than the k-th distance are solved on the level k
+    :param omitted_distance: distance from a viewpoint which will not be included in visual magnitude calculation
+    """
+
+    @staticmethod
+    def check_band_distances(band_distances, omitted_distance):
+        if not band_distances:
+            raise ValueError("At least one band distance is required")
+        for level, distance in enumerate(band_distances, 1):
+            if distance < 2 ** (level + 1):
+                raise ValueError("Band {} must begin at least {} cells from the viewpoint".format(level,
+                                                                                                 2 ** (level + 1)))
+            if level > 1 and distance <= band_distances[level - 2]:
+                raise ValueError("Band distances must increase")
+        if band_distances[0] <= omitted_distance:
+            raise ValueError("The first band must begin beyond the omitted rings")
+
+    """
+    Calculate the visibility and visual magnitude of the cells around a viewpoint approximately. The rings up to the
+    first band distance are solved exactly by the VectorizedEngine, the cells of the k-th band on the k-th level of the
+    pyramid. The LOS of the last ring of a level is handed over to the first ring of the next level, the positions along
+    the perimeter are scaled and the highest LOS of the cells falling to the same coarse cell is kept. The visual
+    magnitude of a visible coarse cell is split evenly among the cells of the map it covers.
+
+    :param origin_y: y coordinate of the viewpoint
+    :param origin_x: x coordinate of the viewpoint
+    :param origin_elevation: elevation of the viewpoint including the offset
+
+    :returns: y coordinates, x coordinates and visual magnitudes of the visible cells
+    """
+
+    def solve(self, origin_y, origin_x, origin_elevation):
+        visible_y, visible_x, magnitudes = self.exact_engine.solve(origin_y, origin_x, origin_elevation)
+        self.visible_count = self.exact_engine.visible_count
+        self.invisible_count = self.exact_engine.invisible_count
+        self.timings = dict(self.exact_engine.timings)
+        visible_y = [visible_y]
+        visible_x = [visible_x]
+        magnitudes = [magnitudes]
+
+        previous_map = self.exact_engine.los_map
+        previous_shape = self.elevation_map.shape
+        inner_distance = self.band_distances[0]
+        for level in range(1, len(self.band_distances) + 1):
+            if previous_map.distance < inner_distance or \
+                    (self.max_distance is not None and inner_distance >= self.max_distance):
+                # the map edge or the maximal distance was reached
+                break
+            outer_distance = self.band_distances[level] if level < len(self.band_distances) else None
+            if self.max_distance is not None:
+                outer_distance = self.max_distance if outer_distance is None \
+                    else min(outer_distance, self.max_distance)
+
+            factor = 2 ** level
+            level_map, level_normals = self.levels[level - 1]
+            level_y = origin_y // factor
+            level_x = origin_x // factor
+            spatial = SpatialUtils(level_y, level_x, origin_elevation, self.cell_resolution * factor, level_map,
+                                   level_normals)
+            los_map = self.los_maps[level - 1]
+            # the coarse cells of the hand-off ring and all the rings inside it cover only cells solved before
+            handoff_distance = (inner_distance - factor + 1) // factor
+            last_distance = None if outer_distance is None else (outer_distance + factor - 1) // factor
+
+            start_time = time.time()
+            omitted_rings, rings = ElevationMap.get_ring_arrays(level_y, level_x, level_map, handoff_distance,
+                                                                last_distance)
+            self.timings["rings"] += time.time() - start_time
+
+            start_time = time.time()
+            los_map.reset(level_y, level_x, handoff_distance,
+                          MultiResolutionEngine.hand_off(previous_map, previous_shape, handoff_distance))
+            geometry = self.geometry
+            if geometry is not None and len(omitted_rings) + len(rings) > geometry.radius:
+                geometry = None
+            level_visible_y = []
+            level_visible_x = []
+            level_slopes = []
+            for ring_y, ring_x in rings:
+                visible, viewing_slopes = VectorizedEngine.solve_ring(ring_y, ring_x, spatial, los_map, geometry)
+                level_visible_y.append(ring_y[visible])
+                level_visible_x.append(ring_x[visible])
+                level_slopes.append(viewing_slopes[visible])
+            self.timings["los"] += time.time() - start_time
+
+            start_time = time.time()
+            if rings:
+                level_visible_y = np.concatenate(level_visible_y)
+                level_visible_x = np.concatenate(level_visible_x)
+                level_slopes = np.concatenate(level_slopes)
+            else:
+                level_visible_y = level_visible_x = np.empty(0, dtype=np.intp)
+                level_slopes = np.empty(0)
+            level_magnitudes = spatial.visual_magnitudes(level_visible_y, level_visible_x,
+                                                         level_slopes).astype(self.dtype)
+            cell_y, cell_x, cell_magnitudes = self.__split_cells(level_visible_y, level_visible_x, level_magnitudes,
+                                                                 factor, origin_y, origin_x, inner_distance,
+                                                                 outer_distance)
+            visible_y.append(cell_y)
+            visible_x.append(cell_x)
+            magnitudes.append(cell_magnitudes)
+            self.timings["magnitude"] += time.time() - start_time
+
+            band_cells = self.__count_cells(origin_y, origin_x, outer_distance) \
+                - self.__count_cells(origin_y, origin_x, inner_distance)
+            self.visible_count += len(cell_y)
+            self.invisible_count += band_cells - len(cell_y)
+
+            previous_map = los_map
+            previous_shape = level_map.shape
+            inner_distance = outer_distance
+            if outer_distance is None:
+                break
+
+        return np.concatenate(visible_y), np.concatenate(visible_x), np.concatenate(magnitudes)
+
+    """
+    Hand the LOS of the last ring of a level over to a ring of the next coarser level. The positions along the
+    perimeter are scaled to the perimeter of the coarse ring, the highest LOS falling to a coarse cell is kept. Cells
+    of the ring outside the map leave their coarse cells undefined unless other cells fall to them.
+
+    :param previous_map: RingMap holding the LOS of the last ring of the finer level
+    :param previous_shape: shape of the map of the finer level
+    :param distance: distance of the coarse ring
+    :returns: array of LOS values of the coarse ring along its perimeter
+    """
+
+    @staticmethod
+    def hand_off(previous_map, previous_shape, distance):
+        ring_y, ring_x = ElevationMap.get_ring_indices(previous_map.origin_y, previous_map.origin_x, previous_shape,
+                                                       previous_map.distance)
+        positions = RingMap.get_perimeter_indices(ring_y - previous_map.origin_y, ring_x - previous_map.origin_x,
+                                                  previous_map.distance)
+        los = np.full(8 * distance, float(Map.undefined), previous_map.previous.dtype)
+        np.maximum.at(los, positions * distance // previous_map.distance, previous_map.get(ring_y, ring_x))
+        return los
+
+    """
+    Split the visible coarse cells into the cells of the map they cover. Only the cells of the band are kept, each of
+    them gets the same share of the visual magnitude of the coarse cell.
+
+    :param coarse_y: array of y coordinates of the visible coarse cells
+    :param coarse_x: array of x coordinates of the visible coarse cells
+    :param magnitudes: array of visual magnitudes of the coarse cells
+    :param factor: number of cells of the map along a side of a coarse cell
+    :param origin_y: y coordinate of the viewpoint
+    :param origin_x: x coordinate of the viewpoint
+    :param inner_distance: distance of the cells before the band
+    :param outer_distance: distance of the last cells of the band, None for the map edge
+    :returns: y coordinates, x coordinates and visual magnitudes of the cells
+    """
+
+    def __split_cells(self, coarse_y, coarse_x, magnitudes, factor, origin_y, origin_x, inner_distance,
+                      outer_distance):
+        offset_y, offset_x = np.indices((factor, factor))
+        cell_y = (coarse_y[:, np.newaxis] * factor + offset_y.ravel()).ravel()
+        cell_x = (coarse_x[:, np.newaxis] * factor + offset_x.ravel()).ravel()
+        cell_magnitudes = np.repeat(magnitudes / (factor * factor), factor * factor)
+
+        distance = np.maximum(np.abs(cell_y - origin_y), np.abs(cell_x - origin_x))
+        inside = (cell_y < self.elevation_map.shape[0]) & (cell_x < self.elevation_map.shape[1]) \
+            & (distance > inner_distance)
+        if outer_distance is not None:
+            inside &= distance <= outer_distance
+        return cell_y[inside], cell_x[inside], cell_magnitudes[inside]
+
+    """
+    Count the cells of the map up to the specified distance from the viewpoint.
+
+    :param origin_y: y coordinate of the viewpoint
+    :param origin_x: x coordinate of the viewpoint
+    :param distance: distance from the viewpoint, None for the whole map
+    :returns: number of cells
+    """
+
+    def __count_cells(self, origin_y, origin_x, distance):
+        top, left, bottom, right = ElevationMap.get_window(origin_y, origin_x, self.elevation_map.shape, distance)
+        return (bottom - top) * (right - left)
+
+
+class SweepEngine:
+    # number of sight lines processed at once, limits the memory of a solve
+    ray_block = 1024
+
+    def __init__(self, elevation_map, cell_resolution, omitted_distance, max_distance=None, normal_map=None,
+                 geometry=None, dtype="d"):
+        self.elevation_map = elevation_map
+        self.cell_resolution = cell_resolution
+        self.omitted_distance = omitted_distance
+        self.max_distance = max_distance
+        self.normal_map = normal_map
+        self.dtype = dtype
+        self.visible_count = 0
+        self.invisible_count = 0
+        self.timings = {"rings": 0.0, "los": 0.0, "magnitude": 0.0}
+
+    """
+    Calculate the visibility and visual magnitude of the cells around a viewpoint by a radial sweep (R2). A sight line
+    is cast to every cell on the border of the window around the viewpoint. Along a sight line the terrain is
+    interpolated linearly between the two cells crossed at every step, so the horizon follows the line exactly instead
+    of the LOS interpolated between rings. A cell is visible if its viewing slope is not below the horizon of the
+    sight line passing closest to its centre. The omitted rings do not block the view.
+
+    :param origin_y: y coordinate of the viewpoint
+    :param origin_x: x coordinate of the viewpoint
+    :param origin_elevation: elevation of the viewpoint including the offset
+
+    :returns: y coordinates, x coordinates and visual magnitudes of the visible cells
+    """
+
+    def solve(self, origin_y, origin_x, origin_elevation):
+        return self.solve_sector(origin_y, origin_x, origin_elevation, 0, 1)
+
+    """
+    Calculate the visibility and visual magnitude of the cells of an angular sector around a viewpoint. The sight lines
+    are ordered by their angle and split into sector_count groups of consecutive lines, a cell belongs to the sector
+    whose sight line passes closest to its centre (the first line in the order if several pass equally close). The
+    lines crossing a cell at distance d span about 1 / d radians, so beyond the core distance max_distance /
+    sector_count the closest line is found among a halo of neighbouring lines of the group. The cells within the core
+    distance are crossed by lines of all sectors and belong to the first sector, which follows all sight lines up to
+    the core distance. The results of the sectors add up to the result of solve.
+
+    :param origin_y: y coordinate of the viewpoint
+    :param origin_x: x coordinate of the viewpoint
+    :param origin_elevation: elevation of the viewpoint including the offset
+    :param sector: index of the sector
+    :param sector_count: number of sectors
+
+    :returns: y coordinates, x coordinates and visual magnitudes of the visible cells of the sector
+    """
+
+    def solve_sector(self, origin_y, origin_x, origin_elevation, sector, sector_count):
+        start_time = time.time()
+        spatial = SpatialUtils(origin_y, origin_x, origin_elevation, self.cell_resolution, self.elevation_map,
+                               self.normal_map)
+        top, left, bottom, right = ElevationMap.get_window(origin_y, origin_x, self.elevation_map.shape,
+                                                           self.max_distance)
+        target_y, target_x = SweepEngine.get_border_cells(top, left, bottom, right)
+        # a border passing through the viewpoint has its targets on one line, only the farthest ones are needed
+        on_row = (target_y == origin_y) & (target_x != left) & (target_x != right - 1)
+        on_column = (target_x == origin_x) & (target_y != top) & (target_y != bottom - 1)
+        target_y, target_x = target_y[~(on_row | on_column)], target_x[~(on_row | on_column)]
+        order = np.argsort(np.arctan2(target_y - origin_y, target_x - origin_x), kind="mergesort")
+        target_y, target_x = target_y[order], target_x[order]
+        groups = np.arange(len(target_y)) * sector_count // len(target_y)
+        distance = max(origin_y - top, bottom - 1 - origin_y, origin_x - left, right - 1 - origin_x)
+        core_distance = max(-(-distance // sector_count), 1)
+        halo = 2 * (-(-distance // core_distance) + 2)
+        self.timings["rings"] = time.time() - start_time
+
+        start_time = time.time()
+        visible_cells = [np.empty(0, dtype=np.intp)]
+        solved = 0
+        if sector == 0:
+            cells, visible, owners = self.__sweep_rays(spatial, target_y, target_x, np.arange(len(target_y)),
+                                                       core_distance)
+            visible_cells.append(cells[visible])
+            solved += len(cells)
+        own = np.flatnonzero(groups == sector)
+        if len(own) and distance > core_distance:
+            rays = np.unique(np.arange(own[0] - halo, own[-1] + halo + 1) % len(target_y))
+            cells, visible, owners = self.__sweep_rays(spatial, target_y, target_x, rays)
+            cell_y, cell_x = np.unravel_index(cells, self.elevation_map.shape)
+            owned = (groups[owners] == sector) & (np.maximum(np.abs(cell_y - origin_y), np.abs(cell_x - origin_x))
+                                                  > core_distance)
+            visible_cells.append(cells[owned & visible])
+            solved += np.count_nonzero(owned)
+        visible_y, visible_x = np.unravel_index(np.concatenate(visible_cells), self.elevation_map.shape)
+        visible_y = visible_y.astype(np.intp)
+        visible_x = visible_x.astype(np.intp)
+        self.visible_count = len(visible_y)
+        self.invisible_count = solved - self.visible_count
+        self.timings["los"] = time.time() - start_time
+
+        start_time = time.time()
+        magnitudes = spatial.visual_magnitudes(visible_y, visible_x).astype(self.dtype)
+        self.timings["magnitude"] = time.time() - start_time
+        return visible_y, visible_x, magnitudes
+
+    """
+    Follow the selected sight lines and find the line passing closest to every crossed cell.
+
+    :param spatial: SpatialUtils instance of the viewpoint
+    :param target_y: array of y coordinates of all targets, ordered by their angle
+    :param target_x: array of x coordinates of all targets, ordered by their angle
+    :param rays: indices of the targets of the followed sight lines
+    :param max_steps: (optional) number of steps after which the sight lines are stopped, None to follow them to the
+    targets
+    :returns: flat indices of the crossed cells, their visibility and the indices of the closest sight lines
+    """
+
+    def __sweep_rays(self, spatial, target_y, target_x, rays, max_steps=None):
+        cells = []
+        deviations = []
+        visibility = []
+        owners = []
+        for start in range(0, len(rays), self.ray_block):
+            block = rays[start:start + self.ray_block]
+            ray_cells, ray_deviations, ray_visibility, ray_lines = self.__sweep(spatial, target_y[block],
+                                                                                target_x[block], max_steps)
+            cells.append(ray_cells)
+            deviations.append(ray_deviations)
+            visibility.append(ray_visibility)
+            owners.append(block[ray_lines])
+        cells = np.concatenate(cells)
+        visibility = np.concatenate(visibility)
+        owners = np.concatenate(owners)
+
+        # every cell takes the result of the sight line passing closest to its centre, the deviations are below one
+        order = np.lexsort((owners, cells + np.concatenate(deviations)))
+        cells = cells[order]
+        first = np.ones(len(cells), bool)
+        first[1:] = cells[1:] != cells[:-1]
+        return cells[first], visibility[order[first]], owners[order[first]]
+
+    """
+    Get the cells on the border of a window.
+
+    :param top: first row of the window
+    :param left: first column of the window
+    :param bottom: row after the last row of the window
+    :param right: column after the last column of the window
+    :returns: y and x index arrays of the border cells
+    """
+
+    @staticmethod
+    def get_border_cells(top, left, bottom, right):
+        window_y, window_x = np.mgrid[top:bottom, left:right]
+        border = (window_y == top) | (window_y == bottom - 1) | (window_x == left) | (window_x == right - 1)
+        return window_y[border], window_x[border]
+
+    """
+    Follow the sight lines from the viewpoint to the target cells. The sight lines advance by one cell along their
+    major axis in every step, the lines with the major x axis are followed on the transposed map.
+
+    :param spatial: SpatialUtils instance of the viewpoint
+    :param target_y: array of y coordinates of the targets
+    :param target_x: array of x coordinates of the targets
+    :param max_steps: (optional) number of steps after which the sight lines are stopped, None to follow them to the
+    targets
+    :returns: flat indices of the cells crossed by the sight lines, distances of the sight lines from the cell centres,
+    visibility of the cells and indices of the targets of the sight lines
+    """
+
+    def __sweep(self, spatial, target_y, target_x, max_steps=None):
+        distance_y = np.abs(target_y - spatial.origin_y)
+        distance_x = np.abs(target_x - spatial.origin_x)
+        # the viewpoint itself lies on the border if the window has a single row or column
+        y_major = (distance_y >= distance_x) & (distance_y > 0)
+        x_major = distance_x > distance_y
+        cells = []
+        deviations = []
+        visibility = []
+        lines = []
+        for major, minor, targets, transposed in ((target_y[y_major], target_x[y_major], np.flatnonzero(y_major),
+                                                   False),
+                                                  (target_x[x_major], target_y[x_major], np.flatnonzero(x_major),
+                                                   True)):
+            if not len(major):
+                continue
+            cell_major, cell_minor, line_deviations, line_visibility, line_index = self.__sweep_lines(
+                spatial, major, minor, transposed, max_steps)
+            if transposed:
+                cell_major, cell_minor = cell_minor, cell_major
+            cells.append(np.ravel_multi_index((cell_major, cell_minor), self.elevation_map.shape))
+            deviations.append(line_deviations)
+            visibility.append(line_visibility)
+            lines.append(targets[line_index])
+        if not cells:
+            return np.empty(0, dtype=np.intp), np.empty(0), np.empty(0, dtype=bool), np.empty(0, dtype=np.intp)
+        return np.concatenate(cells), np.concatenate(deviations), np.concatenate(visibility), np.concatenate(lines)
+
+    """
+    Follow the sight lines whose major axis is the y axis of the map (or the x axis if the map is transposed).
+
+    :param spatial: SpatialUtils instance of the viewpoint
+    :param target_major: array of coordinates of the targets along the major axis
+    :param target_minor: array of coordinates of the targets along the minor axis
+    :param transposed: True if the major axis is the x axis of the map
+    :param max_steps: (optional) number of steps after which the sight lines are stopped, None to follow them to the
+    targets
+    :returns: major and minor coordinates of the cells crossed by the sight lines, distances of the sight lines from
+    the cell centres, visibility of the cells and indices of the sight lines
+    """
+
+    def __sweep_lines(self, spatial, target_major, target_minor, transposed, max_steps=None):
+        elevation_map = self.elevation_map.T if transposed else self.elevation_map
+        origin_major, origin_minor = (spatial.origin_x, spatial.origin_y) if transposed \
+            else (spatial.origin_y, spatial.origin_x)
+        delta_major = target_major - origin_major
+        steps = np.abs(delta_major)
+        step = np.arange(1, (steps.max() if max_steps is None else min(steps.max(), max_steps)) + 1)
+        valid = step <= steps[:, np.newaxis]
+        step = np.minimum(step, steps[:, np.newaxis])
+
+        # positions of the sight lines after every step, the steps beyond the targets stay on the targets
+        point_major = origin_major + np.sign(delta_major)[:, np.newaxis] * step
+        point_minor = origin_minor + step * ((target_minor - origin_minor) / steps.astype("d"))[:, np.newaxis]
+        lower = np.floor(point_minor)
+        fraction = point_minor - lower
+        lower = lower.astype(np.intp)
+        upper = np.minimum(lower + 1, elevation_map.shape[1] - 1)
+        lower_elevation = elevation_map[point_major, lower]
+        elevation = lower_elevation + fraction * (elevation_map[point_major, upper] - lower_elevation)
+
+        # horizon of the sight line before every step, the omitted rings and the steps beyond the target do not count
+        point_y, point_x = (point_minor, point_major) if transposed else (point_major, point_minor)
+        slopes = spatial.get_viewing_slopes(point_y, point_x, elevation).astype(self.dtype)
+        counted = valid & (step > self.omitted_distance)
+        slopes[~counted] = -np.inf
+        horizon = np.empty_like(slopes)
+        horizon[:, 0] = -np.inf
+        np.maximum.accumulate(slopes[:, :-1], axis=1, out=horizon[:, 1:])
+
+        cell_major = point_major[counted]
+        cell_minor = np.rint(point_minor[counted]).astype(np.intp)
+        deviations = np.abs(point_minor[counted] - cell_minor)
+        cell_y, cell_x = (cell_minor, cell_major) if transposed else (cell_major, cell_minor)
+        visibility = spatial.get_viewing_slopes(cell_y, cell_x) >= horizon[counted]
+        return cell_major, cell_minor, deviations, visibility, np.nonzero(counted)[0]